@@ -1,12 +1,14 @@
 import random
 import traceback
 from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+from augmentoolkit.generation_functions.llamacpp_client import close_shared_session
+from augmentoolkit.generation_functions.worker_pool import run_pool
 from augmentoolkit.utils.write_output_to_file import write_output_to_file
-from BOILERPLATE_TO_MAKE_YOUR_OWN_PIPELINE.steps import API_KEY_A, API_KEY_B, BASE_URL_A, BASE_URL_B, CONCURRENCY_LIMIT, LOGICAL_MODEL_A, LOGICAL_MODEL_B, MODE_A, MODE_B, add_key, chunking_algorithm, count_tokens, make_id
+from BOILERPLATE_TO_MAKE_YOUR_OWN_PIPELINE.steps import API_KEY_A, API_KEY_B, BASE_URL_A, BASE_URL_B, CONCURRENCY_LIMIT, MAX_CONCURRENCY_LIMIT, ENDPOINT_WEIGHTS_A, ENDPOINT_WEIGHTS_B, LOGICAL_MODEL_A, LOGICAL_MODEL_B, MODE_A, MODE_B, REQUESTS_PER_MINUTE_A, REQUESTS_PER_MINUTE_B, TOKENS_PER_MINUTE_A, TOKENS_PER_MINUTE_B, add_key, chunking_algorithm, count_tokens, make_id
 
 
 import nltk
-from tqdm import asyncio as tqdmasyncio
+from tqdm import tqdm
 
 
 import asyncio
@@ -27,6 +29,8 @@ USE_SUBSET = bool(config["SYSTEM"]["USE_SUBSET"])
 SUBSET_SIZE = int(config["SYSTEM"]["SUBSET_SIZE"])
 CHUNK_SIZE = int(config["SYSTEM"]["CHUNK_SIZE"])
 INPUT = config["PATH"]["INPUT"]
+USE_STREAMING = bool(config["SYSTEM"].get("USE_STREAMING", True))
+HEDGE_PERCENTILE = float(config["SYSTEM"].get("HEDGE_PERCENTILE", 0)) or None
 
 
 async def main():
@@ -36,12 +40,6 @@ async def main():
     start_time = time.time()
     print("Begun")
 
-    # Set up rate-limit-conscious functions
-    semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    async def run_task_with_limit(task):
-        async with semaphore:
-            return await task
-
     extensions = [".txt", ".md"]
 
     source_texts = []
@@ -60,6 +58,13 @@ async def main():
         api_key=API_KEY_A,
         base_url=BASE_URL_A,
         mode=MODE_A,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE_A,
+        tokens_per_minute=TOKENS_PER_MINUTE_A,
+        endpoint_weights=ENDPOINT_WEIGHTS_A,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
     )
 
     engine_wrapper_large = EngineWrapper(
@@ -67,22 +72,41 @@ async def main():
         api_key=API_KEY_B,
         base_url=BASE_URL_B,
         mode=MODE_B,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE_B,
+        tokens_per_minute=TOKENS_PER_MINUTE_B,
+        endpoint_weights=ENDPOINT_WEIGHTS_B,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
     )
 
     # any HF path to a transformer model will do, as long as it has a tokenizer
 
-    sentence_chunks = []
-    for source_text in source_texts:
-        sentence_chunks += chunking_algorithm(source_text, max_token_length=CHUNK_SIZE)
+    def read_chunks(): # chunks are made as they're needed, so only one source text is in memory at a time
+        for source_text in source_texts:
+            yield from chunking_algorithm(source_text, max_token_length=CHUNK_SIZE)
 
     # NOTE Generate the data
+    # The engine wrappers decide how many requests are actually in flight; a fixed pool of workers pulls chunks one at a time, so only MAX_CONCURRENCY_LIMIT tasks exist at once however big the input is
     output_list = []
-    data_generations_tasks = [add_key(input_data=chunk, engine_wrapper=engine_wrapper_large, idx=idx, output_list=output_list) for idx, chunk in enumerate(sentence_chunks)]
-    coroutines = [run_task_with_limit(task) for task in data_generations_tasks]
-    for future in tqdmasyncio.tqdm.as_completed(coroutines):
-        await future
+    async def generate_data(item):
+        idx, chunk = item
+        await add_key(input_data=chunk, engine_wrapper=engine_wrapper_large, idx=idx, output_list=output_list)
+    with tqdm() as progress_bar:
+        await run_pool(generate_data, enumerate(read_chunks()), MAX_CONCURRENCY_LIMIT, progress_bar=progress_bar)
 
     print(f"Time taken: {time.time() - start_time}")
+    for server, limiter in EngineWrapper.shared_concurrency_limiters.items():
+        print(f"Concurrency stats for {server}: {limiter.stats()}")
+    for (server, model), limiter in EngineWrapper.shared_rate_limiters.items():
+        print(f"Rate limit stats for {model} at {server}: {limiter.stats()}")
+    if len(engine_wrapper.endpoint_pool) > 1 or len(engine_wrapper_large.endpoint_pool) > 1:
+        print(f"Endpoint stats: {engine_wrapper.endpoint_pool.stats()} {engine_wrapper_large.endpoint_pool.stats()}")
+    for wrapper in (engine_wrapper, engine_wrapper_large):
+        if wrapper.latency_tracker:
+            print(f"Hedging stats for {wrapper.model}: {wrapper.latency_tracker.stats()}")
+    await close_shared_session()  # only does anything if a llamacpp mode was used
     print("You generated some data! Check the output folder for the results.")
     print("here's one of the results: ")
     print(output_list[0])
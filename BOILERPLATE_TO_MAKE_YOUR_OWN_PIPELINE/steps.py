@@ -15,6 +15,7 @@ import logging
 from math import ceil
 import traceback
 from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
+from augmentoolkit.utils.write_output_to_file import write_output_to_file # the shared one handles chat-mode Transcripts as well as strings
 import uuid
 import yaml
 import nltk
@@ -46,9 +47,18 @@ API_KEY_A = obj_conf["API"]["API_KEY_A"]
 API_KEY_B = obj_conf["API"]["API_KEY_B"]
 BASE_URL_A = obj_conf["API"]["BASE_URL_A"]
 BASE_URL_B = obj_conf["API"]["BASE_URL_B"]
+# Optional provider quotas, 0 means no limit. Requests wait for budget instead of getting rate limited
+REQUESTS_PER_MINUTE_A = int(obj_conf["API"].get("REQUESTS_PER_MINUTE_A", 0)) or None
+TOKENS_PER_MINUTE_A = int(obj_conf["API"].get("TOKENS_PER_MINUTE_A", 0)) or None
+REQUESTS_PER_MINUTE_B = int(obj_conf["API"].get("REQUESTS_PER_MINUTE_B", 0)) or None
+TOKENS_PER_MINUTE_B = int(obj_conf["API"].get("TOKENS_PER_MINUTE_B", 0)) or None
+# BASE_URL_A/B (and API_KEY_A/B) can be lists of identical servers to load balance across; optional relative capacity of each
+ENDPOINT_WEIGHTS_A = obj_conf["API"].get("ENDPOINT_WEIGHTS_A")
+ENDPOINT_WEIGHTS_B = obj_conf["API"].get("ENDPOINT_WEIGHTS_B")
 MODE_A = obj_conf["API"]["MODE_A"]
 MODE_B = obj_conf["API"]["MODE_B"]
 CONCURRENCY_LIMIT = int(obj_conf["SYSTEM"]["CONCURRENCY_LIMIT"])
+MAX_CONCURRENCY_LIMIT = int(obj_conf["SYSTEM"].get("MAX_CONCURRENCY_LIMIT", CONCURRENCY_LIMIT * 4)) # the adaptive limiter starts at CONCURRENCY_LIMIT and can grow up to this while the API keeps up
 USE_STOP = parse_bool(obj_conf["SYSTEM"]["STOP"])
 USE_MIN_P = parse_bool(obj_conf["SYSTEM"]["USE_MIN_P"])
 
@@ -112,22 +122,6 @@ def chunking_algorithm(file_path, max_token_length=1500):
 def make_id():
     return str(uuid.uuid4())
 
-# Also used basically everywhere:
-def write_output_to_file(output, directory, uuid):
-    # Ensure directory exists
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    # Define the file path using the directory and UUID
-    file_path = os.path.join(directory, f"{uuid}.txt")
-
-    # Write the output to the file
-    with open(file_path, "w") as file:
-        file.write(output)
-
-    print(f"Output written to {file_path}")
-    
-
 # A pipeline step to get you started
 
 def validate_output(output, input_data): # some random validation function
@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import math
+import time
+
+from augmentoolkit.generation_functions.request_errors import CONGESTION_FAILURES
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    An asyncio semaphore whose size changes with how the server is coping (AIMD, like TCP congestion control).
+
+    While requests succeed and latency stays near the best we've seen, the limit grows by about one slot per
+    "window" of limit-many successful requests. On a 429, 5xx, timeout or dropped connection the limit is
+    multiplied by decrease_factor, at most once per cooldown_seconds so that a burst of errors from requests that
+    were all sent at the old limit only counts once.
+    """
+
+    def __init__(
+        self,
+        initial_limit,
+        min_limit=1,
+        max_limit=None,
+        increase_step=1,
+        decrease_factor=0.5,
+        latency_tolerance=2.0,  # latency this many times worse than the best seen counts as congestion
+        cooldown_seconds=5.0,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit if max_limit is not None else initial_limit * 4
+        self._limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown_seconds = cooldown_seconds
+
+        self._in_flight = 0
+        self._waiters = collections.deque()
+        self._last_decrease = {}  # reason -> time of the last decrease for that reason
+        self.latency_ewma = None  # seconds per character of output, smoothed
+        self.latency_baseline = None
+        self.successes = 0
+        self.failures = collections.Counter()
+
+    @property
+    def limit(self):
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def queue_depth(self):
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self):
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()  # cancelled waiters
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # We were handed a slot right as we got cancelled; give it back
+                self.release()
+            raise
+
+    def release(self):
+        self._in_flight -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._in_flight += 1
+                waiter.set_result(True)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def record_success(self, latency, output_size=1):
+        self.successes += 1
+        normalized_latency = latency / max(output_size, 1)
+        if self.latency_ewma is None:
+            self.latency_ewma = normalized_latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * normalized_latency
+        if self.latency_baseline is None or self.latency_ewma < self.latency_baseline:
+            self.latency_baseline = self.latency_ewma
+
+        if self.latency_ewma > self.latency_baseline * self.latency_tolerance:
+            self._decrease(0.9, "latency")  # latency is degrading; ease off gently before the server starts erroring
+            return
+
+        # Only grow if we're actually using the slots we already have
+        if self._in_flight >= self.limit or self._waiters:
+            self._limit = min(self.max_limit, self._limit + self.increase_step / self._limit)
+            self._wake_waiters()
+
+    def record_failure(self, kind):
+        self.failures[kind] += 1
+        if kind in CONGESTION_FAILURES:
+            self._decrease(self.decrease_factor, "failure")
+
+    def _decrease(self, factor, reason):
+        now = time.monotonic()
+        if now - self._last_decrease.get(reason, -math.inf) < self.cooldown_seconds:
+            return
+        self._last_decrease[reason] = now
+        self._limit = max(self.min_limit, self._limit * factor)
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "successes": self.successes,
+            "failures": dict(self.failures),
+        }
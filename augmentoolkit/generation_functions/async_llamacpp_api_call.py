@@ -1,6 +1,7 @@
 import aiohttp
 import asyncio
 import json
+from augmentoolkit.generation_functions.llamacpp_client import get_shared_session
 
 
 async def make_async_api_call(
@@ -23,20 +24,20 @@ async def make_async_api_call(
     # Complete the URL with the chosen endpoint
     full_url = url + endpoint
 
-    # Use aiohttp to make the async request
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            full_url, data=data, headers={"Content-Type": "application/json"}, ssl=False
-        ) as response:
-            if response.status == 200:
-                # Parse the JSON response
-                response_json = await response.json()
-                if prompt:
-                    return prompt + response_json["content"]
-                else:
-                    return response_json["choices"][0]["content"]
+    # Use aiohttp to make the async request, reusing the process-wide keep-alive session
+    session = get_shared_session()
+    async with session.post(
+        full_url, data=data, headers={"Content-Type": "application/json"}, ssl=False
+    ) as response:
+        if response.status == 200:
+            # Parse the JSON response
+            response_json = await response.json()
+            if prompt:
+                return prompt + response_json["content"]
             else:
-                return {"error": f"API call failed with status code: {response.status}"}
+                return response_json["choices"][0]["content"]
+        else:
+            return {"error": f"API call failed with status code: {response.status}"}
 
 
 # Example usage for completion
@@ -0,0 +1,149 @@
+import asyncio
+import itertools
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+_DONE = object()
+
+
+class PriorityLimiter:
+    """
+    A semaphore that lets waiters in highest priority first (and first come, first served within a priority).
+    Waiters can also name a step and a share class: a step can have its own cap on slots (waiters of a step that's at its cap wait without blocking anyone else),
+    and share classes split the slots by weight -- a freed slot goes to whichever class with someone waiting is using the least of its share, before priority is looked at.
+    """
+
+    def __init__(self, limit, step_limits=None, share_weights=None):
+        self.limit = limit
+        self.step_limits = step_limits or {}  # step -> max slots it can hold at once
+        self.share_weights = share_weights or {}  # share class -> weight; classes not listed weigh 1
+        self.in_use = 0
+        self.in_use_by_step = Counter()
+        self.in_use_by_share = Counter()
+        self.lanes = {}  # (step, share, priority) -> deque of (arrival order, future)
+        self.order = itertools.count()
+
+    async def acquire(self, priority=0, step=None, share=None):
+        future = asyncio.get_running_loop().create_future()
+        self.lanes.setdefault((step, share, priority), deque()).append((next(self.order), future))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(step, share)  # we were handed a slot but were cancelled before we could use it
+            raise
+
+    def dispatch(self):
+        # Hand free slots to the best waiters: least-served share class, then highest priority, then first come
+        while self.in_use < self.limit:
+            best = None
+            for lane, waiters in self.lanes.items():
+                while waiters and waiters[0][1].done():  # cancelled waiters are skipped
+                    waiters.popleft()
+                step, share, priority = lane
+                if not waiters or self.in_use_by_step[step] >= self.step_limits.get(step, self.limit):
+                    continue
+                key = (self.in_use_by_share[share] / self.share_weights.get(share, 1), -priority, waiters[0][0])
+                if best is None or key < best[0]:
+                    best = (key, lane)
+            if best is None:
+                return
+            step, share, _ = best[1]
+            _, future = self.lanes[best[1]].popleft()
+            self.in_use += 1
+            self.in_use_by_step[step] += 1
+            self.in_use_by_share[share] += 1
+            future.set_result(None)
+
+    def release(self, step=None, share=None):
+        self.in_use -= 1
+        self.in_use_by_step[step] -= 1
+        self.in_use_by_share[share] -= 1
+        self.dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority=0, step=None, share=None):
+        await self.acquire(priority, step, share)
+        try:
+            yield
+        finally:
+            self.release(step, share)
+
+
+class DAGScheduler:
+    """
+    Runs items through a graph of steps, handing each item to the next step(s) as soon as it's through the previous one, instead of making every item wait for the slowest one at each phase.
+    Steps take one item and return a list of items for the steps after them (an empty list, or None, drops the item).
+    All steps share one concurrency budget, and a step's priority is its depth in the graph: work on items that are further along gets slots first, so finished data shows up early and a run that's stopped partway has complete items to show for it.
+    Steps should wrap each request-making call in `async with scheduler.limit(step_name):` -- slots are held per call, so a step can fan out (e.g. vet all of a paragraph's questions) without deadlocking on the budget.
+    A step can be given a max_concurrency of its own, and a share class (e.g. which model it uses): with share_weights set, classes with work waiting split the budget by weight,
+    so one slow step on one server can't sit on every slot while the other server's steps queue behind it.
+    With stop_after set, items aren't passed on past that step.
+    """
+
+    def __init__(self, concurrency_limit, stop_after=None, share_weights=None, max_pending=None):
+        self.limiter = PriorityLimiter(concurrency_limit, share_weights=share_weights)
+        self.max_pending = max_pending or 4 * concurrency_limit  # enough queued work to keep every slot busy
+        self.stop_after = stop_after
+        self.steps = {}  # name -> {"function", "successors", "priority", "share"}
+        self.roots = []
+        self.results = {}  # name of a last step (or stop_after) -> the items it returned
+        self.completed = Counter()  # name -> items through that step so far
+
+    def add_step(self, name, function, after=None, share=None, max_concurrency=None):
+        priority = 0 if after is None else self.steps[after]["priority"] + 1
+        self.steps[name] = {"function": function, "successors": [], "priority": priority, "share": share}
+        if max_concurrency:
+            self.limiter.step_limits[name] = max_concurrency
+        if after is None:
+            self.roots.append(name)
+        else:
+            self.steps[after]["successors"].append(name)
+
+    def limit(self, name):
+        step = self.steps[name]
+        return self.limiter.slot(step["priority"], name, step["share"])
+
+    async def run_step(self, name, item, schedule):
+        step = self.steps[name]
+        outputs = await step["function"](item) or []
+        self.completed[name] += 1
+        successors = [] if name == self.stop_after else step["successors"]
+        if not successors:
+            self.results.setdefault(name, []).extend(outputs)
+        for output in outputs:
+            for successor in successors:
+                schedule(successor, output)
+
+    async def run(self, items):
+        # items can be a generator: new items are only pulled in while fewer than max_pending tasks are waiting or running, so a huge input isn't turned into a task per item up front
+        tasks = set()
+        items = iter(items)
+
+        def schedule(name, item):
+            tasks.add(asyncio.ensure_future(self.run_step(name, item, schedule)))
+
+        def top_up():
+            while len(tasks) < self.max_pending:
+                item = next(items, _DONE)
+                if item is _DONE:
+                    return
+                for root in self.roots:
+                    schedule(root, item)
+
+        top_up()
+        try:
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                tasks.difference_update(done)
+                for task in done:
+                    task.result()  # a step that raised stops the run, same as an exception in a phase would
+                top_up()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.results
+
+    def stats(self):
+        return dict(self.completed)
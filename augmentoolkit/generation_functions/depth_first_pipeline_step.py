@@ -0,0 +1,52 @@
+import json
+
+from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
+from augmentoolkit.utils.make_id import make_id
+from augmentoolkit.utils.write_output_to_file import write_output_to_file
+
+
+class DepthFirstPipelineStep(PipelineStep): # RPTOOLKIT is depth-first rather than breadth-first, so it is easiest to build these steps out using a different class of pipeline step that is focused on returning rather than appending to an output list
+    def read_previous_output(self, idx):
+        save_path_file = super().make_save_path_file(idx)
+        content = self.store.read(save_path_file)
+        if content is not None:
+            try:
+                return json.loads(content)
+            except json.JSONDecodeError:
+                print(f"Could not parse {save_path_file}; generating it again")
+        return False
+    
+    def save(self, result=None,
+    full_output=None,
+    idx=None,
+    input_data=None,):
+        
+        if result:
+            id = make_id()
+            save_path_file = super().make_save_path_file(idx)
+            
+            output_data = input_data
+            output_data[self.result_key] = result
+            write_output_to_file(full_output, self.intermediate_output_path_full, id, extension=".txt") # the shared helper, which knows how to save chat-mode Transcripts; completion-mode outputs keep RPToolkit's .txt, as before
+            
+            self.store.write(save_path_file, json.dumps(output_data, ensure_ascii=False))
+            
+            return output_data
+    
+    async def run(self, idx=None,
+    input_data=None,
+    engine_wrapper=None,
+      ): # things that are args here are produced during inference time. Including config settings.
+        
+        read_previous_item = self.read_previous_output(idx)
+        if read_previous_item:
+            return read_previous_item
+        
+        processed_data = super().process_input_data(input_data)
+        
+        generated = await self.generate_with_retries(processed_data, input_data, engine_wrapper) # validation failures use up tries too, so an output that keeps failing validation can't loop forever
+        if generated is None: # consider raising here and catching in the actual pipeline.
+            return
+        result, full_output = generated
+        
+        return self.save(result=result, full_output=full_output, idx=idx, input_data=input_data)
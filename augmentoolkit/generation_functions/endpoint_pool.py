@@ -0,0 +1,116 @@
+import random
+import time
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an endpoint after failure_threshold failures in a row.
+    After reset_seconds one trial request is let through; if it works the endpoint is back in rotation, if not it's ejected again.
+    """
+
+    def __init__(self, failure_threshold=3, reset_seconds=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.times_opened = 0
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allows_request(self):
+        if self.opened_at is None:
+            return True
+        if self.trial_in_progress:
+            return False
+        return time.monotonic() - self.opened_at >= self.reset_seconds
+
+    def start_request(self):
+        if self.opened_at is not None:
+            self.trial_in_progress = True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+
+    def record_cancelled(self):
+        # e.g. the losing half of a hedged request; tells us nothing about whether the endpoint works
+        self.trial_in_progress = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.trial_in_progress or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.trial_in_progress = False
+
+
+class Endpoint:
+    # One replica: its own client, and its own rate/concurrency limiters since each server has its own capacity
+    def __init__(self, base_url, client, weight=1.0, concurrency_limiter=None, rate_limiter=None, breaker=None):
+        self.base_url = base_url
+        self.client = client
+        self.weight = float(weight)
+        self.concurrency_limiter = concurrency_limiter
+        self.rate_limiter = rate_limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+
+
+class EndpointPool:
+    """
+    Routes each request to the healthy endpoint with the fewest outstanding requests relative to its weight.
+    If every endpoint's circuit breaker is open we still have to send the request somewhere, so it goes to whichever endpoint was ejected longest ago.
+    """
+
+    def __init__(self, endpoints):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = endpoints
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def pick(self, exclude=()):
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+        healthy = [endpoint for endpoint in candidates if endpoint.breaker.allows_request()]
+        if not healthy:
+            return min(candidates, key=lambda endpoint: endpoint.breaker.opened_at)
+        best_load = min((endpoint.outstanding + 1) / endpoint.weight for endpoint in healthy)
+        # Break ties randomly so that a burst of requests at startup doesn't all land on the first replica
+        return random.choice(
+            [endpoint for endpoint in healthy if (endpoint.outstanding + 1) / endpoint.weight == best_load]
+        )
+
+    def start_request(self, endpoint):
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        endpoint.breaker.start_request()
+
+    def finish_request(self, endpoint, succeeded):
+        endpoint.outstanding -= 1
+        if succeeded is None:
+            endpoint.breaker.record_cancelled()
+        elif succeeded:
+            endpoint.breaker.record_success()
+        else:
+            endpoint.failures += 1
+            endpoint.breaker.record_failure()
+
+    def stats(self):
+        return {
+            endpoint.base_url: {
+                "requests": endpoint.requests,
+                "failures": endpoint.failures,
+                "outstanding": endpoint.outstanding,
+                "ejected": endpoint.breaker.is_open,
+                "times_ejected": endpoint.breaker.times_opened,
+            }
+            for endpoint in self.endpoints
+        }
@@ -1,32 +1,341 @@
 import asyncio
+import contextlib
+import functools
+import time
 import uuid
+from collections import Counter
 from openai import AsyncOpenAI
 import cohere
 from httpx import Timeout
+from augmentoolkit.generation_functions.adaptive_concurrency import AdaptiveConcurrencyLimiter
+from augmentoolkit.generation_functions.endpoint_pool import CircuitBreaker, Endpoint, EndpointPool
+from augmentoolkit.generation_functions.hedging import StepLatencyTracker
+from augmentoolkit.generation_functions.llamacpp_client import LlamaCppClient
+from augmentoolkit.generation_functions.rate_limiter import RateLimiter, estimate_tokens
+from augmentoolkit.generation_functions.request_metrics import RequestMetrics, estimate_prompt_tokens
+from augmentoolkit.generation_functions.request_errors import StreamValidationError, classify_exception, retry_after_seconds
+from augmentoolkit.generation_functions.response_cache import make_cache_key
+from augmentoolkit.generation_functions.stream_monitor import read_stream
 
 def make_id():
     return str(uuid.uuid4())
 
 
+# The text in one chunk of each backend's stream, for read_stream
+def openai_completion_piece(chunk):
+    return chunk.choices[0].text
+
+
+def openai_chat_piece(chunk):
+    return chunk.choices[0].delta.content
+
+
+def llamacpp_completion_piece(event):  # llama.cpp's native /completion sends {"content": ..., "stop": ...}
+    return event.get("content")
+
+
+def llamacpp_chat_piece(event):  # OpenAI-style, but as plain dicts; the last event can have no choices, or a delta without content
+    choices = event.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def cohere_chat_piece(event):  # only text-generation events have text; stream-start/stream-end and the rest don't
+    return event.text if event.event_type == "text-generation" else None
+
+
 class EngineWrapper:
+    # One concurrency governor per server, so that wrappers pointed at the same base_url (e.g. small and large models served by the same provider) back off together
+    shared_concurrency_limiters = {}
+    # Provider quotas (RPM/TPM) are usually per model, so these are shared per (base_url, model)
+    shared_rate_limiters = {}
+    # Whether a server is up doesn't depend on which model we asked it for
+    shared_circuit_breakers = {}
+    # Caps on in-flight requests per step (by step_name, the names in the metrics table), across every wrapper, so one slow step can't take all of a server's slots
+    step_limiters = {}
+
     def __init__(
         self,
         model,
-        api_key=None,
-        base_url=None,
-        mode="api",  # can be one of api, aphrodite, llama.cpp, cohere
+        api_key=None,  # a list (one per base_url) if the replicas need different keys
+        base_url=None,  # can be a list of identical servers; requests are load balanced across them and fail over between them
+        mode="api",  # can be one of api, aphrodite, llamacpp, cohere
         quantization="gptq",  # only needed if using aphrodite mode
+        cache=None,  # optional ResponseCache; identical requests are answered from disk instead of the API
+        concurrency_limit=None,  # starting number of in-flight requests per server; grows/shrinks with server health. None means unlimited
+        max_concurrency_limit=None,  # ceiling for the adaptive limit; defaults to 4x concurrency_limit
+        requests_per_minute=None,  # provider quotas; requests wait for budget instead of getting 429'd. None means unlimited
+        tokens_per_minute=None,
+        rate_limit_retries=3,  # 429s that still get through are retried here (after waiting) rather than failing the step
+        endpoint_weights=None,  # relative capacity of each base_url, e.g. [2, 1] if the first server is twice as fast
+        stream=True,  # False asks for the whole response at once; we never use partial output, so on some servers this is just less overhead
+        hedge_percentile=None,  # e.g. 0.95: a request slower than 95% of its step's recent requests gets a duplicate sent, and whichever finishes first is used. None turns hedging off
+        hedge_to_other_endpoint=True,  # send the duplicate to a different base_url if there is one
+        cache_prompt=True,  # llamacpp mode only: let the server reuse the KV cache of the shared prefix of our prompts
+        llamacpp_slot=None,  # llamacpp mode only: pin requests to one server slot. None lets the server pick the slot with the most similar cached prompt
+        recorder=None,  # optional RequestRecorder; every request/response pair is logged so the run can be replayed offline
+        metrics_log=None,  # optional MetricsLog; gets queue wait, time to first token, latency, token counts and retries for every request, by step
     ):
         self.mode = mode
         self.model = model
-        if mode == "cohere":
-            self.client = cohere.AsyncClient(api_key=api_key)
-        elif mode == "api":
-            self.client = AsyncOpenAI(timeout=Timeout(timeout=5000.0, connect=10.0), api_key=api_key, base_url=base_url)
+        base_urls = base_url if isinstance(base_url, (list, tuple)) else [base_url]
+        api_keys = api_key if isinstance(api_key, (list, tuple)) else [api_key] * len(base_urls)
+        weights = endpoint_weights or [1] * len(base_urls)
+        if len(api_keys) != len(base_urls) or len(weights) != len(base_urls):
+            raise ValueError("api_key and endpoint_weights must have one entry per base_url")
+        self.base_url = base_urls[0]  # replicas are interchangeable, so the first one stands in for all of them in cache keys
+        self.cache = cache
+        self.request_occurrences = Counter()  # how many times each identical request has been made this run
+        self.rate_limit_retries = rate_limit_retries
+        self.stream = stream
+        self.latency_tracker = StepLatencyTracker(hedge_percentile) if hedge_percentile else None
+        self.hedge_to_other_endpoint = hedge_to_other_endpoint
+        self.recorder = recorder
+        self.metrics_log = metrics_log
+
+        endpoints = []
+        for url, key, weight in zip(base_urls, api_keys, weights):
+            server = url if mode != "cohere" else "cohere"
+            if mode == "cohere":
+                client = cohere.AsyncClient(api_key=key)
+            elif mode == "api":
+                client = AsyncOpenAI(timeout=Timeout(timeout=5000.0, connect=10.0), api_key=key, base_url=url)
+            elif mode == "llamacpp":
+                client = LlamaCppClient(url, api_key=key, cache_prompt=cache_prompt, id_slot=llamacpp_slot)
+            else:
+                client = None
+            concurrency_limiter = None
+            if concurrency_limit is not None:
+                concurrency_limiter = self.get_shared_concurrency_limiter(server, concurrency_limit, max_concurrency_limit)
+            rate_limiter = None
+            if requests_per_minute or tokens_per_minute:
+                rate_limiter = self.get_shared_rate_limiter((server, model), requests_per_minute, tokens_per_minute)
+            if server not in self.shared_circuit_breakers:
+                self.shared_circuit_breakers[server] = CircuitBreaker()
+            endpoints.append(
+                Endpoint(
+                    server,
+                    client,
+                    weight=weight,
+                    concurrency_limiter=concurrency_limiter,
+                    rate_limiter=rate_limiter,
+                    breaker=self.shared_circuit_breakers[server],
+                )
+            )
+        self.endpoint_pool = EndpointPool(endpoints)
+
+    @classmethod
+    def get_shared_concurrency_limiter(cls, server, concurrency_limit, max_concurrency_limit=None):
+        if server not in cls.shared_concurrency_limiters:
+            cls.shared_concurrency_limiters[server] = AdaptiveConcurrencyLimiter(
+                initial_limit=concurrency_limit, max_limit=max_concurrency_limit
+            )
+        return cls.shared_concurrency_limiters[server]
+
+    @classmethod
+    def get_shared_rate_limiter(cls, endpoint, requests_per_minute, tokens_per_minute):
+        if endpoint not in cls.shared_rate_limiters:
+            cls.shared_rate_limiters[endpoint] = RateLimiter(
+                requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute
+            )
+        return cls.shared_rate_limiters[endpoint]
+
+    @classmethod
+    def set_step_concurrency_limits(cls, limits):
+        cls.step_limiters = {step: asyncio.Semaphore(int(limit)) for step, limit in (limits or {}).items() if limit and int(limit) > 0}
+
+    def cache_key_for(self, kind, prompt_or_messages, sampling_params):
+        if not self.cache:
+            return None
+        # Repeating an identical request (a retry, or another vote in a validation loop) is expected to produce a new sample,
+        # so the Nth identical request of a run maps to the Nth cached response rather than replaying the first one forever.
+        request_fingerprint = make_cache_key(
+            kind=kind,
+            model=self.model,
+            base_url=self.base_url,
+            input=prompt_or_messages,
+            sampling_params=sampling_params,
+        )
+        attempt = self.request_occurrences[request_fingerprint]
+        self.request_occurrences[request_fingerprint] += 1
+        return make_cache_key(request=request_fingerprint, attempt=attempt)
+
+    async def run_request(self, kind, stream_function, prompt_or_messages, sampling_params, step_name):
+        # Sends a request that wasn't in the cache, and records how it went
+        metrics = None
+        if self.metrics_log:
+            metrics = RequestMetrics(step_name, self.model, kind, estimate_prompt_tokens(prompt_or_messages))
+            stream_function = functools.partial(stream_function, metrics=metrics)  # the stream notes when the first token arrives
+        step_limiter = self.step_limiters.get(step_name) or contextlib.nullcontext()
+        queued_at = time.monotonic()
+        try:
+            async with step_limiter:
+                if metrics is not None:
+                    metrics.add_queue_wait(queued_at)
+                start_time = time.monotonic()
+                completion, timed_out = await self.run_hedged(stream_function, prompt_or_messages, sampling_params, step_name, metrics)
+        except Exception as e:
+            if metrics is not None:
+                self.metrics_log.record(metrics.finish(getattr(e, "partial_output", ""), failure=classify_exception(e)))
+            raise
+        if metrics is not None:
+            self.metrics_log.record(metrics.finish(completion, timed_out=timed_out))
+        if self.recorder:
+            self.recorder.record(kind, self.model, prompt_or_messages, sampling_params, completion, time.monotonic() - start_time, step_name)
+        return completion, timed_out
+
+    def record_cached(self, kind, prompt_or_messages, sampling_params, cached, step_name):
+        if self.metrics_log:
+            metrics = RequestMetrics(step_name, self.model, kind, estimate_prompt_tokens(prompt_or_messages))
+            self.metrics_log.record(metrics.finish(cached, cached=True))
+        if self.recorder:  # so that a recording made on a resumed run is still complete
+            self.recorder.record(kind, self.model, prompt_or_messages, sampling_params, cached, 0.0, step_name)
+
+    async def run_hedged(self, stream_function, prompt_or_messages, sampling_params, step_name, metrics=None):
+        # If the request takes longer than most of this step's requests do, send a duplicate and use whichever answer comes back first
+        tracker = self.latency_tracker
+        if not tracker:
+            return await self.run_with_failover(stream_function, prompt_or_messages, sampling_params, metrics=metrics)
+
+        start_time = time.monotonic()
+        primary_endpoints = []
+        primary = asyncio.ensure_future(
+            self.run_with_failover(stream_function, prompt_or_messages, sampling_params, tried=primary_endpoints, metrics=metrics)
+        )
+        hedge = None
+        try:
+            delay = tracker.hedge_delay(step_name)
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    if metrics is not None:
+                        metrics.hedged = True
+                    hedge = asyncio.ensure_future(
+                        self.run_with_failover(
+                            stream_function,
+                            prompt_or_messages,
+                            sampling_params,
+                            tried=list(primary_endpoints) if self.hedge_to_other_endpoint else [],
+                            metrics=metrics,
+                        )
+                    )
+
+            pending = {task for task in (primary, hedge) if task}
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        first_error = first_error or task.exception()
+                        continue
+                    completion, timed_out = task.result()
+                    elapsed = time.monotonic() - start_time
+                    if hedge:
+                        tracker.record_hedge(step_name, hedge_won=task is hedge, elapsed=elapsed)
+                    if not timed_out:
+                        tracker.record(step_name, elapsed)
+                    return completion, timed_out
+            raise first_error
+        finally:
+            for task in (primary, hedge):
+                if task and not task.done():
+                    task.cancel()
+
+    async def run_with_failover(self, stream_function, prompt_or_messages, sampling_params, tried=None, metrics=None):
+        # Sends the request to the least loaded healthy replica; if that replica fails, tries each of the others once before giving up
+        tried = [] if tried is None else tried  # endpoints already used for this request; also lets a hedged duplicate avoid the original's endpoint
+        while True:
+            endpoint = self.endpoint_pool.pick(exclude=tried)
+            tried.append(endpoint)
+            self.endpoint_pool.start_request(endpoint)
+            try:
+                completion, timed_out = await self.run_limited(endpoint, stream_function, prompt_or_messages, sampling_params, metrics)
+            except asyncio.CancelledError:
+                self.endpoint_pool.finish_request(endpoint, succeeded=None)
+                raise
+            except Exception as e:
+                # A bad request (or output we rejected) will be just as bad on every replica, so that doesn't count against this one
+                failure_kind = classify_exception(e)
+                not_the_servers_fault = failure_kind in ("client_error", "invalid_output")
+                self.endpoint_pool.finish_request(endpoint, succeeded=not_the_servers_fault)
+                if not_the_servers_fault or len(tried) >= len(self.endpoint_pool):
+                    raise
+                print(f"Request to {endpoint.base_url} failed ({failure_kind}: {e}), retrying on another endpoint")
+                if metrics is not None:
+                    metrics.retries += 1
+                continue
+            self.endpoint_pool.finish_request(endpoint, succeeded=not timed_out)
+            return completion, timed_out
+
+    async def run_limited(self, endpoint, stream_function, prompt_or_messages, sampling_params, metrics=None):
+        # Waits for rate limit budget (if any), then for a concurrency slot, then makes the request
+        limiter = endpoint.rate_limiter
+        if not limiter:
+            return await self.run_with_concurrency_limit(endpoint, stream_function, prompt_or_messages, sampling_params, metrics)
+
+        prompt_tokens = estimate_prompt_tokens(prompt_or_messages)
+        for attempt in range(self.rate_limit_retries + 1):
+            queued_at = time.monotonic()
+            reserved_tokens = await limiter.acquire(prompt_tokens + sampling_params["max_tokens"])
+            if metrics is not None:
+                metrics.add_queue_wait(queued_at)
+            try:
+                completion, timed_out = await self.run_with_concurrency_limit(
+                    endpoint, stream_function, prompt_or_messages, sampling_params, metrics
+                )
+            except StreamValidationError as e:
+                limiter.settle(reserved_tokens, prompt_tokens + estimate_tokens(e.partial_output))
+                raise
+            except Exception as e:
+                if classify_exception(e) != "rate_limit" or attempt == self.rate_limit_retries:
+                    raise
+                limiter.record_rate_limit_error()
+                if metrics is not None:
+                    metrics.retries += 1
+                await asyncio.sleep(retry_after_seconds(e) or 0)
+                continue
+            limiter.settle(reserved_tokens, prompt_tokens + estimate_tokens(completion))
+            return completion, timed_out
+
+    async def run_with_concurrency_limit(self, endpoint, stream_function, prompt_or_messages, sampling_params, metrics=None):
+        # Holds a concurrency slot for the duration of the request and tells the governor how it went
+        limiter = endpoint.concurrency_limiter
+        if not limiter:
+            return await self.send_request(endpoint, stream_function, prompt_or_messages, sampling_params, metrics)
+        queued_at = time.monotonic()
+        await limiter.acquire()
+        if metrics is not None:
+            metrics.add_queue_wait(queued_at)
+        try:
+            start_time = time.monotonic()
+            try:
+                completion, timed_out = await self.send_request(endpoint, stream_function, prompt_or_messages, sampling_params, metrics)
+            except Exception as e:
+                limiter.record_failure(classify_exception(e))
+                raise
+            if timed_out:
+                limiter.record_failure("timeout")
+            else:
+                limiter.record_success(time.monotonic() - start_time, len(completion))
+            return completion, timed_out
+        finally:
+            limiter.release()
+
+    async def send_request(self, endpoint, stream_function, prompt_or_messages, sampling_params, metrics=None):
+        if metrics is None:
+            return await stream_function(endpoint.client, prompt_or_messages, sampling_params)
+        metrics.mark_sent()
+        try:
+            completion, timed_out = await stream_function(endpoint.client, prompt_or_messages, sampling_params)
+        except Exception as e:
+            metrics.errors.append(classify_exception(e))
+            raise
+        metrics.mark_first_token()  # no-op if streamed; a non-streamed response arrives all at once
+        return completion, timed_out
 
     async def submit_completion(
-        self, prompt, sampling_params
-    ):  # Submit request and wait for it to stream back fully
+        self, prompt, sampling_params, stream_validators=None, stop_when=None, step_name=None
+    ):  # Submit request and wait for it to come back fully
+        sampling_params = dict(sampling_params)  # fill in defaults on a copy; the caller's dict is shared by every concurrent request of a step
         if "temperature" not in sampling_params:
             sampling_params["temperature"] = 1
         if "top_p" not in sampling_params:
@@ -37,51 +346,80 @@ class EngineWrapper:
             sampling_params["stop"] = []
         if "n_predict" not in sampling_params:
             sampling_params["n_predict"] = sampling_params["max_tokens"]
-        
-        use_min_p = False
-        if "min_p" in sampling_params:
-            use_min_p = True
 
+        if self.mode == "cohere":
+            raise Exception("Cohere not compatible with completion mode!")
+
+        cache_key = self.cache_key_for("completion", prompt, sampling_params)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.record_cached("completion", prompt, sampling_params, cached, step_name)
+                return prompt + cached, False
+
+        # stream_validators/stop_when are checked while the response streams in; see StreamMonitor
+        stream_function = functools.partial(self._stream_completion, stream_validators=stream_validators, stop_when=stop_when)
+        completion, timed_out = await self.run_request("completion", stream_function, prompt, sampling_params, step_name)
+
+        if cache_key and not timed_out:
+            self.cache.put(cache_key, completion)
+        return prompt + completion, timed_out
+
+    async def _stream_completion(self, client, prompt, sampling_params, stream_validators=None, stop_when=None, metrics=None):
         if self.mode == "api":
             timed_out = False
-            completion = ""
-            if use_min_p:
-                stream = await self.client.completions.create(
+            request_kwargs = {}
+            if "min_p" in sampling_params:
+                request_kwargs["extra_body"] = {"min_p": sampling_params["min_p"]}
+            if not self.stream:
+                response = await client.completions.create(
                     model=self.model,
                     prompt=prompt,
                     temperature=sampling_params["temperature"],
                     top_p=sampling_params["top_p"],
                     stop=sampling_params["stop"],
                     max_tokens=sampling_params["max_tokens"],
-                    extra_body={"min_p": sampling_params["min_p"]},
-                    stream=True,
                     timeout=360,
+                    **request_kwargs,
                 )
-            else:
-                stream = await self.client.completions.create(
-                    model=self.model,
-                    prompt=prompt,
-                    temperature=sampling_params["temperature"],
-                    top_p=sampling_params["top_p"],
-                    stop=sampling_params["stop"],
-                    max_tokens=sampling_params["max_tokens"],
-                    stream=True,
-                    timeout=360,
-                )
-            async for chunk in stream:
-                try:
-                    completion = completion + chunk.choices[0].delta.content
-                except:
-                    timed_out = True
+                return response.choices[0].text or "", timed_out
 
-            return prompt + completion, timed_out
+            stream = await client.completions.create(
+                model=self.model,
+                prompt=prompt,
+                temperature=sampling_params["temperature"],
+                top_p=sampling_params["top_p"],
+                stop=sampling_params["stop"],
+                max_tokens=sampling_params["max_tokens"],
+                stream=True,
+                timeout=360,
+                **request_kwargs,
+            )
+            return await read_stream(stream, openai_completion_piece, stream_validators, stop_when, metrics)
 
-        if self.mode == "cohere":
-            raise Exception("Cohere not compatible with completion mode!")
+        elif self.mode == "llamacpp":
+            # The native endpoint rather than /v1/completions, since that's where cache_prompt and slots live
+            payload = client.add_cache_options(
+                {
+                    "prompt": prompt,
+                    "temperature": sampling_params["temperature"],
+                    "top_p": sampling_params["top_p"],
+                    "stop": sampling_params["stop"],
+                    "n_predict": sampling_params["max_tokens"],
+                }
+            )
+            if "min_p" in sampling_params:
+                payload["min_p"] = sampling_params["min_p"]
+            if not self.stream:
+                response = await client.post("/completion", payload)
+                return response.get("content") or "", False
+
+            return await read_stream(client.stream("/completion", payload), llamacpp_completion_piece, stream_validators, stop_when, metrics)
 
     async def submit_chat(
-        self, messages, sampling_params
-    ):  # Submit request and wait for it to stream back fully
+        self, messages, sampling_params, stream_validators=None, stop_when=None, step_name=None
+    ):  # Submit request and wait for it to come back fully
+        sampling_params = dict(sampling_params)  # fill in defaults on a copy; the caller's dict is shared by every concurrent request of a step
         if "temperature" not in sampling_params:
             sampling_params["temperature"] = 1
         if "top_p" not in sampling_params:
@@ -90,50 +428,74 @@ class EngineWrapper:
             sampling_params["max_tokens"] = 3000
         if "stop" not in sampling_params:
             sampling_params["stop"] = []
-        
-        use_min_p = False
-        if "min_p" in sampling_params:
-            use_min_p = True
 
+        if self.mode not in ("api", "cohere", "llamacpp"):
+            raise Exception("Aphrodite not compatible with chat mode!")
+
+        cache_key = self.cache_key_for("chat", messages, sampling_params)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.record_cached("chat", messages, sampling_params, cached, step_name)
+                return cached, False
+
+        stream_function = functools.partial(self._stream_chat, stream_validators=stream_validators, stop_when=stop_when)
+        completion, timed_out = await self.run_request("chat", stream_function, messages, sampling_params, step_name)
+
+        if cache_key and not timed_out:
+            self.cache.put(cache_key, completion)
+        return completion, timed_out
+
+    async def _stream_chat(self, client, messages, sampling_params, stream_validators=None, stop_when=None, metrics=None):
         if self.mode == "api":
-            completion = ""
             timed_out = False
-            if use_min_p:
-                stream = await self.client.chat.completions.create(
+            request_kwargs = {}
+            if "min_p" in sampling_params:
+                request_kwargs["extra_body"] = {"min_p": sampling_params["min_p"]}
+            if not self.stream:
+                response = await client.chat.completions.create(
                     model=self.model,
                     messages=messages,
                     temperature=sampling_params["temperature"],
                     top_p=sampling_params["top_p"],
                     stop=sampling_params["stop"],
                     max_tokens=sampling_params["max_tokens"],
-                    extra_body={"min_p": sampling_params["min_p"]},
-                    stream=True,
+                    **request_kwargs,
                 )
-            else:
-                stream = await self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    temperature=sampling_params["temperature"],
-                    top_p=sampling_params["top_p"],
-                    stop=sampling_params["stop"],
-                    max_tokens=sampling_params["max_tokens"],
-                    stream=True,
-                )
-            async for chunk in stream:
-                try:
-                    if chunk.choices[0].delta.content:
-                        completion = completion + chunk.choices[0].delta.content
-                except Exception as e:
-                    print("\n\n------------CAUGHT EXCEPTION DURING GENERATION")
-                    print(e)
-                    timed_out = True
-                    print("\n\n-----/\------")
+                return response.choices[0].message.content or "", timed_out
 
-            return completion, timed_out
+            stream = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=sampling_params["temperature"],
+                top_p=sampling_params["top_p"],
+                stop=sampling_params["stop"],
+                max_tokens=sampling_params["max_tokens"],
+                stream=True,
+                **request_kwargs,
+            )
+            return await read_stream(stream, openai_chat_piece, stream_validators, stop_when, metrics)
+
+        elif self.mode == "llamacpp":
+            payload = client.add_cache_options(
+                {
+                    "messages": messages,
+                    "temperature": sampling_params["temperature"],
+                    "top_p": sampling_params["top_p"],
+                    "stop": sampling_params["stop"],
+                    "max_tokens": sampling_params["max_tokens"],
+                }
+            )
+            if "min_p" in sampling_params:
+                payload["min_p"] = sampling_params["min_p"]
+            if not self.stream:
+                response = await client.post("/v1/chat/completions", payload)
+                return response["choices"][0]["message"]["content"] or "", False
+
+            return await read_stream(client.stream("/v1/chat/completions", payload), llamacpp_chat_piece, stream_validators, stop_when, metrics)
 
         elif self.mode == "cohere":
             timed_out = False
-            completion = ""
             messages_cohereified = [
                 {
                     "role": "USER" if message["role"] == "user" else "CHATBOT",
@@ -141,7 +503,20 @@ class EngineWrapper:
                 }
                 for message in messages
             ]
-            stream = self.client.chat_stream(
+            if not self.stream:
+                response = await client.chat(
+                    model=self.model,
+                    chat_history=messages_cohereified[1:-1],
+                    message=messages_cohereified[-1]["message"],
+                    preamble=messages_cohereified[0]["message"],
+                    temperature=sampling_params["temperature"],
+                    p=sampling_params["top_p"],
+                    stop_sequences=sampling_params["stop"],
+                    max_tokens=sampling_params["max_tokens"],
+                )
+                return response.text, timed_out
+
+            stream = client.chat_stream(
                 model=self.model,
                 chat_history=messages_cohereified[1:-1],
                 message=messages_cohereified[-1]["message"],
@@ -151,16 +526,4 @@ class EngineWrapper:
                 stop_sequences=sampling_params["stop"],
                 max_tokens=sampling_params["max_tokens"],
             )
-            async for chunk in stream:
-                try:
-                    if chunk.event_type == "text-generation":
-                        completion = completion + chunk.text
-                except Exception as e:
-                    print("THIS RESPONSE TIMED OUT PARTWAY THROUGH GENERATION!")
-                    print(e)
-                    timed_out = True
-
-            return completion, timed_out
-
-        else:
-            raise Exception("Aphrodite not compatible with chat mode!")
\ No newline at end of file
+            return await read_stream(stream, cohere_chat_piece, stream_validators, stop_when, metrics)
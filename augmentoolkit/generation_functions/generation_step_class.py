@@ -3,7 +3,9 @@ import os
 import traceback
 import logging
 import yaml
-from augmentoolkit.generation_functions.safe_formatter import safe_format
+from augmentoolkit.generation_functions.prompt_registry import prompt_registry
+from augmentoolkit.generation_functions.retry_policy import RetryPolicy
+from augmentoolkit.generation_functions.transcript import Transcript
 
 
 class GenerationStep:
@@ -32,7 +34,7 @@ class GenerationStep:
             ],
         },
         completion_mode=True,  # Chat vs completion mode
-        retries=0,
+        retries=0,  # tries after the first one; ignored if retry_policy is given
         engine_wrapper=None,
         logging_level=logging.INFO,  # Default logging level
         output_processor=lambda x: x,  # to ensure that control flow does not need to have decision code handling the outputs of the LLM, you can pass in a function to handle and modify the outputs (post regex) here. By default it's just the identity function and does nothing.
@@ -40,14 +42,19 @@ class GenerationStep:
         default_prompt_folder="prompts",
         prompt_folder="prompts",
         use_stop=True,
+        stream_validators=None,  # functions of the output so far; if one returns False the request is cut off and retried, instead of paying for the rest of a response that will be thrown away
+        stop_when=None,  # functions of the output so far; if one returns True generation stops there and the output so far is used
+        step_name=None,  # groups requests for latency stats/hedging; defaults to the prompt's name
+        retry_policy=None,  # a RetryPolicy, for backoff settings other than the defaults
     ):
         self.prompt_path = prompt_path
         self.regex = regex
-        self.sampling_params = sampling_params
+        self.sampling_params = dict(sampling_params)  # our own copy; the caller's dict (or the default above) is shared with other steps
         if not use_stop:
-            del self.sampling_params["stop"]
+            self.sampling_params.pop("stop", None)
         self.completion_mode = completion_mode
         self.retries = retries
+        self.retry_policy = retry_policy or RetryPolicy(retries=retries)
         self.logging_level = logging_level
         self.output_processor = output_processor
         self.return_input_too = return_input_too
@@ -56,36 +63,37 @@ class GenerationStep:
         self.engine_wrapper = engine_wrapper
         self.prompt_folder = prompt_folder
         self.default_prompt_folder = default_prompt_folder
+        self.stream_validators = stream_validators
+        self.stop_when = stop_when
+        self.step_name = step_name or os.path.splitext(os.path.basename(prompt_path))[0]
         logging.basicConfig(
             level=self.logging_level, format="%(asctime)s - %(levelname)s - %(message)s"
         )
 
-    async def generate(self, **kwargs):
-        # Current file directory
-        current_dir = os.path.dirname(os.path.abspath(__file__))
+    def record_failed_attempt(self, exception):
+        metrics_log = getattr(self.engine_wrapper, "metrics_log", None)
+        if metrics_log:
+            metrics_log.record_failed_attempt(self.step_name, exception)
 
-        # Get the full path of the prompt file
-        ideal_path = os.path.join(
-            current_dir, "..", "..", self.prompt_folder, self.prompt_path
+    async def generate(self, **kwargs):
+        # The prompt file (from prompt_folder if it's there, otherwise default_prompt_folder) is read and parsed once per run, not once per call
+        template = prompt_registry.get(
+            self.prompt_folder, self.default_prompt_folder, self.prompt_path, chat=not self.completion_mode
         )
-        if os.path.exists(ideal_path):
-            full_prompt_path = ideal_path
-        else:
-            full_prompt_path = os.path.join(
-                current_dir, "..", "..", self.default_prompt_folder, self.prompt_path
-            )
-
-        with open(full_prompt_path, "r", encoding='utf-8') as pf:
-            prompt = pf.read()
 
-        # Submit generation and return response, retrying as needed
-        times_tried = 0
+        # Submit generation and return response, retrying as needed (see retry_policy.py: transient failures back off, bad outputs are retried straight away)
         if self.completion_mode:
-            prompt_formatted = safe_format(prompt, **kwargs)
-            while times_tried <= self.retries:
+            prompt_formatted = template.format(**kwargs)
+
+            async def attempt():
+                response = None
                 try:
                     response, timeout = await self.engine_wrapper.submit_completion(
-                        prompt_formatted, self.sampling_params
+                        prompt_formatted,
+                        self.sampling_params,
+                        stream_validators=self.stream_validators,
+                        stop_when=self.stop_when,
+                        step_name=self.step_name,
                     )
                     filtered_response = re.search(self.regex, response).group(1)
                     ret = self.output_processor(filtered_response)
@@ -94,88 +102,63 @@ class GenerationStep:
                     return ret, timeout
                 except Exception as e:
                     # logging.error(f"Error in Generation Step: {e}")
-                    try:
-                        if not self.engine_wrapper.mode == "llamacpp":
-                            print("Response:")
-                            print(response)
-                    except:
-                        pass
+                    if response is not None and not self.engine_wrapper.mode == "llamacpp":
+                        print("Response:")
+                        print(response)
                     traceback.print_exc()
-                    times_tried += 1
-            raise Exception("Generation step failed -- too many retries!")
+                    self.record_failed_attempt(e)
+                    raise
         else:
-            messages = yaml.safe_load(prompt)
-            new_messages = []
-            for message in messages:
-                try:
-                    new_messages.append(
-                        {
-                            "role": message["role"],
-                            "content": safe_format(message["content"], **kwargs),
-                        }
-                    )
-                except Exception as e:
-                    new_messages.append(
-                        {"role": message["role"], "content": message["content"]}
-                    )
-            messages = new_messages
+            messages = template.format(**kwargs)
 
             # messages = [{
             #     "role": message["role"],
             #     "content": safe_format(message["content"],**arguments)
             #     }
             #             for message in messages]
-            while times_tried <= self.retries:
-                try:
+            # strip whitespace added by yaml load
+            messages = [
+                {
+                    "role": message["role"],
+                    "content": message["content"].strip(),
+                }
+                for message in messages
+            ]
 
-                    # strip whitespace added by yaml load
-                    messages = [
-                        {
-                            "role": message["role"],
-                            "content": message["content"].strip(),
-                        }
-                        for message in messages
-                    ]
+            async def attempt():
+                response = None
+                try:
                     # print("\n\n\nBEGIN DEBUG")
                     # print(messages)
                     # print("END DEBUG\n\n\n")
                     response, timeout = await self.engine_wrapper.submit_chat(
-                        messages, self.sampling_params
+                        messages,
+                        self.sampling_params,
+                        stream_validators=self.stream_validators,
+                        stop_when=self.stop_when,
+                        step_name=self.step_name,
                     )
                     ret = self.output_processor(response)
                     if self.return_input_too:
-                        return ret, yaml.dump(
-                            messages
-                            + [
-                                {
-                                    "role": "assistant",
-                                    "content": response,
-                                    "timeout": timeout,
-                                }
-                            ],
-                            default_flow_style=False,
-                            allow_unicode=True
-                        )
+                        return ret, Transcript(messages, response, timeout)  # serialized only when it's written
                     return ret, timeout
                 except Exception as e:
                     logging.error(f"Error in Generation Step: {e}")
-                    if self.completion_mode:
-                        print("Prompt:")
-                        print(prompt)
-                    else:
-                        print("Messages:")
-                        print(yaml.dump(messages, default_flow_style=False, allow_unicode=True))
-                    try:
+                    print("Messages:")
+                    print(yaml.dump(messages, default_flow_style=False, allow_unicode=True))
+                    if response is not None:
                         print("\n\nResponse:\n-----\n")
                         print(response)
-                    except UnboundLocalError:
+                    else:
                         print("No response to print")
-                        pass
-                    # if prompt_formatted:
-                    #     print(prompt_formatted)
                     logging.error(
                         f"Above prompt resulted in error, probably the model's fault: {e}"
                     )
                     traceback.print_exc()
-                    times_tried += 1
-            raise Exception("Generation step failed -- too many retries!")
+                    self.record_failed_attempt(e)
+                    raise
+
+        try:
+            return await self.retry_policy.run(attempt, self.step_name)
+        except Exception as e:
+            raise Exception("Generation step failed -- too many retries!") from e
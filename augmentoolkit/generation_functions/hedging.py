@@ -0,0 +1,52 @@
+import collections
+import math
+
+
+class StepLatencyTracker:
+    """
+    Remembers how long recent successful requests took for each pipeline step, and how hedging has been doing.
+
+    A request to a step that has taken longer than hedge_percentile of that step's recent requests is probably
+    stuck behind something (an overloaded replica, a long queue on the server) and is worth duplicating.
+    """
+
+    def __init__(self, hedge_percentile=0.95, min_samples=20, window=500):
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples  # don't hedge off of a handful of requests; the estimate would be noise
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.hedges_fired = collections.Counter()
+        self.hedges_won = collections.Counter()
+        self.seconds_saved = collections.defaultdict(float)
+
+    def record(self, step_name, latency):
+        self.latencies[step_name].append(latency)
+
+    def percentile(self, step_name, fraction):
+        samples = self.latencies[step_name]
+        if len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1)]
+
+    def hedge_delay(self, step_name):
+        return self.percentile(step_name, self.hedge_percentile)
+
+    def record_hedge(self, step_name, hedge_won, elapsed):
+        self.hedges_fired[step_name] += 1
+        if hedge_won:
+            self.hedges_won[step_name] += 1
+            # We cancel the original request, so we never find out how long it would have taken; the step's p99 is a conservative stand-in for a straggler
+            p99 = self.percentile(step_name, 0.99) or elapsed
+            self.seconds_saved[step_name] += max(0.0, p99 - elapsed)
+
+    def stats(self):
+        return {
+            step_name: {
+                "recent_p50_seconds": round(self.percentile(step_name, 0.5) or 0.0, 1),
+                "recent_p99_seconds": round(self.percentile(step_name, 0.99) or 0.0, 1),
+                "hedges_fired": self.hedges_fired[step_name],
+                "hedges_won": self.hedges_won[step_name],
+                "estimated_seconds_saved": round(self.seconds_saved[step_name], 1),
+            }
+            for step_name in self.latencies
+        }
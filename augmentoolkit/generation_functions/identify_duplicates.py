@@ -1,54 +1,158 @@
-from typing import List, Tuple
-from .process_multiturn_functions import has_sequential_chars
-
-# If you want to check for matching substrings anywhere, not just at start, use this code (untested)
-# def identify_duplicates(tuples: List[Tuple[str, str, str, str]]) -> List[Tuple[str, str, str, str]]:
-#     # Create a dictionary to hold questions with the same first N characters
-#     question_dict = {}
-
-#     # Iterate through each tuple and categorize them by the first N characters of the question
-#     for q_tuple in tuples:
-#         question = q_tuple[0]
-#         placed = False
-#         for dict_q in question_dict.keys():
-#             if has_sequential_chars(question,dict_q,N_CHARACTERS_SAME):
-#                 question_dict[dict_q].append(q_tuple)
-#                 placed = True
-#                 break
-#         if not placed:
-#             question_dict[question] = [q_tuple] # if not found to be equivalent with anything, make it a dict entry so that things can be compared against it and added to its list
-
-#     # Filter out prefixes that only have one question associated
-#     matching_questions = [q for q_list in question_dict.values() if len(q_list) > 1 for q in q_list]
-
-#     return matching_questions
-
-
-def identify_duplicates(
-    tuples: List[Tuple[str, str, str, str]]
-) -> List[Tuple[str, str, str, str]]:
-    # Create a dictionary to hold questions with the same first N characters
-    question_dict = {}
-
-    # Iterate through each tuple and categorize them by the first N characters of the question
-    for q_tuple in tuples:
-        question = q_tuple[0]
-        # Get the first N characters of the question
-        prefix = question[:15]
-        # Add the tuple to the list of tuples with the same prefix
-        if prefix in question_dict:
-            question_dict[prefix].append(q_tuple)
-        else:
-            question_dict[prefix] = [q_tuple]
-
-    matching_questions = [
-        q for q_list in question_dict.values() if len(q_list) == 1 for q in q_list
-    ]
-    selected_from_duplicates = [
-        q_list[0] for q_list in question_dict.values() if len(q_list) > 1
+import json
+import re
+import random
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # the pure-Python path gives the same answers, it's just slower on big corpora
+    np = None
+
+# Near-duplicate detection for questions: character shingles -> MinHash signatures -> LSH banding to find candidates -> exact Jaccard similarity to confirm them.
+# Used to be "same first 15 characters", which missed paraphrases and lumped together everything starting with "What is the ".
+
+MASK_64 = (1 << 64) - 1  # permutations are multiply-shift hashes, ((a * x + b) mod 2**64) >> 32: numpy's uint64 math wraps around like this for free, and Python's ints get masked to match
+
+
+def normalize(text):
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def shingle_hashes(text, shingle_size=5):
+    # Stable hashes (crc32, not hash(), which changes between runs) of every shingle_size-character piece of the normalized text
+    text = normalize(text)
+    if len(text) <= shingle_size:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return {zlib.crc32(text[i : i + shingle_size].encode("utf-8")) for i in range(len(text) - shingle_size + 1)}
+
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """
+    Finds groups of near-duplicate texts in roughly linear time. Texts are added one at a time (or in batches, which numpy can speed up);
+    each new text is only compared against the texts it shares an LSH bucket with, and counts as a duplicate if the Jaccard similarity of their shingles is at least `threshold`.
+    With the defaults (32 bands of 4 rows), pairs at 0.6 similarity are found ~99% of the time.
+    """
+
+    def __init__(self, threshold=0.6, shingle_size=5, num_perm=128, bands=32, seed=42):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self.perms = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(num_perm)]
+        self.shingles = []  # per text added
+        self.buckets = {}  # (band, signature slice) -> the first text that landed there
+        self.parent = []  # union-find over texts; each text's group is found through its root
+
+    def signatures(self, shingle_sets):
+        if np is not None:
+            return self.signatures_numpy(shingle_sets)
+        return [
+            [min(((a * h + b) & MASK_64) >> 32 for h in shingles) for a, b in self.perms]
+            for shingles in shingle_sets
+        ]
+
+    def signatures_numpy(self, shingle_sets, chunk_size=20_000):
+        # The shingles of a chunk of texts in one array, hashed by every permutation at once, then the minimum taken per text. Chunked so the (permutations x shingles) array stays small
+        a = np.array([[a] for a, _ in self.perms], dtype=np.uint64)
+        b = np.array([[b] for _, b in self.perms], dtype=np.uint64)
+        signatures = []
+        start = 0
+        while start < len(shingle_sets):
+            end, total = start, 0
+            while end < len(shingle_sets) and (end == start or total + len(shingle_sets[end]) <= chunk_size):
+                total += len(shingle_sets[end])
+                end += 1
+            chunk = shingle_sets[start:end]
+            lengths = np.array([len(shingles) for shingles in chunk], dtype=np.int64)
+            hashes = np.fromiter((h for shingles in chunk for h in shingles), dtype=np.uint64, count=total)
+            hashed = (a * hashes + b) >> np.uint64(32)  # permutations x shingles, so each text's shingles are contiguous for reduceat
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            signatures.extend(np.minimum.reduceat(hashed, offsets, axis=1).T.tolist())
+            start = end
+        return signatures
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def add_many(self, texts):
+        # Returns, for each text, the index of the earlier text it's a near-duplicate of, or None
+        shingle_sets = [shingle_hashes(text, self.shingle_size) for text in texts]
+        matches = []
+        for shingles, signature in zip(shingle_sets, self.signatures(shingle_sets)):
+            idx = len(self.shingles)
+            self.shingles.append(shingles)
+            self.parent.append(idx)
+            match = None
+            compared = {idx}  # a text often shares several buckets with the same other text
+            for band in range(self.bands):
+                key = (band, tuple(signature[band * self.rows : (band + 1) * self.rows]))
+                other = self.buckets.setdefault(key, idx)
+                if other in compared or self.find(other) == self.find(idx):
+                    continue
+                compared.add(other)
+                if jaccard(shingles, self.shingles[other]) >= self.threshold:
+                    self.parent[self.find(idx)] = self.find(other)
+                    if match is None:
+                        match = other
+            matches.append(match)
+        return matches
+
+    def add(self, text):
+        return self.add_many([text])[0]
+
+    def clusters(self):
+        # Groups of near-duplicates (indices in the order texts were added), largest first; texts with no duplicates are left out
+        groups = {}
+        for idx in range(len(self.parent)):
+            groups.setdefault(self.find(idx), []).append(idx)
+        return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
+
+
+def qa_text(qa_dict):
+    # Questions are compared along with their answers, so the same generic question asked of two different texts isn't a duplicate
+    if isinstance(qa_dict, dict):
+        return qa_dict["question"] + "\n" + qa_dict["answer"]
+    return qa_dict[0] + "\n" + qa_dict[1]  # old-style (question, answer, ...) tuples
+
+
+def identify_duplicates(qa_dicts, threshold=0.6, index=None):
+    """
+    Returns (kept, clusters): the qa dicts with all but the first of each group of near-duplicates dropped (order kept), and the groups themselves as lists of qa dicts.
+    Pass an index to dedupe against what was added to it earlier too (e.g. across the paragraphs of a run that's processed a bit at a time).
+    """
+    index = index or NearDuplicateIndex(threshold=threshold)
+    first_new = len(index.parent)
+    matches = index.add_many([qa_text(qa_dict) for qa_dict in qa_dicts])
+    kept = [qa_dict for qa_dict, match in zip(qa_dicts, matches) if match is None]
+    clusters = [
+        [qa_dicts[idx - first_new] for idx in cluster if idx >= first_new]
+        for cluster in index.clusters()
+        if any(idx >= first_new for idx in cluster)
     ]
+    return kept, [cluster for cluster in clusters if len(cluster) > 1]
+
 
-    return matching_questions + selected_from_duplicates
+def save_duplicate_clusters(path, index, qa_dicts):
+    # qa_dicts is everything that was added to the index, in the order it was added. The first of each group is the one that was kept
+    clusters = [
+        [{key: qa_dicts[idx].get(key) for key in ("question", "answer", "paragraph_idx", "question_idx")} for idx in cluster]
+        for cluster in index.clusters()
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(clusters, f, indent=2, ensure_ascii=False)
+    return clusters
 
 
 # There is no bug about this ignoring certain judgments and retrying; that's just the dissenting reasoning from the print statement
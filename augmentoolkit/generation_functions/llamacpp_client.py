@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import aiohttp
+
+# Same timeout behaviour as the OpenAI path: fail fast if the server can't be reached, but give a slow generation up to 360 seconds between pieces of output
+LLAMACPP_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=10, sock_read=360)
+
+_shared_session = None
+_shared_session_loop = None
+
+
+def get_shared_session():
+    # One keep-alive connection pool for every llama.cpp request in the process, instead of a new one (and a new TCP handshake) per request.
+    # Sessions belong to an event loop, so a new one is made if we're running under a different loop than last time.
+    global _shared_session, _shared_session_loop
+    loop = asyncio.get_running_loop()
+    if _shared_session is None or _shared_session.closed or _shared_session_loop is not loop:
+        _shared_session = aiohttp.ClientSession(
+            timeout=LLAMACPP_TIMEOUT,
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60),  # concurrency is limited by EngineWrapper, not here
+        )
+        _shared_session_loop = loop
+    return _shared_session
+
+
+async def close_shared_session():
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
+
+class LlamaCppClient:
+    """
+    Talks to a llama.cpp server (llama-server) directly, so that its prompt caching can be used:
+    cache_prompt keeps the KV cache of the last prompt in each slot, so our heavily templated prompts (which share long prefixes) only have their new part processed.
+    By default the server picks the slot whose cached prompt is most similar; id_slot pins requests to one slot instead.
+    """
+
+    def __init__(self, base_url, api_key=None, cache_prompt=True, id_slot=None):
+        self.base_url = (base_url or "http://127.0.0.1:8080").rstrip("/")
+        if self.base_url.endswith("/v1"):
+            self.base_url = self.base_url[: -len("/v1")]  # configs written for the OpenAI-compatible endpoint point at /v1
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        self.cache_prompt = cache_prompt
+        self.id_slot = id_slot
+
+    def add_cache_options(self, payload):
+        payload["cache_prompt"] = self.cache_prompt
+        if self.id_slot is not None:
+            payload["id_slot"] = self.id_slot
+        return payload
+
+    async def post(self, path, payload):
+        session = get_shared_session()
+        async with session.post(self.base_url + path, data=json.dumps(payload), headers=self.headers) as response:
+            response.raise_for_status()  # raises with .status, so 429s/5xxs get classified like the OpenAI client's errors
+            return await response.json()
+
+    async def stream(self, path, payload):
+        # Yields each server-sent event's JSON. Closing this generator (aclose) drops the connection, which makes the server stop generating.
+        session = get_shared_session()
+        async with session.post(
+            self.base_url + path, data=json.dumps({**payload, "stream": True}), headers=self.headers
+        ) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    return
+                event = json.loads(data)
+                yield event
+                if event.get("stop"):  # native /completion marks its last event like this
+                    return
@@ -0,0 +1,65 @@
+import asyncio
+from math import ceil
+
+
+async def majority_vote_each(judge, votes, count):
+    """
+    Like majority_vote, for a judge that votes on `count` things at once (e.g. all the questions of a paragraph in one request): judge() returns a list of count True/False votes.
+    Returns a list with each thing's outcome. Judges are started while some undecided thing could still need them to pass, and the rest are cancelled once every outcome is decided.
+    """
+    needed = ceil(votes / 2)
+    passed = [0] * count
+    failed = [0] * count
+    launched = 0
+    pending = set()
+
+    def undecided():
+        return [i for i in range(count) if passed[i] < needed and failed[i] < needed]
+
+    try:
+        while undecided():
+            while launched < votes and any(passed[i] + len(pending) < needed for i in undecided()):
+                pending.add(asyncio.ensure_future(judge()))
+                launched += 1
+            if not pending:
+                break  # out of votes; can't happen with the thresholds above, but don't hang if it does
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for i, vote in enumerate(task.result()):
+                    if vote:
+                        passed[i] += 1
+                    else:
+                        failed[i] += 1
+        return [passed[i] >= needed and passed[i] > failed[i] for i in range(count)]  # ties (only possible if votes came in together) are tossed
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def majority_vote(judge, votes):
+    """
+    Asks judge() (an async function returning True or False) up to `votes` times, and returns True once ceil(votes / 2) of them have said True, or False once that many have said False.
+    The judges run at the same time instead of one after another. Only as many are in flight as could still be needed to pass: if they all agree, that's one round instead of ceil(votes / 2),
+    and each dissenting vote starts one more. So no more requests are made than when voting one at a time, and judges still running when the outcome is decided are cancelled.
+    An exception from a judge cancels the others and is raised.
+    """
+
+    async def judge_one():
+        return [await judge()]
+
+    return (await majority_vote_each(judge_one, votes, 1))[0]
+
+
+async def majority_vote_checks(judge, votes, count, checks):
+    """
+    For a judge that makes several checks of `count` things at once: judge() returns a list of `count` dicts of check -> True/False.
+    Each check of each thing gets its own majority, and a thing passes only if it passes every one of `checks`, like vetting the checks one at a time would do.
+    (ANDing each vote's checks first and taking one majority of that can disagree: votes of question-only, answer-only and both pass each check 2 to 1, but "all checks" only 1 to 2.)
+    """
+
+    async def judge_each():
+        verdicts = await judge()
+        return [verdict[check] for verdict in verdicts for check in checks]
+
+    outcomes = await majority_vote_each(judge_each, votes, count * len(checks))
+    return [all(outcomes[i * len(checks) : (i + 1) * len(checks)]) for i in range(count)]
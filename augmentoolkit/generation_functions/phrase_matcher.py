@@ -0,0 +1,110 @@
+import json
+import os
+import re
+from collections import deque
+
+
+def normalize(text):
+    # Case and runs of whitespace (including newlines) don't matter when matching. Leading/trailing spaces are kept, so a phrase like " the text" only matches at the start of a word
+    return re.sub(r"\s+", " ", text.casefold())
+
+
+class PhraseMatcher:
+    """
+    Finds any of a (possibly long) list of phrases in a string with one pass over the string (Aho-Corasick), instead of one pass per phrase.
+    Built once, then used for every question, answer and output line. Phrases and texts are compared after normalize().
+    """
+
+    def __init__(self, phrases):
+        self.phrases = []
+        self.goto = [{}]  # state -> {character: next state}; state 0 is the root
+        self.fail = [0]  # state -> the longest proper suffix of it that's also a state
+        self.outputs = [[]]  # state -> indices of the phrases that end there (including via fail links)
+        seen = set()
+        for phrase in phrases:
+            phrase = normalize(phrase)
+            if not phrase or phrase in seen:
+                continue
+            seen.add(phrase)
+            state = 0
+            for char in phrase:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.outputs[state].append(len(self.phrases))
+            self.phrases.append(phrase)
+
+        queue = deque(self.goto[0].values())  # breadth first, so a state's fail link is always built before its children's
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    @classmethod
+    def from_file(cls, path):
+        # One phrase per line; blank lines and lines starting with # are skipped
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(line.rstrip("\r\n") for line in f if line.strip() and not line.lstrip().startswith("#"))
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def scan(self, text):
+        # Yields (end position in the normalized text, phrase) for every match
+        state = 0
+        for position, char in enumerate(normalize(text)):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for phrase_idx in self.outputs[state]:
+                yield position, self.phrases[phrase_idx]
+
+    def search(self, text):
+        # The first phrase found in text, or None
+        return next((phrase for _, phrase in self.scan(text)), None)
+
+    def find_all(self, text):
+        return [phrase for _, phrase in self.scan(text)]
+
+    def __contains__(self, text):
+        return self.search(text) is not None
+
+
+def all_strings(value):
+    # Every string in a JSON value, however deeply nested
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from all_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from all_strings(item)
+
+
+def filter_jsonl(input_path, output_path, matcher, texts=all_strings):
+    """
+    Copies the lines of a .jsonl file whose texts (texts(record) yields the strings to check; by default every string in it) contain none of the matcher's phrases, one line at a time, so files of any size can be filtered.
+    output_path may be input_path, to filter in place. Returns (kept, dropped).
+    """
+    kept = dropped = 0
+    temp_path = output_path + ".filtering"
+    with open(input_path, "r", encoding="utf-8") as infile, open(temp_path, "w", encoding="utf-8") as outfile:
+        for line in infile:
+            if not line.strip():
+                continue
+            if any(text in matcher for text in texts(json.loads(line))):
+                dropped += 1
+                continue
+            outfile.write(line if line.endswith("\n") else line + "\n")
+            kept += 1
+    os.replace(temp_path, output_path)
+    return kept, dropped
@@ -2,8 +2,9 @@ import json
 import logging
 import os
 import re
-import traceback
 from augmentoolkit.generation_functions.generation_step_class import GenerationStep
+from augmentoolkit.generation_functions.retry_policy import RetryPolicy, ValidationFailed
+from augmentoolkit.generation_functions.run_store import store_for
 from augmentoolkit.utils.make_id import make_id
 from augmentoolkit.utils.write_output_to_file import write_output_to_file
 
@@ -26,7 +27,10 @@ class PipelineStep:
         result_key="placeholder_result_key", # this is the key that the result will be saved under in the output dictionary.
         regex=re.compile(r".*", re.DOTALL),
         validation_function=lambda x, y: True,
-        max_retries=3,
+        max_retries=3, # tries per item, counting the first
+        retry_policy=None, # a RetryPolicy, to change the backoff settings; its retries override max_retries
+        stream_validators=None, # checked while the response streams in, see GenerationStep
+        stop_when=None,
         **kwargs,
         ): # things that are args here are things that would be in the code. Some of these will be live-tweakable.
         self.prompt_path = prompt_path + ".yaml" if not completion_mode else prompt_path + ".txt"
@@ -47,51 +51,41 @@ class PipelineStep:
         self.save_path_dir = os.path.join(self.full_output_path, self.save_path)
         self.validation_function = validation_function
         self.max_retries=max_retries
+        self.retry_policy = retry_policy or RetryPolicy(retries=max_retries - 1)
+        self.stream_validators = stream_validators
+        self.stop_when = stop_when
         self.static_arguments = kwargs # any additional arguments are passed in during generation time. Fits the role of stuff read from the config, like special instructions.
+        self.generators = {} # one GenerationStep per engine wrapper, made on first use and reused by every item and retry
     
     def process_input_data(self, input_data):
         return input_data # this should be a dictionary with the keys being the same as the interpolation spots in the prompt. This function in particular will basically always be overridden in subclasses.
     
+    @property
+    def store(self):
+        # Files, or the run's SQLite store if STORAGE_BACKEND picked one; see run_store.py
+        return store_for(self.full_output_path)
+    
     def make_save_path_file(self, idx):
-        path = os.path.join(self.full_output_path, self.save_path, f"{str(idx)}.json")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        return path
+        return os.path.join(self.full_output_path, self.save_path, f"{str(idx)}.json")
     
     def read_previous_output(self, idx, output_list):
         save_path_file = self.make_save_path_file(idx)
-        if os.path.exists(save_path_file):
+        content = self.store.read(save_path_file)
+        if content is not None:
             try:
-                # First try UTF-8
-                with open(save_path_file, "r", encoding='utf-8') as f:
-                    output_data = json.load(f)
-                    output_list.append(output_data)
-                    return True
-            except UnicodeDecodeError:
-                # If UTF-8 fails, try with 'utf-8-sig' to handle BOM
-                try:
-                    with open(save_path_file, "r", encoding='utf-8-sig') as f:
-                        output_data = json.load(f)
-                        output_list.append(output_data)
-                        return True
-                except UnicodeDecodeError:
-                    # If that fails too, try with errors='replace'
-                    try:
-                        with open(save_path_file, "r", encoding='utf-8', errors='replace') as f:
-                            output_data = json.load(f)
-                            output_list.append(output_data)
-                            return True
-                    except Exception as e:
-                        print(f"Error reading file {save_path_file}: {str(e)}")
-                        return False
+                output_data = json.loads(content)
+                output_list.append(output_data)
+                return True
             except Exception as e:
                 print(f"Error reading file {save_path_file}: {str(e)}")
                 return False
         return False
 
     
-    async def generate_data(self, processed_data, engine_wrapper):
-        try:
-                
+    def get_generator(self, engine_wrapper):
+        # GenerationStep doesn't change after it's made (it copies sampling_params, and EngineWrapper copies them again per request), so concurrent tasks can share one
+        generator = self.generators.get(engine_wrapper)
+        if generator is None:
             generator = GenerationStep(
                 prompt_path=self.prompt_path,
                 default_prompt_folder=self.default_prompt_folder,
@@ -104,16 +98,35 @@ class PipelineStep:
                 use_stop=self.use_stop,
                 prompt_folder=self.prompt_folder,
                 regex=self.regex,
+                stream_validators=self.stream_validators,
+                stop_when=self.stop_when,
+                step_name=self.output_subdir,
             )
-            
-            # print(processed_data)
-            
-            result, full_output = await generator.generate(**processed_data, **self.static_arguments)
-            
+            self.generators[engine_wrapper] = generator
+        return generator
+    
+    async def generate_data(self, processed_data, engine_wrapper):
+        generator = self.get_generator(engine_wrapper)
+        
+        # print(processed_data)
+        
+        result, full_output = await generator.generate(**processed_data, **self.static_arguments) # errors are printed by the generator, and raised so that the retry policy can tell what kind of failure it was
+        
+        return result, full_output
+    
+    async def generate_with_retries(self, processed_data, input_data, engine_wrapper):
+        # Returns (result, full_output), or None if every try failed or was rejected by validation_function
+        async def attempt():
+            result, full_output = await self.generate_data(processed_data, engine_wrapper)
+            if not self.validation_function(result, input_data):
+                raise ValidationFailed(f"{self.output_subdir}: output failed validation")
             return result, full_output
+        
+        try:
+            return await self.retry_policy.run(attempt, self.output_subdir)
         except Exception as e:
-            print(e)
-            traceback.print_exc()
+            print(f"{self.output_subdir}: giving up on this item -- {e}")
+            return None
     
     
     
@@ -129,9 +142,7 @@ class PipelineStep:
         output_data[self.result_key] = result
         write_output_to_file(full_output, self.intermediate_output_path_full, id)
         
-        os.makedirs(self.save_path, exist_ok=True)
-        with open(save_path_file, "w", encoding='utf-8') as f:
-            f.write(json.dumps(output_data, ensure_ascii=False))
+        self.store.write(save_path_file, json.dumps(output_data, ensure_ascii=False))
         
         output_list.append(output_data)
         return output_data
@@ -148,19 +159,10 @@ class PipelineStep:
         
         processed_data = self.process_input_data(input_data)
         
-        complete = False
-        max_retries = self.max_retries
-        while not complete and max_retries > 0:
-            try:
-                result, full_output = await self.generate_data(processed_data, engine_wrapper)
-                if self.validation_function(result, input_data):
-                    complete = True
-            except Exception as e:
-                print(e)
-                traceback.print_exc() 
-            max_retries -= 1
-        if not complete: # consider raising here and catching in the actual pipeline.
+        generated = await self.generate_with_retries(processed_data, input_data, engine_wrapper)
+        if generated is None: # consider raising here and catching in the actual pipeline.
             return
+        result, full_output = generated
         
         return self.save(result=result, full_output=full_output, idx=idx, output_list=output_list, input_data=input_data)
         
@@ -0,0 +1,78 @@
+import os
+
+import yaml
+
+from augmentoolkit.generation_functions.safe_formatter import CompiledTemplate
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+
+class ChatTemplate:
+    # A YAML list of messages, with each message's content compiled
+    def __init__(self, messages):
+        self.messages = messages
+        self.compiled = []
+        for message in messages:
+            try:
+                self.compiled.append(CompiledTemplate(message["content"]))
+            except Exception:
+                self.compiled.append(None)  # e.g. content that isn't a string; left as it is, like before
+
+    def format(self, **kwargs):
+        # A message that fails to format is sent unformatted rather than failing the whole prompt
+        formatted = []
+        for message, template in zip(self.messages, self.compiled):
+            content = message["content"]
+            if template is not None:
+                try:
+                    content = template.format(**kwargs)
+                except Exception:
+                    pass
+            formatted.append({"role": message["role"], "content": content})
+        return formatted
+
+
+class PromptRegistry:
+    """
+    Loads, parses and compiles each prompt file once per process, instead of on every GenerationStep call.
+    A prompt in prompt_folder overrides the one with the same name in default_prompt_folder (both relative to the repo root, unless absolute).
+    With reload_on_change on, files are re-checked on every lookup and re-read if they were modified, so prompts can be edited during a run.
+    """
+
+    def __init__(self, reload_on_change=False):
+        self.reload_on_change = reload_on_change
+        self.paths = {}  # (prompt_folder, default_prompt_folder, prompt_path) -> full path
+        self.templates = {}  # (full path, is chat) -> (mtime, template)
+
+    def resolve(self, prompt_folder, default_prompt_folder, prompt_path):
+        key = (prompt_folder, default_prompt_folder, prompt_path)
+        full_path = self.paths.get(key)
+        if full_path is None or self.reload_on_change:
+            ideal_path = os.path.join(REPO_ROOT, prompt_folder, prompt_path)
+            if os.path.exists(ideal_path):
+                full_path = ideal_path
+            else:
+                full_path = os.path.join(REPO_ROOT, default_prompt_folder, prompt_path)
+            self.paths[key] = full_path
+        return full_path
+
+    def get(self, prompt_folder, default_prompt_folder, prompt_path, chat=False):
+        full_path = self.resolve(prompt_folder, default_prompt_folder, prompt_path)
+        cached = self.templates.get((full_path, chat))
+        if cached is not None and not self.reload_on_change:
+            return cached[1]
+        mtime = os.path.getmtime(full_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(full_path, "r", encoding="utf-8") as pf:
+            text = pf.read()
+        template = ChatTemplate(yaml.safe_load(text)) if chat else CompiledTemplate(text)
+        self.templates[(full_path, chat)] = (mtime, template)
+        return template
+
+    def clear(self):
+        self.paths.clear()
+        self.templates.clear()
+
+
+prompt_registry = PromptRegistry()
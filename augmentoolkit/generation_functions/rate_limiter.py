@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+
+def estimate_tokens(text):
+    # Rough but tokenizer-free; ~4 characters per token holds up well enough for English text with most tokenizers
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    """
+    Refills continuously at capacity-per-minute. Taking more than is available waits until enough has refilled,
+    so a request that would break the provider's quota is delayed instead of being sent and rejected.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.refill_rate = self.capacity / 60.0  # per second
+        self.available = self.capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def wait_time(self, amount):
+        self._refill()
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_rate
+
+    def take(self, amount):
+        self._refill()
+        self.available -= amount
+
+    def give_back(self, amount):
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+    def drain(self):
+        # The provider told us we're over quota, so whatever we think is left clearly isn't
+        self._refill()
+        self.available = min(self.available, 0.0)
+
+
+class RateLimiter:
+    """
+    Request-per-minute and token-per-minute budgets for one endpoint. Either can be None for no limit.
+
+    Token cost is estimated up front as the prompt's tokens plus max_tokens (the most the request could use),
+    then settled against the real size of the response once it finishes so that unused budget is returned.
+    Waiters are served in order so that a big generate_story request isn't starved by a stream of small ones.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+        self.total_wait_seconds = 0.0
+        self.waits = 0
+        self.rate_limit_errors = 0
+
+    def clamp_cost(self, estimated_tokens):
+        # A single request bigger than the whole per-minute budget would otherwise wait forever
+        if self.token_bucket:
+            return min(estimated_tokens, self.token_bucket.capacity)
+        return estimated_tokens
+
+    async def acquire(self, estimated_tokens):
+        estimated_tokens = self.clamp_cost(estimated_tokens)
+        async with self._lock:
+            while True:
+                wait = 0.0
+                if self.request_bucket:
+                    wait = max(wait, self.request_bucket.wait_time(1))
+                if self.token_bucket:
+                    wait = max(wait, self.token_bucket.wait_time(estimated_tokens))
+                if wait <= 0:
+                    break
+                self.waits += 1
+                self.total_wait_seconds += wait
+                await asyncio.sleep(wait)
+            if self.request_bucket:
+                self.request_bucket.take(1)
+            if self.token_bucket:
+                self.token_bucket.take(estimated_tokens)
+        return estimated_tokens
+
+    def settle(self, reserved_tokens, actual_tokens):
+        if self.token_bucket and actual_tokens < reserved_tokens:
+            self.token_bucket.give_back(reserved_tokens - actual_tokens)
+
+    def record_rate_limit_error(self):
+        self.rate_limit_errors += 1
+        if self.request_bucket:
+            self.request_bucket.drain()
+        if self.token_bucket:
+            self.token_bucket.drain()
+
+    def stats(self):
+        return {
+            "waits": self.waits,
+            "total_wait_seconds": round(self.total_wait_seconds, 2),
+            "rate_limit_errors": self.rate_limit_errors,
+        }
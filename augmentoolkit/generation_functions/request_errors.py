@@ -0,0 +1,48 @@
+import asyncio
+
+
+# Kinds of failure that mean "the server is overloaded, slow down" rather than "this particular request was bad"
+CONGESTION_FAILURES = ("rate_limit", "server_error", "timeout", "connection")
+
+
+def classify_exception(exception):
+    # Works off of attributes and class names so that it handles openai, cohere, httpx and aiohttp errors without importing all of them
+    if isinstance(exception, StreamValidationError):
+        return "invalid_output"  # the model's fault, not the server's
+    status = getattr(exception, "status_code", None)
+    if status is None:
+        status = getattr(exception, "status", None)
+    if isinstance(status, int):
+        if status == 429:
+            return "rate_limit"
+        if status >= 500:
+            return "server_error"
+        if 400 <= status < 500:
+            return "client_error"
+
+    name = type(exception).__name__.lower()
+    if "ratelimit" in name or "toomanyrequests" in name:
+        return "rate_limit"
+    if isinstance(exception, asyncio.TimeoutError) or "timeout" in name:
+        return "timeout"
+    if isinstance(exception, ConnectionError) or "connection" in name:
+        return "connection"
+    return "other"
+
+
+def retry_after_seconds(exception):
+    # Providers send Retry-After on 429s; openai/httpx errors carry the response, aiohttp errors carry the headers directly
+    headers = getattr(getattr(exception, "response", None), "headers", None) or getattr(exception, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class StreamValidationError(Exception):
+    # Raised when a streamed response is already known to be unusable, so it was cut off early. Keeps what had been generated so the tokens can be accounted for.
+    def __init__(self, message, partial_output=""):
+        super().__init__(message)
+        self.partial_output = partial_output
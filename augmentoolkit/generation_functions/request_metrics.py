@@ -0,0 +1,179 @@
+import collections
+import json
+import math
+import os
+import time
+
+from augmentoolkit.generation_functions.rate_limiter import estimate_tokens
+from augmentoolkit.generation_functions.request_errors import classify_exception
+
+
+def estimate_prompt_tokens(prompt_or_messages):
+    if isinstance(prompt_or_messages, str):
+        return estimate_tokens(prompt_or_messages)
+    return sum(estimate_tokens(message["content"]) for message in prompt_or_messages)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class RequestMetrics:
+    # Measurements for one submit_completion/submit_chat call, filled in as the request moves through EngineWrapper's layers
+
+    def __init__(self, step_name, model, kind, prompt_tokens):
+        self.step_name = step_name
+        self.model = model
+        self.kind = kind
+        self.prompt_tokens = prompt_tokens
+        self.started_at = time.monotonic()
+        self.queue_wait = 0.0  # waiting on rate limit budget and for a concurrency slot; summed over attempts
+        self.sent_at = None
+        self.first_token_at = None
+        self.retries = 0  # re-sends of this request: 429 retries and failovers to another endpoint
+        self.errors = []  # what went wrong with each failed attempt
+        self.hedged = False
+
+    def add_queue_wait(self, since):
+        self.queue_wait += time.monotonic() - since
+
+    def mark_sent(self):
+        self.sent_at = time.monotonic()
+        self.first_token_at = None
+
+    def mark_first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def finish(self, completion="", timed_out=False, cached=False, failure=None):
+        ttft = None
+        if self.sent_at is not None and self.first_token_at is not None:
+            ttft = self.first_token_at - self.sent_at
+        return {
+            "step": self.step_name,
+            "model": self.model,
+            "kind": self.kind,
+            "cached": cached,
+            "queue_wait": round(self.queue_wait, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "latency": round(time.monotonic() - self.started_at, 3),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": estimate_tokens(completion) if completion else 0,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "timed_out": timed_out,
+            "errors": self.errors,
+            "failure": failure,
+        }
+
+
+class MetricsLog:
+    """
+    Collects RequestMetrics from every EngineWrapper it's given to (and failed attempts from GenerationStep, which it retries),
+    appends each one to a JSONL file if a path is given, and prints a per-step summary table at the end of each phase.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "a", encoding="utf-8")
+        self.phase_requests = collections.defaultdict(list)  # step -> records since the last summary
+        self.phase_failed_attempts = collections.defaultdict(collections.Counter)  # step -> reason -> count
+
+    def write(self, entry):
+        if self.file:
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.file.flush()
+
+    def record(self, entry):
+        self.phase_requests[entry["step"]].append(entry)
+        self.write(entry)
+
+    def record_failed_attempt(self, step_name, exception):
+        # A GenerationStep attempt failed (it's retried if it has retries left); either the request itself failed, or the step couldn't use the output
+        reason = classify_exception(exception)
+        if reason == "other":
+            reason = "unusable_output"
+        self.phase_failed_attempts[step_name][reason] += 1
+        self.write({"step": step_name, "event": "failed_attempt", "reason": reason, "error": str(exception)[:200]})
+
+    def summary_rows(self):
+        total_tokens = sum(
+            entry["prompt_tokens"] + entry["completion_tokens"]
+            for entries in self.phase_requests.values()
+            for entry in entries
+            if not entry["cached"]
+        )
+        rows = []
+        for step_name in sorted(set(self.phase_requests) | set(self.phase_failed_attempts), key=str):
+            entries = self.phase_requests.get(step_name, [])
+            sent = [entry for entry in entries if not entry["cached"]]
+            ttfts = [entry["ttft"] for entry in sent if entry["ttft"] is not None]
+            latencies = [entry["latency"] for entry in sent]
+            completion_tokens = sum(entry["completion_tokens"] for entry in sent)
+            generating_seconds = sum(max(0.0, entry["latency"] - entry["queue_wait"]) for entry in sent)
+            step_tokens = sum(entry["prompt_tokens"] for entry in sent) + completion_tokens
+            rows.append(
+                {
+                    "step": step_name or "(unnamed)",
+                    "requests": len(entries),
+                    "cached": len(entries) - len(sent),
+                    "failed": sum(1 for entry in entries if entry["failure"]),
+                    "retries": sum(entry["retries"] for entry in entries),
+                    "failed_attempts": sum(self.phase_failed_attempts.get(step_name, {}).values()),
+                    "avg_queue_wait": sum(entry["queue_wait"] for entry in sent) / len(sent) if sent else 0.0,
+                    "p50_ttft": _percentile(ttfts, 0.5),
+                    "p50_latency": _percentile(latencies, 0.5),
+                    "p95_latency": _percentile(latencies, 0.95),
+                    "prompt_tokens": step_tokens - completion_tokens,
+                    "completion_tokens": completion_tokens,
+                    "tokens_per_second": completion_tokens / generating_seconds if generating_seconds else 0.0,
+                    "share_of_tokens": step_tokens / total_tokens if total_tokens else 0.0,
+                }
+            )
+        return rows
+
+    def format_summary(self, title):
+        columns = [
+            ("step", "step", "{}"),
+            ("requests", "reqs", "{}"),
+            ("cached", "cached", "{}"),
+            ("failed", "failed", "{}"),
+            ("retries", "retries", "{}"),
+            ("failed_attempts", "failed attempts", "{}"),
+            ("avg_queue_wait", "queue s", "{:.2f}"),
+            ("p50_ttft", "ttft p50", "{:.2f}"),
+            ("p50_latency", "lat p50", "{:.2f}"),
+            ("p95_latency", "lat p95", "{:.2f}"),
+            ("prompt_tokens", "prompt tok", "{}"),
+            ("completion_tokens", "compl tok", "{}"),
+            ("tokens_per_second", "tok/s", "{:.1f}"),
+            ("share_of_tokens", "% tokens", "{:.0%}"),
+        ]
+        rows = self.summary_rows()
+        cells = [[header for _, header, _ in columns]] + [
+            [fmt.format(row[key]) for key, _, fmt in columns] for row in rows
+        ]
+        widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+        lines = [f"Request metrics: {title}"]
+        for line in cells:
+            lines.append("  ".join(cell.ljust(width) if i == 0 else cell.rjust(width) for i, (cell, width) in enumerate(zip(line, widths))))
+        if not rows:
+            lines.append("(no requests)")
+        return "\n".join(lines)
+
+    def print_summary(self, title):
+        # Covers everything since the last summary, so each phase gets its own table
+        print(self.format_summary(title))
+        self.phase_requests.clear()
+        self.phase_failed_attempts.clear()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
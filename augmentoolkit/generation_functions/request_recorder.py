@@ -0,0 +1,101 @@
+import collections
+import json
+import os
+import random
+
+from augmentoolkit.generation_functions.response_cache import make_cache_key
+
+
+def make_replay_key(kind, prompt_or_messages):
+    # Only what was asked, not who it was asked of: a recording made against one provider/model can be replayed under a config that names another
+    return make_cache_key(kind=kind, input=prompt_or_messages)
+
+
+def seed_random(seed=None):
+    # Prompts are built with the global random (sampled few-shot examples, conversation starters...), so a replayed run only asks the recorded questions if it makes the same choices.
+    # Returns the seed used; with none given, one is picked so it can still be written down
+    if seed is None or seed == "":
+        seed = random.randrange(2**32)
+    seed = int(seed)
+    random.seed(seed)
+    return seed
+
+
+class RequestRecorder:
+    """
+    Appends every request EngineWrapper makes, and the response it got, to a JSONL file (one compact line per request).
+    The file can be served back by utils_for_manual_use/replay_server.py, which makes a pipeline run repeatable and free.
+    """
+
+    def __init__(self, path, seed=None):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.records = 0
+        if seed is not None:  # a header line per run, so whoever replays this knows what RANDOM_SEED to use
+            self.file.write(json.dumps({"seed": seed}) + "\n")
+            self.file.flush()
+
+    def record(self, kind, model, prompt_or_messages, sampling_params, output, latency, step_name=None):
+        entry = {
+            "kind": kind,
+            "model": model,
+            "step": step_name,
+            "input": prompt_or_messages,
+            "sampling_params": sampling_params,
+            "output": output,
+            "latency": round(latency, 3),
+        }
+        self.file.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":"), default=str) + "\n")
+        self.file.flush()  # a crashed run still leaves a usable recording
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+
+class ReplayLog:
+    """
+    Recorded responses, looked up by the request that produced them.
+    A request that was made several times (retries, votes in a validation loop) got a different response each time, so the Nth identical request gets the Nth recorded response, wrapping around.
+    A request that isn't in the recording is a miss: lookup returns None, and it's up to the caller to fail it rather than send it anywhere else.
+    """
+
+    def __init__(self, path):
+        self.responses = collections.defaultdict(list)
+        self.latencies = collections.defaultdict(list)
+        self.occurrences = collections.Counter()
+        self.hits = 0
+        self.misses = 0
+        self.seeds = []  # RANDOM_SEED of each recorded run, from the header lines
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "input" not in entry:
+                    if "seed" in entry:
+                        self.seeds.append(entry["seed"])
+                    continue
+                key = make_replay_key(entry["kind"], entry["input"])
+                self.responses[key].append(entry["output"])
+                self.latencies[key].append(entry.get("latency", 0.0))
+
+    def __len__(self):
+        return sum(len(responses) for responses in self.responses.values())
+
+    def lookup(self, kind, prompt_or_messages):
+        # Returns (output, recorded latency), or None if this request was never recorded
+        key = make_replay_key(kind, prompt_or_messages)
+        responses = self.responses.get(key)
+        if not responses:
+            self.misses += 1
+            return None
+        index = self.occurrences[key] % len(responses)
+        self.occurrences[key] += 1
+        self.hits += 1
+        return responses[index], self.latencies[key][index]
+
+    def stats(self):
+        return {"recorded": len(self), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+
+def make_cache_key(**request_fields):
+    # Content-addressed: the same model, endpoint, prompt/messages, sampling params and attempt number always hash to the same key.
+    serialized = json.dumps(request_fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent on-disk cache of LLM responses, stored in a single SQLite file.
+
+    Entries are evicted least-recently-used first once the cache grows past max_size_bytes,
+    and entries older than max_age_seconds are treated as misses and removed.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_size_bytes=1024 * 1024 * 1024,  # 1 GiB
+        max_age_seconds=None,  # None means entries never expire
+    ):
+        self.path = path
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )"""
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)"
+        )
+        self.connection.commit()
+        self.total_size = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT response, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        response, created = row
+        now = time.time()
+        if self.max_age_seconds is not None and now - created > self.max_age_seconds:
+            self._delete(key)
+            self.connection.commit()
+            self.misses += 1
+            return None
+
+        self.connection.execute(
+            "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+        )
+        self.connection.commit()
+        self.hits += 1
+        return response
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        self._delete(key)  # keep total_size accurate if we are overwriting
+        self.connection.execute(
+            "INSERT INTO responses (key, response, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, response, size, now, now),
+        )
+        self.total_size += size
+        self._evict()
+        self.connection.commit()
+
+    def _delete(self, key):
+        row = self.connection.execute(
+            "SELECT size FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_size -= row[0]
+
+    def _evict(self):
+        if self.max_age_seconds is not None:
+            cutoff = time.time() - self.max_age_seconds
+            expired = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses WHERE created < ?",
+                (cutoff,),
+            ).fetchone()
+            if expired[0]:
+                self.connection.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+                self.evictions += expired[0]
+                self.total_size -= expired[1]
+
+        # Least recently used entries go first
+        while self.total_size > self.max_size_bytes:
+            row = self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.total_size -= row[1]
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_bytes": self.total_size,
+        }
+
+    def close(self):
+        self.connection.close()
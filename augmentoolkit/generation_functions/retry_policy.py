@@ -0,0 +1,98 @@
+import asyncio
+import random
+from collections import Counter, defaultdict
+
+from augmentoolkit.generation_functions.request_errors import CONGESTION_FAILURES, classify_exception, retry_after_seconds
+
+
+class ValidationFailed(Exception):
+    # The request went fine, but a validation function rejected the output
+    pass
+
+
+def failure_kind(exception):
+    # "transient" failures (rate limits, server errors, timeouts, dropped connections) are worth waiting out before trying again.
+    # Everything else is "semantic": the regex didn't match, validation failed, the output couldn't be parsed. That's the model's fault, so waiting doesn't help.
+    while exception.__cause__ is not None:  # e.g. "Generation step failed -- too many retries!" raised from the error that actually happened
+        exception = exception.__cause__
+    return "transient" if classify_exception(exception) in CONGESTION_FAILURES else "semantic"
+
+
+class RetryBudget:
+    """
+    Counts the retries made during a run, by step and kind of failure, and optionally caps how many retries the whole run may make.
+    Without a cap, a broken prompt or a server that's down means every item quietly retries its way to failure; with one, the run stops paying for retries once it's clearly not going to work.
+    """
+
+    def __init__(self, max_retries=None):
+        self.max_retries = max_retries
+        self.used = 0
+        self.by_step = defaultdict(Counter)  # step -> transient/semantic retries, items that gave up, retries refused because the budget ran out
+        self.backoff_seconds = Counter()  # step -> time spent waiting before retries
+
+    def take(self, step_name, kind):
+        if self.max_retries is not None and self.used >= self.max_retries:
+            if self.used == self.max_retries:
+                print(f"Retry budget of {self.max_retries} used up; failed requests and validations won't be retried for the rest of the run")
+                self.used += 1  # so the message only prints once
+            self.by_step[step_name]["budget_exhausted"] += 1
+            return False
+        self.used += 1
+        self.by_step[step_name][kind] += 1
+        return True
+
+    def stats(self):
+        return {
+            step_name: {**counts, "backoff_seconds": round(self.backoff_seconds[step_name], 1)}
+            for step_name, counts in self.by_step.items()
+        }
+
+
+retry_budget = RetryBudget()  # one per run, shared by every step; see set_retry_budget
+
+
+def set_retry_budget(max_retries=None):
+    # Called by the pipelines with RETRY_BUDGET from the config. 0/None means no cap. Also resets the stats.
+    global retry_budget
+    retry_budget = RetryBudget(int(max_retries) if max_retries else None)
+    return retry_budget
+
+
+class RetryPolicy:
+    """
+    How a step retries: up to `retries` times after the first attempt, with exponential backoff and full jitter for transient failures
+    (so that everything that failed at once, e.g. when the server hiccuped, doesn't all retry at once), and straight away (or after semantic_delay) for semantic ones.
+    Every retry is taken from the run's retry budget and counted in its stats.
+    """
+
+    def __init__(self, retries=3, base_delay=1.0, max_delay=60.0, semantic_delay=0.0):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.semantic_delay = semantic_delay
+
+    def backoff(self, retry_number, exception):
+        if failure_kind(exception) == "semantic":
+            return self.semantic_delay
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**retry_number))
+        retry_after = retry_after_seconds(exception)
+        if retry_after:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    async def run(self, attempt, step_name=None):
+        # attempt is an async function of no arguments that returns the result or raises; the last failure is re-raised once retries (or the budget) run out
+        budget = retry_budget
+        retry_number = 0
+        while True:
+            try:
+                return await attempt()
+            except Exception as e:
+                if retry_number >= self.retries or not budget.take(step_name, failure_kind(e)):
+                    budget.by_step[step_name]["gave_up"] += 1
+                    raise
+                delay = self.backoff(retry_number, e)
+                retry_number += 1
+                if delay:
+                    budget.backoff_seconds[step_name] += delay
+                    await asyncio.sleep(delay)
@@ -0,0 +1,229 @@
+import atexit
+import fnmatch
+import hashlib
+import os
+import sqlite3
+import time
+
+# Where PipelineSteps save their per-item outputs and intermediate transcripts.
+# "files" is the usual layout (one file per item/generation); "sqlite" puts everything under an output folder into a single run_store.sqlite in it,
+# which is much kinder to network filesystems and makes resuming a 100k-chunk run fast, since there are no longer hundreds of thousands of small files.
+# Either way, code addresses things by the path the file would have had, so steps don't need to know which backend is in use.
+# Both keep a manifest of each folder's names, built from one listing the first time the folder is looked at and updated on every write,
+# so checking whether an item was already done (which resuming does for every item of every step) is a set lookup rather than a filesystem probe.
+STORAGE_BACKENDS = ("files", "sqlite")
+SQLITE_FILENAME = "run_store.sqlite"
+CHECKSUMS_FILENAME = ".checksums"
+
+
+def checksum(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class Manifests:
+    def __init__(self):
+        self.manifests = {}  # directory -> set of names in it
+
+    def manifest(self, directory):
+        directory = os.path.abspath(directory)
+        names = self.manifests.get(directory)
+        if names is None:
+            names = self.manifests[directory] = set(self.listdir(directory))
+        return names
+
+    def exists(self, path):
+        return os.path.basename(path) in self.manifest(os.path.dirname(path))
+
+    def isdir(self, directory):
+        return bool(self.manifest(directory))
+
+    def glob(self, pattern):
+        directory, name_pattern = os.path.split(pattern)
+        return [os.path.join(directory, name) for name in sorted(self.manifest(directory)) if fnmatch.fnmatchcase(name, name_pattern)]
+
+    def added(self, path):
+        names = self.manifests.get(os.path.abspath(os.path.dirname(path)))
+        if names is not None:
+            names.add(os.path.basename(path))
+
+
+class FileStore(Manifests):
+    """
+    Writes go to a temporary file that is then renamed over the real one, so a process killed mid-write leaves the old file or the new one, never half of one.
+    Each folder also gets an append-only .checksums log; a file whose contents don't match its checksum (e.g. cut off by a power loss before the OS wrote it out) is reported and treated as missing, so it gets generated again.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.checksums = {}  # directory -> {name: checksum}
+
+    def listdir(self, directory):
+        try:
+            return [entry.name for entry in os.scandir(directory) if entry.is_file() and not entry.name.startswith(".")]
+        except FileNotFoundError:
+            return []
+
+    def recorded_checksums(self, directory):
+        directory = os.path.abspath(directory)
+        checksums = self.checksums.get(directory)
+        if checksums is None:
+            checksums = self.checksums[directory] = {}
+            try:
+                with open(os.path.join(directory, CHECKSUMS_FILENAME), "r", encoding="utf-8") as f:
+                    for line in f:
+                        name, _, digest = line.rstrip("\n").partition("\t")
+                        if len(digest) == 16:  # a line cut off by a crash is ignored
+                            checksums[name] = digest
+            except FileNotFoundError:
+                pass
+        return checksums
+
+    def isdir(self, directory):
+        return os.path.isdir(directory)
+
+    def read(self, path):
+        if not self.exists(path):
+            return None
+        with open(path, "rb") as f:
+            content = f.read()
+        try:
+            text = content.decode("utf-8")
+        except UnicodeDecodeError:
+            text = None
+        expected = self.recorded_checksums(os.path.dirname(path)).get(os.path.basename(path))
+        if text is None or (expected is not None and checksum(text) != expected):
+            print(f"{path} is incomplete or corrupted (probably cut off by a crash); it will be generated again")
+            return None
+        return text
+
+    def write(self, path, text):
+        directory, name = os.path.split(path)
+        os.makedirs(directory, exist_ok=True)
+        temp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+        with open(temp_path, "wb") as f:
+            f.write(text.encode("utf-8"))
+        os.replace(temp_path, path)
+        digest = checksum(text)
+        self.recorded_checksums(directory)[name] = digest
+        with open(os.path.join(directory, CHECKSUMS_FILENAME), "a", encoding="utf-8") as f:
+            f.write(f"{name}\t{digest}\n")
+        self.added(path)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteStore(Manifests):
+    """
+    Every "file" under root, kept as a row of one SQLite database (in WAL mode).
+    Writes are buffered and committed together every batch_size writes or flush_interval seconds (and on flush/close), so the disk syncs once per batch rather than once per item.
+    A commit is all-or-nothing, so a crash loses at most the last uncommitted batch -- those items are simply generated again on resume -- and never leaves a half-written item behind.
+    """
+
+    def __init__(self, root, batch_size=256, flush_interval=5.0):
+        super().__init__()
+        self.root = os.path.abspath(root)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = {}  # (dir, name) -> text, not committed yet
+        self.last_flush = time.monotonic()
+        os.makedirs(self.root, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.root, SQLITE_FILENAME))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # in WAL mode this is still crash-safe; it just doesn't fsync on every commit
+        self.connection.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                content TEXT NOT NULL,
+                PRIMARY KEY (dir, name)
+            )"""
+        )
+        self.connection.commit()
+
+    def contains(self, path):
+        path = os.path.abspath(path)
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def key(self, path):
+        relative = os.path.relpath(os.path.abspath(path), self.root)
+        directory, name = os.path.split(relative)
+        return directory.replace(os.sep, "/"), name
+
+    def dir_key(self, directory):
+        relative = os.path.relpath(os.path.abspath(directory), self.root)
+        return "" if relative == "." else relative.replace(os.sep, "/")
+
+    def listdir(self, directory):
+        dir_key = self.dir_key(directory)
+        names = {name for (name,) in self.connection.execute("SELECT name FROM files WHERE dir = ?", (dir_key,))}
+        names.update(name for d, name in self.pending if d == dir_key)
+        return names
+
+    def read(self, path):
+        if not self.exists(path):
+            return None
+        key = self.key(path)
+        if key in self.pending:
+            return self.pending[key]
+        row = self.connection.execute(
+            "SELECT content FROM files WHERE dir = ? AND name = ?", key
+        ).fetchone()
+        return row[0] if row else None
+
+    def write(self, path, text):
+        self.pending[self.key(path)] = text
+        self.added(path)
+        if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            with self.connection:  # one transaction per batch
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO files (dir, name, content) VALUES (?, ?, ?)",
+                    [(d, name, text) for (d, name), text in self.pending.items()],
+                )
+            self.pending = {}
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+file_store = FileStore()
+open_stores = []  # SQLiteStores, each responsible for everything under its root
+
+
+def open_run_store(output_dir, backend="files"):
+    # Called once by a pipeline with its output folder and STORAGE_BACKEND
+    backend = (backend or "files").lower()
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Storage backend must be one of {STORAGE_BACKENDS}, not {backend}")
+    if backend == "files":
+        return file_store
+    for store in open_stores:
+        if store.root == os.path.abspath(output_dir):
+            return store
+    if not open_stores:
+        atexit.register(close_run_stores)  # pipelines sys.exit() between phases; this commits whatever is still buffered
+    store = SQLiteStore(output_dir)
+    open_stores.append(store)
+    return store
+
+
+def store_for(path):
+    # The store that owns a path: the SQLite store whose output folder it is under, if any, otherwise plain files
+    for store in open_stores:
+        if store.contains(path):
+            return store
+    return file_store
+
+
+def close_run_stores():
+    while open_stores:
+        open_stores.pop().close()
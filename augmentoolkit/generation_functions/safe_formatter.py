@@ -15,6 +15,42 @@ class SafeFormatter(string.Formatter):
             return [(format_string, None, None, None)]
 
 
+_formatter = SafeFormatter()  # it holds no state, so one is enough for every call
+
+
 def safe_format(format_string, *args, **kwargs):
-    formatter = SafeFormatter()
-    return formatter.format(format_string, *args, **kwargs)
+    return _formatter.format(format_string, *args, **kwargs)
+
+
+class CompiledTemplate:
+    """
+    A format string parsed once, for formatting many times with safe_format's semantics (missing keys are left as "{key}").
+    Templates whose fields are all plain names (which is all of our prompts) are formatted by joining pre-split pieces;
+    anything fancier (format specs, conversions, attribute/index access, positional fields) or a string that doesn't parse goes through safe_format itself, so the result (or error) is always identical.
+    """
+
+    def __init__(self, format_string):
+        self.format_string = format_string
+        self.pieces = None  # alternating literal text and field names, when the fast path applies
+        try:
+            parsed = list(_formatter.parse(format_string))
+        except ValueError:
+            return
+        pieces = []
+        for literal, field_name, format_spec, conversion in parsed:
+            if literal:
+                pieces.append((literal, None))
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or format_spec or conversion:
+                return
+            pieces.append((None, field_name))
+        self.pieces = pieces
+
+    def format(self, **kwargs):
+        if self.pieces is None:
+            return safe_format(self.format_string, **kwargs)
+        return "".join(
+            literal if field_name is None else format(kwargs.get(field_name, "{" + field_name + "}"), "")
+            for literal, field_name in self.pieces
+        )
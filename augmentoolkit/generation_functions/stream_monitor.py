@@ -0,0 +1,97 @@
+import asyncio
+import inspect
+
+from augmentoolkit.generation_functions.request_errors import StreamValidationError
+
+
+class StreamMonitor:
+    """
+    Collects a streamed response and periodically checks it, so that output which is already known to be bad doesn't get paid for in full.
+
+    stream_validators are functions of the text so far that return False once the output can no longer be valid; the stream is then aborted with a StreamValidationError (and the step retries).
+    stop_when are functions of the text so far that return True once there is no point generating more (e.g. everything after this point would be truncated anyway); the stream is then ended and the text so far is kept as the response.
+    Checks run every check_interval characters rather than on every token, since some of them parse the whole output.
+    A check that wants to remember what it has already looked at (so it only examines what's new each time) can be given as a class instead of a function: each stream gets its own instance, which is called with the text so far.
+    """
+
+    def __init__(self, stream_validators=None, stop_when=None, check_interval=200, metrics=None):
+        self.stream_validators = [fresh(validator) for validator in stream_validators or []]
+        self.stop_when = [fresh(condition) for condition in stop_when or []]
+        self.check_interval = check_interval
+        self.chunks = []
+        self.unchecked_characters = 0
+        self.stopped_early = False
+        self.metrics = metrics  # optional RequestMetrics, told when the first piece arrives
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def feed(self, piece):
+        # Returns True once the stream should be stopped (keeping the output); raises StreamValidationError if it should be thrown away
+        if not self.chunks and self.metrics is not None:
+            self.metrics.mark_first_token()
+        self.chunks.append(piece)
+        self.unchecked_characters += len(piece)
+        if self.unchecked_characters < self.check_interval:
+            return False
+        self.unchecked_characters = 0
+        return self.check()
+
+    def check(self):
+        if not self.stream_validators and not self.stop_when:
+            return False
+        text = self.text
+        for validator in self.stream_validators:
+            if not validator(text):
+                raise StreamValidationError(
+                    f"Stream aborted by {getattr(validator, '__name__', 'validator')} after {len(text)} characters",
+                    partial_output=text,
+                )
+        for condition in self.stop_when:
+            if condition(text):
+                self.stopped_early = True
+                return True
+        return False
+
+
+def fresh(check):
+    # Classes are stateful checks: one instance per stream, since the same step's streams share the check
+    return check() if isinstance(check, type) else check
+
+
+async def close_stream(stream):
+    # Stops the server from generating (and billing) any more of a response we're done with
+    close = getattr(stream, "close", None) or getattr(stream, "aclose", None)
+    if close:
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            print(f"Couldn't close stream cleanly: {e}")
+
+
+async def read_stream(stream, piece_of, stream_validators=None, stop_when=None, metrics=None):
+    """
+    Reads a streamed response into a StreamMonitor until it ends or the monitor says to stop, and returns (text, timed_out).
+    piece_of(chunk) gets the text out of one chunk (None or "" if it has none); that's the only thing that differs between backends.
+    A chunk that can't be read means the response broke off partway, which is reported as timed_out.
+    """
+    monitor = StreamMonitor(stream_validators, stop_when, metrics=metrics)  # collects the pieces and joins them once at the end (adding to a string each time is quadratic over a 7000 token output)
+    timed_out = False
+    try:
+        async for chunk in stream:
+            try:
+                piece = piece_of(chunk)
+            except Exception as e:
+                print(f"Couldn't read a chunk of a streamed response, so it probably timed out partway through: {e}")
+                timed_out = True
+                continue
+            if piece and monitor.feed(piece):  # feed is plain synchronous code, so there's no coroutine to make and await per chunk
+                await close_stream(stream)
+                break
+    except (asyncio.CancelledError, StreamValidationError):  # e.g. the losing half of a hedged request, or output a validator rejected
+        await close_stream(stream)
+        raise
+    return monitor.text, timed_out
@@ -0,0 +1,92 @@
+import json
+import os
+
+import yaml
+
+from augmentoolkit.generation_functions.run_store import FileStore, store_for
+
+# How transcripts (the messages sent to the model plus its response) are saved to the intermediate_generations folders.
+# "yaml" is one {id}.yaml file per generation, like always; "json" is one {id}.json file, which is much faster to write and read;
+# "jsonl" appends every generation in a folder to a single transcripts.jsonl, which also avoids making tens of thousands of small files.
+TRANSCRIPT_FORMATS = ("yaml", "json", "jsonl")
+JSONL_FILENAME = "transcripts.jsonl"
+
+transcript_format = "yaml"
+
+
+def set_transcript_format(format_name):
+    global transcript_format
+    format_name = (format_name or "yaml").lower()
+    if format_name not in TRANSCRIPT_FORMATS:
+        raise ValueError(f"Transcript format must be one of {TRANSCRIPT_FORMATS}, not {format_name}")
+    transcript_format = format_name
+
+
+class Transcript:
+    """
+    What GenerationStep returns as the full output in chat mode. Serializing a multi-KB conversation with PyYAML is slow,
+    and plenty of outputs are only looked at if something goes wrong, so this holds onto the messages and only serializes when it's written (or turned into a string).
+    """
+
+    def __init__(self, messages, response, timeout):
+        self.messages = messages
+        self.response = response
+        self.timeout = timeout
+        self._yaml = None
+
+    def to_messages(self):
+        return self.messages + [{"role": "assistant", "content": self.response, "timeout": self.timeout}]
+
+    def to_yaml(self):
+        if self._yaml is None:
+            self._yaml = yaml.dump(self.to_messages(), default_flow_style=False, allow_unicode=True)
+        return self._yaml
+
+    def to_json(self):
+        return json.dumps(self.to_messages(), ensure_ascii=False)
+
+    def __str__(self):
+        return self.to_yaml()  # same text the full output always was
+
+    def write(self, directory, id):
+        store = store_for(directory)
+        if transcript_format == "jsonl" and isinstance(store, FileStore):
+            os.makedirs(directory, exist_ok=True)
+            file_path = os.path.join(directory, JSONL_FILENAME)
+            with open(file_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"id": str(id), "messages": self.to_messages()}, ensure_ascii=False) + "\n")
+            store.added(file_path)
+        elif transcript_format == "yaml":
+            file_path = os.path.join(directory, f"{id}.yaml")
+            store.write(file_path, self.to_yaml())
+        else:  # a run store is already a single file, so there's no need for transcripts.jsonl there; json is the fast option
+            file_path = os.path.join(directory, f"{id}.json")
+            store.write(file_path, self.to_json())
+        return file_path
+
+
+def read_transcripts(directory):
+    # Every transcript saved in a folder, in any of the formats, as lists of messages. In a transcripts.jsonl a later line with the same id replaces an earlier one, like overwriting a file would.
+    store = store_for(directory)
+    transcripts = []
+    # A file the store couldn't read (None: cut off by a crash, or not valid UTF-8) or that doesn't parse is skipped
+    for pattern, load, errors in (("*.yaml", yaml.safe_load, yaml.YAMLError), ("*.json", json.loads, json.JSONDecodeError)):
+        for file_path in store.glob(os.path.join(directory, pattern)):
+            content = store.read(file_path)
+            if content is None:
+                continue
+            try:
+                transcripts.append(load(content))
+            except errors:
+                print(f"Could not parse {file_path}; skipping it")
+    jsonl = store.read(os.path.join(directory, JSONL_FILENAME))
+    if jsonl is not None:
+        by_id = {}
+        for line in jsonl.splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # blank, or cut off by a crash mid-append
+            by_id[entry["id"]] = entry["messages"]
+        transcripts.extend(by_id.values())
+    return transcripts
@@ -0,0 +1,43 @@
+import asyncio
+
+_DONE = object()
+
+
+async def run_pool(function, inputs, concurrency_limit, progress_bar=None):
+    """
+    Awaits function(item) for every item of inputs (a list, a generator, or an async iterator), with a fixed pool of concurrency_limit workers each pulling the next item when it's done with the last one.
+    Making every coroutine up front and handing them to as_completed means a coroutine, a task and a future per item before any work starts; with this only concurrency_limit items are being worked on, or even read from the iterator, at once.
+    Results aren't collected: functions save/append their outputs themselves, like the steps already do. The first exception stops the pool and is raised.
+    """
+    if hasattr(inputs, "__aiter__"):
+        iterator = inputs.__aiter__()
+
+        async def next_item():
+            try:
+                return await iterator.__anext__()
+            except StopAsyncIteration:
+                return _DONE
+    else:
+        iterator = iter(inputs)
+
+        async def next_item():
+            return next(iterator, _DONE)
+
+    lock = asyncio.Lock()  # an async generator can't be advanced by two workers at once
+
+    async def worker():
+        while True:
+            async with lock:
+                item = await next_item()
+            if item is _DONE:
+                return
+            await function(item)
+            if progress_bar is not None:
+                progress_bar.update(1)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency_limit))]
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
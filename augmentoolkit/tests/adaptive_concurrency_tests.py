@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+from augmentoolkit.generation_functions.adaptive_concurrency import AdaptiveConcurrencyLimiter
+from augmentoolkit.generation_functions.request_errors import classify_exception
+
+
+class FakeStatusError(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class TestAdaptiveConcurrencyLimiter(unittest.TestCase):
+    def test_grows_while_saturated_and_respects_max(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+
+        async def run():
+            await limiter.acquire()
+            await limiter.acquire()
+            for _ in range(50):
+                limiter.record_success(1.0, 100)
+            limiter.release()
+            limiter.release()
+
+        asyncio.run(run())
+        self.assertEqual(limiter.limit, 3)
+
+    def test_does_not_grow_when_idle(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+        for _ in range(50):
+            limiter.record_success(1.0, 100)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_backs_off_once_per_burst_of_failures(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=16, cooldown_seconds=60)
+        for _ in range(10):
+            limiter.record_failure("rate_limit")
+        self.assertEqual(limiter.limit, 8)
+        limiter.record_failure("client_error")  # a bad request isn't the server's fault
+        self.assertEqual(limiter.limit, 8)
+        self.assertEqual(limiter.stats()["failures"], {"rate_limit": 10, "client_error": 1})
+
+    def test_limits_in_flight_requests(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=3)
+        peak = 0
+
+        async def request():
+            nonlocal peak
+            async with limiter:
+                peak = max(peak, limiter.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[request() for _ in range(20)])
+
+        asyncio.run(run())
+        self.assertEqual(peak, 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_classify_exception(self):
+        self.assertEqual(classify_exception(FakeStatusError(429)), "rate_limit")
+        self.assertEqual(classify_exception(FakeStatusError(503)), "server_error")
+        self.assertEqual(classify_exception(FakeStatusError(400)), "client_error")
+        self.assertEqual(classify_exception(asyncio.TimeoutError()), "timeout")
+        self.assertEqual(classify_exception(ConnectionResetError()), "connection")
+        self.assertEqual(classify_exception(ValueError()), "other")
+
+
+if __name__ == "__main__":
+    unittest.main()
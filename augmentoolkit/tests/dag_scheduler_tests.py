@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+from collections import Counter
+
+from augmentoolkit.generation_functions.dag_scheduler import DAGScheduler, PriorityLimiter
+
+
+class TestPriorityLimiter(unittest.TestCase):
+    def test_higher_priority_waiters_go_first(self):
+        order = []
+
+        async def run():
+            limiter = PriorityLimiter(1)
+            await limiter.acquire()
+
+            async def waiter(name, priority):
+                async with limiter.slot(priority):
+                    order.append(name)
+
+            tasks = [asyncio.ensure_future(waiter(name, priority)) for name, priority in [("a", 0), ("b", 2), ("c", 1), ("d", 2)]]
+            await asyncio.sleep(0)
+            limiter.release()
+            await asyncio.gather(*tasks)
+            self.assertEqual(limiter.in_use, 0)
+
+        asyncio.run(run())
+        self.assertEqual(order, ["b", "d", "c", "a"])
+
+    def test_step_caps_and_share_weights(self):
+        async def run():
+            limiter = PriorityLimiter(4, step_limits={"stories": 1}, share_weights={"small": 1, "large": 1})
+            for _ in range(4):
+                await limiter.acquire()
+            running = []
+
+            async def waiter(step, share, priority):
+                async with limiter.slot(priority, step, share):
+                    running.append(step)
+                    await asyncio.sleep(0.01)
+
+            # the large model's steps are further along, so they'd get every slot on priority alone
+            tasks = [asyncio.ensure_future(waiter("stories", "large", 3)) for _ in range(3)]
+            tasks += [asyncio.ensure_future(waiter("questions", "large", 2)) for _ in range(4)]
+            tasks += [asyncio.ensure_future(waiter("judge", "small", 0)) for _ in range(4)]
+            await asyncio.sleep(0)
+            for _ in range(4):
+                limiter.release()
+            await asyncio.sleep(0)
+            first_batch = Counter(running)
+            await asyncio.gather(*tasks)
+            self.assertEqual(limiter.in_use, 0)
+            return first_batch
+
+        first_batch = asyncio.run(run())
+        self.assertEqual(first_batch, {"stories": 1, "questions": 1, "judge": 2})
+
+
+class TestDAGScheduler(unittest.TestCase):
+    def make_dag(self, stop_after=None):
+        events = []
+        dag = DAGScheduler(2, stop_after=stop_after)
+
+        async def first(item):
+            async with dag.limit("first"):
+                await asyncio.sleep(0.01 * (item % 3))
+                events.append(("first", item))
+            return [item] if item % 2 == 0 else []  # odd items are dropped
+
+        async def second(item):
+            async with dag.limit("second"):
+                await asyncio.sleep(0.01)
+                events.append(("second", item))
+            return [item * 10]
+
+        dag.add_step("first", first)
+        dag.add_step("second", second, after="first")
+        return dag, events
+
+    def test_items_flow_on_without_waiting_for_the_whole_phase(self):
+        dag, events = self.make_dag()
+        results = asyncio.run(dag.run(range(12)))
+        self.assertEqual(sorted(results["second"]), [0, 20, 40, 60, 80, 100])
+        self.assertEqual(dag.stats(), {"first": 12, "second": 6})
+        first_second = events.index(next(e for e in events if e[0] == "second"))
+        last_first = max(i for i, e in enumerate(events) if e[0] == "first")
+        self.assertLess(first_second, last_first)  # later steps start before the earlier step has finished every item
+
+    def test_stop_after(self):
+        dag, events = self.make_dag(stop_after="first")
+        results = asyncio.run(dag.run(range(4)))
+        self.assertEqual(sorted(results["first"]), [0, 2])
+        self.assertNotIn("second", dag.stats())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+
+from augmentoolkit.generation_functions.depth_first_pipeline_step import DepthFirstPipelineStep
+from augmentoolkit.generation_functions.transcript import read_transcripts
+
+
+class FakeCompletionEngineWrapper:
+    mode = "api"
+    metrics_log = None
+
+    async def submit_completion(self, prompt, sampling_params, **kwargs):
+        await asyncio.sleep(0)
+        return prompt + " Joy", False
+
+
+class FakeChatEngineWrapper:
+    mode = "api"
+    metrics_log = None
+
+    async def submit_chat(self, messages, sampling_params, **kwargs):
+        await asyncio.sleep(0)
+        return "Joy: " + messages[-1]["content"], False
+
+
+class TestDepthFirstPipelineStep(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tempdir.name, "step.yaml"), "w", encoding="utf-8") as f:
+            f.write("- role: system\n  content: Name the emotion.\n- role: user\n  content: \"{text}\"\n")
+        with open(os.path.join(self.tempdir.name, "step.txt"), "w", encoding="utf-8") as f:
+            f.write("Name the emotion of: {text}\nEmotion:")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_chat_mode_output_is_saved(self):
+        # Chat-mode full outputs are Transcripts; RPToolkit's old write_output_to_file only took strings, so this crashed after the generation was paid for
+        step = DepthFirstPipelineStep(
+            prompt_path="step",
+            prompt_folder=self.tempdir.name,
+            default_prompt_folder=self.tempdir.name,
+            sampling_params={"max_tokens": 100},
+            output_dir=self.tempdir.name,
+            output_subdir="emotion_generation",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            result_key="emotion",
+            completion_mode=False,
+        )
+        output = asyncio.run(step.run(idx=0, input_data={"text": "a sunny day"}, engine_wrapper=FakeChatEngineWrapper()))
+        self.assertEqual(output, {"text": "a sunny day", "emotion": "Joy: a sunny day"})
+        with open(os.path.join(self.tempdir.name, "emotion_generation", "saved", "0.json"), "r", encoding="utf-8") as f:
+            self.assertEqual(json.load(f), output)
+        [transcript] = read_transcripts(os.path.join(self.tempdir.name, "emotion_generation", "intermediate"))
+        self.assertEqual(transcript[-1]["content"], "Joy: a sunny day")
+
+    def test_completion_mode_output_keeps_the_txt_extension(self):
+        # RPToolkit always saved its completion-mode intermediates as .txt; output folders from before the shared helper should look the same
+        step = DepthFirstPipelineStep(
+            prompt_path="step",
+            prompt_folder=self.tempdir.name,
+            default_prompt_folder=self.tempdir.name,
+            sampling_params={"max_tokens": 100},
+            output_dir=self.tempdir.name,
+            output_subdir="emotion_generation",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            result_key="emotion",
+            completion_mode=True,
+            regex=re.compile(r"Emotion: (.*)"),
+        )
+        output = asyncio.run(step.run(idx=0, input_data={"text": "a sunny day"}, engine_wrapper=FakeCompletionEngineWrapper()))
+        self.assertEqual(output["emotion"], "Joy")
+        intermediate = os.path.join(self.tempdir.name, "emotion_generation", "intermediate")
+        self.assertEqual([os.path.splitext(name)[1] for name in os.listdir(intermediate) if not name.startswith(".")], [".txt"])  # .checksums aside
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+
+from augmentoolkit.generation_functions.endpoint_pool import CircuitBreaker, Endpoint, EndpointPool
+
+
+class TestEndpointPool(unittest.TestCase):
+    def test_routes_to_least_outstanding_by_weight(self):
+        fast = Endpoint("fast", None, weight=2)
+        slow = Endpoint("slow", None, weight=1)
+        pool = EndpointPool([fast, slow])
+        picks = []
+        for _ in range(6):
+            endpoint = pool.pick()
+            pool.start_request(endpoint)
+            picks.append(endpoint.base_url)
+        self.assertEqual(picks.count("fast"), 4)
+        self.assertEqual(picks.count("slow"), 2)
+
+    def test_failover_excludes_tried_endpoints(self):
+        a, b = Endpoint("a", None), Endpoint("b", None)
+        pool = EndpointPool([a, b])
+        pool.start_request(b)  # b is busier, so a would normally be picked
+        self.assertIs(pool.pick(exclude=[a]), b)
+
+    def test_circuit_breaker_ejects_and_readmits(self):
+        a = Endpoint("a", None, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=0))
+        b = Endpoint("b", None, breaker=CircuitBreaker(failure_threshold=2, reset_seconds=60))
+        pool = EndpointPool([a, b])
+        for _ in range(2):
+            pool.start_request(b)
+            pool.finish_request(b, succeeded=False)
+        self.assertTrue(b.breaker.is_open)
+        for _ in range(5):
+            self.assertIs(pool.pick(), a)
+
+        # a trial request after the reset period closes the breaker again if it works
+        for _ in range(2):
+            pool.start_request(a)
+            pool.finish_request(a, succeeded=False)
+        self.assertTrue(a.breaker.allows_request())
+        pool.start_request(a)
+        self.assertFalse(a.breaker.allows_request())  # only one trial at a time
+        pool.finish_request(a, succeeded=True)
+        self.assertFalse(a.breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+
+SAMPLING_PARAMS = {"temperature": 1, "top_p": 1, "stop": [], "max_tokens": 100}
+MESSAGES = [{"role": "system", "content": "Be brief."}, {"role": "user", "content": "Hi"}]
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(0)
+            self.read += 1
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeOpenAIClient:
+    # client.completions.create / client.chat.completions.create, as AsyncOpenAI has them
+    def __init__(self, stream):
+        async def create(**kwargs):
+            return stream
+
+        self.completions = SimpleNamespace(create=create)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=create))
+
+
+class FakeLlamaCppClient:
+    def __init__(self, stream):
+        self.stream_to_return = stream
+        self.paths = []
+
+    def add_cache_options(self, payload):
+        return payload
+
+    def stream(self, path, payload):
+        self.paths.append(path)
+        return self.stream_to_return
+
+
+class FakeCohereClient:
+    def __init__(self, stream):
+        self.stream_to_return = stream
+
+    def chat_stream(self, **kwargs):
+        return self.stream_to_return
+
+
+def openai_chunk(**choice):
+    return SimpleNamespace(choices=[SimpleNamespace(**choice)])
+
+
+def openai_delta(content=None, **delta):
+    return openai_chunk(delta=SimpleNamespace(content=content, **delta), finish_reason=None)
+
+
+class TestStreamChunkShapes(unittest.TestCase):
+    # What each backend's client actually yields while streaming, including the chunks with no text in them
+    def read(self, mode, kind, client, stop_when=None):
+        engine_wrapper = EngineWrapper(model="model", base_url="http://127.0.0.1:8080/v1", mode=mode)
+        if kind == "completion":
+            coroutine = engine_wrapper._stream_completion(client, "Say hello", SAMPLING_PARAMS, stop_when=stop_when)
+        else:
+            coroutine = engine_wrapper._stream_chat(client, MESSAGES, SAMPLING_PARAMS, stop_when=stop_when)
+        return asyncio.run(coroutine)
+
+    def test_openai_completion(self):
+        stream = FakeStream([openai_chunk(text="Hel", finish_reason=None), openai_chunk(text="lo", finish_reason=None), openai_chunk(text="", finish_reason="stop")])
+        self.assertEqual(self.read("api", "completion", FakeOpenAIClient(stream)), ("Hello", False))
+
+    def test_openai_chat(self):
+        stream = FakeStream([openai_delta(role="assistant"), openai_delta("Hel"), openai_delta("lo"), openai_chunk(delta=SimpleNamespace(content=None), finish_reason="stop")])
+        self.assertEqual(self.read("api", "chat", FakeOpenAIClient(stream)), ("Hello", False))
+
+    def test_openai_chunk_without_choices_is_reported_as_timed_out(self):
+        stream = FakeStream([openai_delta("Hel"), SimpleNamespace(choices=[]), openai_delta("lo")])
+        self.assertEqual(self.read("api", "chat", FakeOpenAIClient(stream)), ("Hello", True))
+
+    def test_llamacpp_native_completion(self):
+        stream = FakeStream([{"content": "Hel", "stop": False}, {"content": "lo", "stop": False}, {"content": "", "stop": True, "timings": {}}])
+        client = FakeLlamaCppClient(stream)
+        self.assertEqual(self.read("llamacpp", "completion", client), ("Hello", False))
+        self.assertEqual(client.paths, ["/completion"])
+
+    def test_llamacpp_chat(self):
+        stream = FakeStream(
+            [
+                {"choices": [{"delta": {"role": "assistant"}}]},
+                {"choices": [{"delta": {"content": "Hel"}}]},
+                {"choices": [{"delta": {"content": "lo"}}]},
+                {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+                {"choices": [], "usage": {"completion_tokens": 2}},
+            ]
+        )
+        client = FakeLlamaCppClient(stream)
+        self.assertEqual(self.read("llamacpp", "chat", client), ("Hello", False))
+        self.assertEqual(client.paths, ["/v1/chat/completions"])
+
+    def test_cohere_chat(self):
+        stream = FakeStream(
+            [
+                SimpleNamespace(event_type="stream-start", generation_id="abc"),
+                SimpleNamespace(event_type="text-generation", text="Hel"),
+                SimpleNamespace(event_type="text-generation", text="lo"),
+                SimpleNamespace(event_type="stream-end", finish_reason="COMPLETE"),
+            ]
+        )
+        self.assertEqual(self.read("cohere", "chat", FakeCohereClient(stream)), ("Hello", False))
+
+    def test_stop_when_closes_the_stream(self):
+        stream = FakeStream([{"content": "x" * 100, "stop": False} for _ in range(10)])
+        text, timed_out = self.read("llamacpp", "completion", FakeLlamaCppClient(stream), stop_when=[lambda text: len(text) >= 300])
+        self.assertEqual(len(text), 400)  # checked every 200 characters
+        self.assertTrue(stream.closed)
+        self.assertEqual(stream.read, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
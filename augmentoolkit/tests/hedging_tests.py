@@ -0,0 +1,29 @@
+import unittest
+
+from augmentoolkit.generation_functions.hedging import StepLatencyTracker
+
+
+class TestStepLatencyTracker(unittest.TestCase):
+    def test_no_hedging_until_enough_samples(self):
+        tracker = StepLatencyTracker(hedge_percentile=0.9, min_samples=10)
+        for latency in range(9):
+            tracker.record("judge", latency)
+        self.assertIsNone(tracker.hedge_delay("judge"))
+        tracker.record("judge", 9)
+        self.assertEqual(tracker.hedge_delay("judge"), 8)
+        self.assertIsNone(tracker.hedge_delay("story_generation"))  # steps are tracked separately
+
+    def test_hedge_stats(self):
+        tracker = StepLatencyTracker(hedge_percentile=0.5, min_samples=1)
+        for latency in [1, 1, 1, 10]:
+            tracker.record("story_generation", latency)
+        tracker.record_hedge("story_generation", hedge_won=True, elapsed=3)
+        tracker.record_hedge("story_generation", hedge_won=False, elapsed=2)
+        stats = tracker.stats()["story_generation"]
+        self.assertEqual(stats["hedges_fired"], 2)
+        self.assertEqual(stats["hedges_won"], 1)
+        self.assertEqual(stats["estimated_seconds_saved"], 7)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import augmentoolkit.generation_functions.identify_duplicates as identify_duplicates_module
+from augmentoolkit.generation_functions.identify_duplicates import NearDuplicateIndex, identify_duplicates
+
+
+def qa(question, answer, paragraph_idx=0):
+    return {"question": question, "answer": answer, "paragraph": "", "paragraph_idx": paragraph_idx, "question_idx": 0}
+
+
+class TestIdentifyDuplicates(unittest.TestCase):
+    def test_paraphrases_are_grouped_and_shared_prefixes_are_not(self):
+        qa_dicts = [
+            qa("What is the role of mitochondria in a cell?", "Mitochondria produce most of the cell's ATP through respiration."),
+            qa("What is the capital city of France?", "Paris is the capital of France."),
+            qa("What's the role of the mitochondria in a cell?", "Mitochondria produce most of the cell's ATP via respiration.", paragraph_idx=1),
+            qa("What is the boiling point of water at sea level?", "Water boils at 100 degrees Celsius at sea level."),
+        ]
+        kept, clusters = identify_duplicates(qa_dicts)
+        self.assertEqual(kept, [qa_dicts[0], qa_dicts[1], qa_dicts[3]])
+        self.assertEqual(clusters, [[qa_dicts[0], qa_dicts[2]]])
+
+    def test_index_carries_across_calls(self):
+        index = NearDuplicateIndex()
+        first, _ = identify_duplicates([qa("Who wrote Hamlet?", "William Shakespeare wrote Hamlet around 1600.")], index=index)
+        second, _ = identify_duplicates([qa("Who wrote Hamlet?", "William Shakespeare wrote Hamlet around the year 1600.")], index=index)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertEqual(index.clusters(), [[0, 1]])
+
+    def test_numpy_and_pure_python_signatures_match(self):
+        if identify_duplicates_module.np is None:
+            self.skipTest("numpy not installed")
+        index = NearDuplicateIndex()
+        shingle_sets = [identify_duplicates_module.shingle_hashes(text) for text in ["a short one", "Something a bit longer than that, with punctuation!", "x"]]
+        numpy_signatures = index.signatures(shingle_sets)
+        np = identify_duplicates_module.np
+        identify_duplicates_module.np = None
+        try:
+            self.assertEqual(index.signatures(shingle_sets), numpy_signatures)
+        finally:
+            identify_duplicates_module.np = np
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from augmentoolkit.generation_functions import llamacpp_client
+from augmentoolkit.generation_functions.llamacpp_client import LlamaCppClient, close_shared_session, get_shared_session
+
+
+class FakeContent:
+    def __init__(self, lines):
+        self.lines = lines
+
+    async def __aiter__(self):
+        for line in self.lines:
+            await asyncio.sleep(0)
+            yield line
+
+
+class FakeResponse:
+    def __init__(self, lines=(), body=None):
+        self.content = FakeContent(lines)
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    async def json(self):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeSession:
+    def __init__(self, timeout=None, connector=None):
+        self.closed = False
+        self.posts = []
+        self.response = FakeResponse()
+
+    def post(self, url, data=None, headers=None):
+        self.posts.append((url, json.loads(data), headers))
+        return self.response
+
+    async def close(self):
+        self.closed = True
+
+
+def sse(event):
+    return b"data: " + json.dumps(event).encode() + b"\n"
+
+
+class TestLlamaCppClient(unittest.TestCase):
+    def setUp(self):
+        for name, fake in (("ClientSession", FakeSession), ("TCPConnector", mock.Mock)):  # no real connections (or unclosed-connector warnings)
+            patcher = mock.patch.object(llamacpp_client.aiohttp, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        llamacpp_client._shared_session = None
+
+    def stream_events(self, client, lines, path="/v1/chat/completions"):
+        async def collect():
+            session = get_shared_session()
+            session.response = FakeResponse(lines)
+            events = [event async for event in client.stream(path, {"prompt": "hi"})]
+            return events, session.posts
+
+        return asyncio.run(collect())
+
+    def test_base_url_drops_trailing_v1(self):
+        self.assertEqual(LlamaCppClient("http://127.0.0.1:8080/v1").base_url, "http://127.0.0.1:8080")
+        self.assertEqual(LlamaCppClient("http://127.0.0.1:8080/v1/").base_url, "http://127.0.0.1:8080")
+        self.assertEqual(LlamaCppClient("http://127.0.0.1:8080").base_url, "http://127.0.0.1:8080")
+        self.assertEqual(LlamaCppClient(None).base_url, "http://127.0.0.1:8080")
+        self.assertEqual(LlamaCppClient("http://x/v1", api_key="key").headers["Authorization"], "Bearer key")
+
+    def test_add_cache_options(self):
+        self.assertEqual(LlamaCppClient("http://x").add_cache_options({"prompt": "hi"}), {"prompt": "hi", "cache_prompt": True})
+        self.assertEqual(
+            LlamaCppClient("http://x", cache_prompt=False, id_slot=2).add_cache_options({"prompt": "hi"}),
+            {"prompt": "hi", "cache_prompt": False, "id_slot": 2},
+        )
+
+    def test_sse_parsing_skips_keepalives_and_ends_at_done(self):
+        lines = [
+            b": keep-alive\n",
+            b"\n",
+            sse({"choices": [{"delta": {"content": "Hi"}}]}),
+            b"event: ping\n",
+            b"   \n",
+            b"data:" + json.dumps({"choices": [{"delta": {"content": " there"}}]}).encode() + b"\r\n",  # no space after the colon
+            b"data: [DONE]\n",
+            sse({"choices": [{"delta": {"content": "never read"}}]}),
+        ]
+        events, posts = self.stream_events(LlamaCppClient("http://x/v1"), lines)
+        self.assertEqual([event["choices"][0]["delta"]["content"] for event in events], ["Hi", " there"])
+        url, payload, _ = posts[0]
+        self.assertEqual(url, "http://x/v1/chat/completions")
+        self.assertEqual(payload, {"prompt": "hi", "stream": True})
+
+    def test_native_completion_stream_ends_at_stop_event(self):
+        lines = [sse({"content": "Hel", "stop": False}), sse({"content": "lo", "stop": True}), sse({"content": "never read"})]
+        events, _ = self.stream_events(LlamaCppClient("http://x"), lines, path="/completion")
+        self.assertEqual([event["content"] for event in events], ["Hel", "lo"])
+
+    def test_session_is_reused_across_requests(self):
+        client = LlamaCppClient("http://x")
+
+        async def two_requests():
+            session = get_shared_session()
+            session.response = FakeResponse(body={"content": "ok"})
+            results = [await client.post("/completion", {"prompt": str(i)}) for i in range(2)]
+            return session, results, get_shared_session()
+
+        session, results, same_session = asyncio.run(two_requests())
+        self.assertEqual(results, [{"content": "ok"}] * 2)
+        self.assertEqual(len(session.posts), 2)
+        self.assertIs(same_session, session)
+
+        async def under_a_new_loop():
+            return get_shared_session()
+
+        new_session = asyncio.run(under_a_new_loop())  # sessions belong to an event loop
+        self.assertIsNot(new_session, session)
+
+        async def after_closing():
+            first = get_shared_session()
+            await close_shared_session()
+            return first, get_shared_session()
+
+        closed, reopened = asyncio.run(after_closing())
+        self.assertTrue(closed.closed)
+        self.assertIsNot(reopened, closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
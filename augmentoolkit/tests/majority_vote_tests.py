@@ -0,0 +1,89 @@
+import asyncio
+import time
+import unittest
+
+from augmentoolkit.generation_functions.majority_vote import majority_vote, majority_vote_checks, majority_vote_each
+
+
+def make_judge(votes, delay=0.02):
+    calls = []
+    cancelled = []
+
+    async def judge():
+        vote = votes[len(calls)]
+        calls.append(vote)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(vote)
+            raise
+        return vote
+
+    return judge, calls, cancelled
+
+
+class TestMajorityVote(unittest.TestCase):
+    def test_unanimous_pass_takes_one_round(self):
+        judge, calls, _ = make_judge([True] * 5)
+        start = time.monotonic()
+        self.assertTrue(asyncio.run(majority_vote(judge, 5)))
+        elapsed = time.monotonic() - start
+        self.assertEqual(len(calls), 3)  # only as many judges as needed to pass
+        self.assertLess(elapsed, 0.05)  # one after another this would take 3 rounds
+
+    def test_dissent_starts_another_judge_and_early_fail_cancels(self):
+        judge, calls, _ = make_judge([False, True, True])
+        self.assertTrue(asyncio.run(majority_vote(judge, 3)))
+        self.assertEqual(len(calls), 3)
+
+        async def slow_last():
+            # two quick failures decide it; the third judge is still running and gets cancelled
+            judge, calls, _ = make_judge([False, False, True])
+            delays = iter([0.0, 0.0, 1.0])
+
+            async def varied():
+                await asyncio.sleep(next(delays))
+                return await judge()
+
+            self.assertFalse(await majority_vote(varied, 3))
+            return calls
+
+        calls = asyncio.run(slow_last())
+        self.assertEqual(calls, [False, False])  # the third judge never got as far as asking
+
+    def test_judge_error_is_raised(self):
+        async def broken():
+            raise ValueError("no judgement")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(majority_vote(broken, 3))
+
+    def test_votes_on_several_things_at_once(self):
+        rounds = iter([[True, False, True], [True, False, False], [True, True, True]])
+        calls = []
+
+        async def judge():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return next(rounds)
+
+        self.assertEqual(asyncio.run(majority_vote_each(judge, 3, 3)), [True, False, True])
+        self.assertEqual(len(calls), 3)  # the third question was still undecided after two rounds
+
+    def test_each_check_gets_its_own_majority(self):
+        # question-only, answer-only, both: each check passes 2 to 1, so the question passes, as it would vetting the checks one at a time
+        rounds = iter([
+            [{"question": True, "answer": False}, {"question": False, "answer": False}],
+            [{"question": False, "answer": True}, {"question": True, "answer": False}],
+            [{"question": True, "answer": True}, {"question": True, "answer": False}],
+        ])
+
+        async def judge():
+            await asyncio.sleep(0.01)
+            return next(rounds)
+
+        self.assertEqual(asyncio.run(majority_vote_checks(judge, 3, 2, ["question", "answer"])), [True, False])
+
+
+if __name__ == "__main__":
+    unittest.main()
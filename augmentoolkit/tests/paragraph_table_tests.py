@@ -0,0 +1,26 @@
+import json
+import unittest
+
+from augmentoolkit.utils.group_by_text import group_by_text
+from augmentoolkit.utils.paragraph_table import intern_paragraph, paragraph_id
+
+
+class TestParagraphTable(unittest.TestCase):
+    def test_loaded_dicts_share_one_paragraph_and_group_by_id(self):
+        paragraph = "The Battle of Hastings was fought in 1066. " * 20
+        saved = [
+            json.dumps({"paragraph": paragraph, "question": f"Question {i}?", "answer": f"Answer {i}.", "paragraph_idx": 0, "question_idx": i})
+            for i in range(3)
+        ]
+        qa_dicts = [intern_paragraph(json.loads(body)) for body in saved]  # each json.loads makes its own copy of the paragraph
+        self.assertTrue(all(qa_dict["paragraph"] is qa_dicts[0]["paragraph"] for qa_dict in qa_dicts))
+        self.assertEqual({qa_dict["paragraph_id"] for qa_dict in qa_dicts}, {paragraph_id(paragraph)})
+
+        older = {"paragraph": "Another paragraph.", "question": "Q?", "answer": "A.", "paragraph_idx": 1, "question_idx": 0}  # saved before paragraph ids
+        groups = group_by_text(qa_dicts + [older])
+        self.assertEqual([len(group["dict_list"]) for group in groups], [3, 1])
+        self.assertIsNone(intern_paragraph(None))  # questions that failed vetting
+
+
+if __name__ == "__main__":
+    unittest.main()
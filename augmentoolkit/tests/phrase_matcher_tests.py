@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+import unittest
+
+from augmentoolkit.generation_functions.phrase_matcher import PhraseMatcher, filter_jsonl
+
+
+class TestPhraseMatcher(unittest.TestCase):
+    def test_matches_overlapping_phrases_ignoring_case_and_whitespace(self):
+        matcher = PhraseMatcher(["according to the text", "the text states"])
+        self.assertEqual(matcher.search("Who, ACCORDING to\nthe   text, won?"), "according to the text")
+        self.assertEqual(PhraseMatcher(["he", "she", "hers"]).find_all("ushers"), ["she", "he", "hers"])
+        self.assertNotIn("The passage says so.", PhraseMatcher(["the text states", " text"]))
+        self.assertIn("Nothing in the text.", PhraseMatcher([" text"]))
+
+    def test_from_file_and_streaming_filter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            phrases_path = os.path.join(tmp, "phrases.txt")
+            with open(phrases_path, "w", encoding="utf-8") as f:
+                f.write("# comment\n\nAs stated in\n")
+            matcher = PhraseMatcher.from_file(phrases_path)
+            self.assertEqual(matcher.phrases, ["as stated in"])
+
+            data_path = os.path.join(tmp, "data.jsonl")
+            lines = [
+                {"conversations": [{"from": "human", "value": "What happened?"}, {"from": "gpt", "value": "As stated in the text, a war."}]},
+                {"conversations": [{"from": "human", "value": "What happened?"}, {"from": "gpt", "value": "A war."}]},
+            ]
+            with open(data_path, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps(line) + "\n" for line in lines)
+            self.assertEqual(filter_jsonl(data_path, data_path, matcher), (1, 1))
+            with open(data_path, "r", encoding="utf-8") as f:
+                self.assertEqual([json.loads(line) for line in f], lines[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import re
+import tempfile
+import unittest
+from collections import Counter
+
+from augmentoolkit.generation_functions.dag_scheduler import DAGScheduler
+from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
+
+
+class FakeEngineWrapper:
+    mode = "api"
+    metrics_log = None
+
+    def __init__(self):
+        self.sampling_params_seen = []
+
+    async def submit_completion(self, prompt, sampling_params, **kwargs):
+        self.sampling_params_seen.append(sampling_params)
+        await asyncio.sleep(0)
+        return prompt + " done", False
+
+
+class TestPipelineStep(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        with open(os.path.join(self.tempdir.name, "step.txt"), "w", encoding="utf-8") as f:
+            f.write("Input: {text}")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def make_step(self, sampling_params, use_stop, **kwargs):
+        return PipelineStep(
+            prompt_path="step",
+            prompt_folder=self.tempdir.name,
+            default_prompt_folder=self.tempdir.name,
+            sampling_params=sampling_params,
+            output_dir=self.tempdir.name,
+            output_subdir="step_generations",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            completion_mode=True,
+            use_stop=use_stop,
+            regex=re.compile(r"Input: (.*)", re.DOTALL),
+            **kwargs,
+        )
+
+    def test_generator_is_reused_and_sampling_params_are_not_mutated(self):
+        sampling_params = {"max_tokens": 100, "stop": ["</s>"]}
+        step = self.make_step(sampling_params, use_stop=False)
+        engine_wrapper = FakeEngineWrapper()
+
+        async def run_many():
+            return await asyncio.gather(
+                *[step.generate_data({"text": str(i)}, engine_wrapper) for i in range(5)]
+            )
+
+        results = asyncio.run(run_many())
+        self.assertEqual([result for result, _ in results], [f"{i} done" for i in range(5)])
+        self.assertEqual(len(step.generators), 1)
+        self.assertEqual(sampling_params, {"max_tokens": 100, "stop": ["</s>"]})  # use_stop=False used to delete "stop" from this
+        for seen in engine_wrapper.sampling_params_seen:
+            self.assertNotIn("stop", seen)
+
+    def test_output_that_keeps_failing_validation_gives_up(self):
+        step = self.make_step({"max_tokens": 100}, use_stop=True, validation_function=lambda result, input_data: False, max_retries=3)
+        engine_wrapper = FakeEngineWrapper()
+        output_list = []
+        self.assertIsNone(asyncio.run(step.run(idx=0, input_data={"text": "a"}, engine_wrapper=engine_wrapper, output_list=output_list)))
+        self.assertEqual(len(engine_wrapper.sampling_params_seen), 3)
+        self.assertEqual(output_list, [])
+
+    def test_one_step_concurrency_limit_caps_the_scheduler_step_and_its_requests(self):
+        # STEP_CONCURRENCY_LIMITS is looked up by the step's name in the metrics table (its output_subdir) both by the OVERLAP_PHASES scheduler and by EngineWrapper
+        limits = {"step_generations": 1}
+        step = self.make_step({"max_tokens": 100}, use_stop=True)
+        engine_wrapper = EngineWrapper(model="model", base_url="http://127.0.0.1:8080/v1")
+        in_flight, most = Counter(), Counter()
+
+        async def fake_run_hedged(stream_function, prompt, sampling_params, step_name, metrics=None):
+            in_flight[step_name] += 1
+            most[step_name] = max(most[step_name], in_flight[step_name])
+            await asyncio.sleep(0.01)
+            in_flight[step_name] -= 1
+            return " done", False
+
+        engine_wrapper.run_hedged = fake_run_hedged
+        self.addCleanup(EngineWrapper.set_step_concurrency_limits, {})
+
+        async def through_the_scheduler():
+            EngineWrapper.set_step_concurrency_limits(limits)
+            dag = DAGScheduler(4)
+
+            async def generate(idx):
+                async with dag.limit("generate"):
+                    in_flight["scheduler"] += 1
+                    most["scheduler"] = max(most["scheduler"], in_flight["scheduler"])
+                    await step.run(idx=idx, input_data={"text": str(idx)}, engine_wrapper=engine_wrapper, output_list=[])
+                    in_flight["scheduler"] -= 1
+                return []
+
+            dag.add_step("generate", generate, max_concurrency=limits.get(step.output_subdir))
+            await dag.run(range(4))
+
+        async def phase_by_phase():
+            EngineWrapper.set_step_concurrency_limits(limits)
+            await asyncio.gather(*[step.run(idx=idx, input_data={"text": str(idx)}, engine_wrapper=engine_wrapper, output_list=[]) for idx in range(4, 8)])
+
+        asyncio.run(through_the_scheduler())
+        asyncio.run(phase_by_phase())
+        self.assertEqual(most, {"scheduler": 1, "step_generations": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
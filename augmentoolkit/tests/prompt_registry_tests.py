@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+import unittest
+
+from augmentoolkit.generation_functions.prompt_registry import PromptRegistry
+from augmentoolkit.generation_functions.safe_formatter import CompiledTemplate, safe_format
+
+
+class TestCompiledTemplate(unittest.TestCase):
+    def assert_same_as_safe_format(self, format_string, **kwargs):
+        try:
+            expected = safe_format(format_string, **kwargs)
+        except Exception as e:
+            with self.assertRaises(type(e)):
+                CompiledTemplate(format_string).format(**kwargs)
+            return
+        self.assertEqual(CompiledTemplate(format_string).format(**kwargs), expected)
+
+    def test_matches_safe_format(self):
+        cases = [
+            "Text: {text}\nName: {textname}",
+            "missing {nothing_here} stays",
+            "escaped {{braces}} and {text}",
+            'json {"key": "value"} in a prompt',
+            "spec {text:>20} and conversion {text!r}",
+            "attribute {text.__class__.__name__} and index {text[0]}",
+            "positional {0} and auto {}",
+            "unbalanced { brace",
+            "unbalanced } brace",
+            "",
+        ]
+        for case in cases:
+            with self.subTest(case=case):
+                self.assert_same_as_safe_format(case, text="hello", textname="file.txt")
+                self.assert_same_as_safe_format(case)
+
+
+class TestPromptRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.override = os.path.join(self.tempdir.name, "override")
+        self.default = os.path.join(self.tempdir.name, "default")
+        os.makedirs(self.override)
+        os.makedirs(self.default)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def write(self, folder, name, text):
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_override_folder_and_chat_templates(self):
+        self.write(self.default, "a.txt", "default {x}")
+        self.write(self.default, "b.txt", "default b {x}")
+        self.write(self.override, "a.txt", "override {x}")
+        self.write(self.default, "c.yaml", "- role: system\n  content: |\n    Be {adjective}.\n- role: user\n  content: 5\n")
+        registry = PromptRegistry()
+        self.assertEqual(registry.get(self.override, self.default, "a.txt").format(x=1), "override 1")
+        self.assertEqual(registry.get(self.override, self.default, "b.txt").format(x=1), "default b 1")
+        messages = registry.get(self.override, self.default, "c.yaml", chat=True).format(adjective="brief")
+        self.assertEqual(messages, [{"role": "system", "content": "Be brief.\n"}, {"role": "user", "content": 5}])
+
+    def test_reload_on_change(self):
+        self.write(self.default, "a.txt", "first {x}")
+        cached = PromptRegistry()
+        reloading = PromptRegistry(reload_on_change=True)
+        self.assertEqual(cached.get(self.override, self.default, "a.txt").format(x=1), "first 1")
+        self.assertEqual(reloading.get(self.override, self.default, "a.txt").format(x=1), "first 1")
+
+        self.write(self.default, "a.txt", "second {x}")
+        later = time.time() + 10
+        os.utime(os.path.join(self.default, "a.txt"), (later, later))
+        self.assertEqual(cached.get(self.override, self.default, "a.txt").format(x=1), "first 1")
+        self.assertEqual(reloading.get(self.override, self.default, "a.txt").format(x=1), "second 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
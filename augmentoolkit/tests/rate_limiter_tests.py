@@ -0,0 +1,49 @@
+import asyncio
+import time
+import unittest
+
+from augmentoolkit.generation_functions.rate_limiter import RateLimiter, TokenBucket
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_bucket_refills_over_time(self):
+        bucket = TokenBucket(6000)  # 100 per second
+        bucket.take(6000)
+        self.assertGreater(bucket.wait_time(50), 0.3)
+        time.sleep(0.2)
+        self.assertLess(bucket.wait_time(10), 0.01)
+
+    def test_requests_wait_for_budget(self):
+        limiter = RateLimiter(requests_per_minute=600)  # one every 0.1s once the burst is used up
+
+        async def run():
+            for _ in range(600):
+                await limiter.acquire(0)
+            start = time.monotonic()
+            await limiter.acquire(0)
+            await limiter.acquire(0)
+            return time.monotonic() - start
+
+        self.assertGreater(asyncio.run(run()), 0.15)
+        self.assertGreaterEqual(limiter.stats()["waits"], 2)
+
+    def test_oversized_requests_are_clamped_and_unused_tokens_refunded(self):
+        limiter = RateLimiter(tokens_per_minute=1000)
+
+        async def run():
+            return await limiter.acquire(5000)
+
+        reserved = asyncio.run(run())
+        self.assertEqual(reserved, 1000)
+        limiter.settle(reserved, 200)
+        self.assertAlmostEqual(limiter.token_bucket.available, 800, delta=1)
+
+    def test_rate_limit_error_drains_budget(self):
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=10000)
+        limiter.record_rate_limit_error()
+        self.assertGreater(limiter.request_bucket.wait_time(1), 0.5)
+        self.assertEqual(limiter.stats()["rate_limit_errors"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+import unittest
+
+from augmentoolkit.generation_functions.request_metrics import MetricsLog, RequestMetrics
+
+
+def make_entry(step, latency, queue_wait=0.0, ttft=0.5, completion_tokens=100, cached=False, failure=None, retries=0):
+    return {
+        "step": step,
+        "model": "m",
+        "kind": "chat",
+        "cached": cached,
+        "queue_wait": queue_wait,
+        "ttft": ttft,
+        "latency": latency,
+        "prompt_tokens": 100,
+        "completion_tokens": completion_tokens,
+        "retries": retries,
+        "hedged": False,
+        "timed_out": False,
+        "errors": [],
+        "failure": failure,
+    }
+
+
+class TestMetricsLog(unittest.TestCase):
+    def test_summary_by_step(self):
+        log = MetricsLog()
+        log.record(make_entry("judge", 2.0, queue_wait=1.0))
+        log.record(make_entry("judge", 3.0, queue_wait=1.0, retries=2))
+        log.record(make_entry("judge", 0.0, cached=True))
+        log.record(make_entry("story", 10.0, completion_tokens=700, failure="server_error"))
+        log.record_failed_attempt("story", AttributeError("'NoneType' object has no attribute 'group'"))
+
+        rows = {row["step"]: row for row in log.summary_rows()}
+        self.assertEqual(rows["judge"]["requests"], 3)
+        self.assertEqual(rows["judge"]["cached"], 1)
+        self.assertEqual(rows["judge"]["retries"], 2)
+        self.assertAlmostEqual(rows["judge"]["avg_queue_wait"], 1.0)  # cached requests never queued, so they don't count
+        self.assertAlmostEqual(rows["judge"]["tokens_per_second"], 200 / 3.0)  # queue time isn't generation time
+        self.assertEqual(rows["story"]["failed"], 1)
+        self.assertEqual(rows["story"]["failed_attempts"], 1)
+        self.assertAlmostEqual(rows["story"]["share_of_tokens"], 800 / 1200)
+
+        self.assertIn("judge", log.format_summary("phase 0"))
+        log.print_summary("phase 0")
+        self.assertEqual(log.summary_rows(), [])  # each phase gets its own table
+
+    def test_writes_jsonl(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, "request_metrics.jsonl")
+            log = MetricsLog(path)
+            metrics = RequestMetrics("judge", "m", "completion", prompt_tokens=10)
+            metrics.mark_sent()
+            metrics.mark_first_token()
+            log.record(metrics.finish("some output"))
+            log.record_failed_attempt("judge", ValueError("bad"))
+            log.close()
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(lines[0]["step"], "judge")
+        self.assertIsNotNone(lines[0]["ttft"])
+        self.assertEqual(lines[1]["reason"], "unusable_output")
+
+
+if __name__ == "__main__":
+    unittest.main()
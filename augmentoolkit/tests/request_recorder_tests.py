@@ -0,0 +1,59 @@
+import os
+import random
+import tempfile
+import unittest
+
+from augmentoolkit.generation_functions.request_recorder import ReplayLog, RequestRecorder, seed_random
+
+
+class TestRequestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "request_log.jsonl")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_replay_returns_recorded_responses_in_order(self):
+        messages = [{"role": "user", "content": "hi"}]
+        recorder = RequestRecorder(self.path)
+        recorder.record("chat", "model-a", messages, {"temperature": 1}, "first", 1.5, "step")
+        recorder.record("chat", "model-a", messages, {"temperature": 1}, "second", 2.0, "step")
+        recorder.record("completion", "model-a", "prompt", {}, "completed", 0.5)
+        recorder.close()
+
+        replay_log = ReplayLog(self.path)
+        self.assertEqual(len(replay_log), 3)
+        # Identical requests get the recorded responses in turn, then wrap around
+        self.assertEqual(replay_log.lookup("chat", messages), ("first", 1.5))
+        self.assertEqual(replay_log.lookup("chat", messages), ("second", 2.0))
+        self.assertEqual(replay_log.lookup("chat", messages), ("first", 1.5))
+        self.assertEqual(replay_log.lookup("completion", "prompt"), ("completed", 0.5))
+
+    def test_unrecorded_request_is_a_miss(self):
+        recorder = RequestRecorder(self.path)
+        recorder.record("completion", "model-a", "prompt", {}, "completed", 0.5)
+        recorder.close()
+
+        replay_log = ReplayLog(self.path)
+        self.assertIsNone(replay_log.lookup("chat", "prompt"))  # same text, different endpoint
+        self.assertIsNone(replay_log.lookup("completion", "another prompt"))
+        self.assertEqual(replay_log.stats(), {"recorded": 1, "hits": 0, "misses": 2})
+
+    def test_seed_is_recorded_and_reproduces_the_same_choices(self):
+        seed = seed_random()
+        recorded_choice = random.choice(["example a", "example b", "example c", "example d"])
+        recorder = RequestRecorder(self.path, seed=seed)
+        recorder.record("completion", "model-a", f"prompt with {recorded_choice}", {}, "completed", 0.5)
+        recorder.close()
+
+        replay_log = ReplayLog(self.path)
+        self.assertEqual(replay_log.seeds, [seed])
+        self.assertEqual(len(replay_log), 1)  # the header isn't a response
+        self.assertEqual(seed_random(replay_log.seeds[0]), seed)
+        replayed_choice = random.choice(["example a", "example b", "example c", "example d"])
+        self.assertEqual(replay_log.lookup("completion", f"prompt with {replayed_choice}"), ("completed", 0.5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+import unittest
+
+from augmentoolkit.generation_functions.response_cache import ResponseCache, make_cache_key
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tempdir.name, "cache.sqlite")
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_key_is_content_addressed(self):
+        key_a = make_cache_key(model="m", input=[{"role": "user", "content": "hi"}], attempt=0)
+        key_b = make_cache_key(attempt=0, input=[{"role": "user", "content": "hi"}], model="m")
+        key_c = make_cache_key(model="m", input=[{"role": "user", "content": "hi"}], attempt=1)
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_a, key_c)
+
+    def test_hit_miss_and_persistence(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "response a")
+        self.assertEqual(cache.get("a"), "response a")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        cache.close()
+
+        reopened = ResponseCache(self.path)
+        self.assertEqual(reopened.get("a"), "response a")
+        self.assertEqual(reopened.total_size, len("response a"))
+        reopened.close()
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(self.path, max_size_bytes=20)
+        cache.put("a", "x" * 8)
+        time.sleep(0.01)
+        cache.put("b", "y" * 8)
+        time.sleep(0.01)
+        cache.get("a")  # a is now more recently used than b
+        time.sleep(0.01)
+        cache.put("c", "z" * 8)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "x" * 8)
+        self.assertEqual(cache.get("c"), "z" * 8)
+        self.assertLessEqual(cache.total_size, 20)
+        cache.close()
+
+    def test_age_eviction(self):
+        cache = ResponseCache(self.path, max_age_seconds=0.05)
+        cache.put("a", "old")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.total_size, 0)
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
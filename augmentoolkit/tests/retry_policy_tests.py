@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+
+from augmentoolkit.generation_functions import retry_policy
+from augmentoolkit.generation_functions.retry_policy import RetryPolicy, ValidationFailed, failure_kind, set_retry_budget
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def tearDown(self):
+        set_retry_budget(None)
+
+    def test_failure_kinds_and_backoff(self):
+        self.assertEqual(failure_kind(RateLimitError()), "transient")
+        self.assertEqual(failure_kind(ValidationFailed()), "semantic")
+        try:
+            try:
+                raise RateLimitError()
+            except RateLimitError as e:
+                raise Exception("Generation step failed -- too many retries!") from e
+        except Exception as wrapped:
+            self.assertEqual(failure_kind(wrapped), "transient")
+
+        policy = RetryPolicy(base_delay=1.0, max_delay=8.0)
+        self.assertEqual(policy.backoff(0, ValidationFailed()), 0.0)
+        for retry_number in range(6):
+            self.assertLessEqual(policy.backoff(retry_number, RateLimitError()), min(8.0, 2**retry_number))
+
+    def test_validation_failures_run_out_of_tries(self):
+        budget = set_retry_budget(None)
+        calls = []
+
+        async def attempt():
+            calls.append(1)
+            raise ValidationFailed("nope")
+
+        with self.assertRaises(ValidationFailed):
+            asyncio.run(RetryPolicy(retries=2).run(attempt, "story_generation"))
+        self.assertEqual(len(calls), 3)  # validation failures count as tries, so this can't loop forever
+        self.assertEqual(budget.stats()["story_generation"], {"semantic": 2, "gave_up": 1, "backoff_seconds": 0})
+
+    def test_budget_is_shared_across_the_run(self):
+        budget = set_retry_budget(3)
+        self.assertIs(retry_policy.retry_budget, budget)
+        outcomes = iter([ValidationFailed(), ValidationFailed(), "ok"])
+
+        async def flaky():
+            outcome = next(outcomes)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        async def always_fails():
+            raise ValidationFailed()
+
+        async def run():
+            self.assertEqual(await RetryPolicy(retries=5).run(flaky, "a"), "ok")
+            with self.assertRaises(ValidationFailed):
+                await RetryPolicy(retries=5).run(always_fails, "b")
+
+        asyncio.run(run())
+        self.assertEqual(budget.by_step["a"]["semantic"], 2)
+        self.assertEqual(budget.by_step["b"]["semantic"], 1)  # only one retry was left in the budget
+        self.assertEqual(budget.by_step["b"]["budget_exhausted"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
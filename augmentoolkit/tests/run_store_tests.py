@@ -0,0 +1,150 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from augmentoolkit.generation_functions import run_store
+from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
+from augmentoolkit.generation_functions.run_store import FileStore, SQLiteStore, close_run_stores, open_run_store, store_for
+from augmentoolkit.generation_functions.transcript import Transcript, read_transcripts
+from augmentoolkit.utils.write_output_to_file import write_output_to_file
+
+
+class TestRunStore(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        close_run_stores()
+        self.tempdir.cleanup()
+
+    def test_sqlite_store_batches_and_survives_reopening(self):
+        store = SQLiteStore(self.tempdir.name, batch_size=3)
+        path = lambda name: os.path.join(self.tempdir.name, "step", "saved", name)
+        store.write(path("1.json"), "one")
+        store.write(path("2.json"), "two")
+        self.assertEqual(store.read(path("1.json")), "one")  # read back before it's committed
+        self.assertEqual(SQLiteStore(self.tempdir.name).read(path("1.json")), None)  # not committed yet, so a crash now would lose it
+        store.write(path("para_3_q_0.json"), "three")
+        self.assertEqual(SQLiteStore(self.tempdir.name).read(path("1.json")), "one")  # the batch filled up and was committed
+
+        store.write(path("para_3_q_1.json"), "four")
+        store.close()
+        reopened = SQLiteStore(self.tempdir.name)
+        self.assertEqual(reopened.glob(path("para_3_*.json")), [path("para_3_q_0.json"), path("para_3_q_1.json")])
+        self.assertTrue(reopened.isdir(os.path.join(self.tempdir.name, "step", "saved")))
+        self.assertFalse(reopened.isdir(os.path.join(self.tempdir.name, "other")))
+        self.assertFalse(os.path.exists(path("1.json")))  # nothing was written as a file
+        reopened.close()
+
+    def test_pipeline_step_saves_and_resumes_from_sqlite(self):
+        open_run_store(self.tempdir.name, "sqlite")
+        step = PipelineStep(
+            prompt_path="step",
+            sampling_params={},
+            output_dir=self.tempdir.name,
+            output_subdir="step_generations",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            result_key="result",
+        )
+        output_list = []
+        step.save(result="answer", full_output=Transcript([{"role": "user", "content": "q"}], "answer", False), idx=0, output_list=output_list, input_data={"text": "q"})
+        close_run_stores()  # like the end of a run (or a sys.exit between phases)
+
+        self.assertEqual(os.listdir(self.tempdir.name), ["run_store.sqlite"])  # no per-item files or folders
+
+        open_run_store(self.tempdir.name, "sqlite")
+        resumed = []
+        self.assertTrue(step.read_previous_output(0, resumed))
+        self.assertFalse(step.read_previous_output(1, resumed))
+        self.assertEqual(resumed, [{"text": "q", "result": "answer"}])
+        intermediate = os.path.join(self.tempdir.name, "step_generations", "intermediate")
+        self.assertEqual(read_transcripts(intermediate)[0][-1]["content"], "answer")
+
+    def test_manifest_is_one_listing_kept_up_to_date_by_writes(self):
+        directory = os.path.join(self.tempdir.name, "saved")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "0.json"), "w", encoding="utf-8") as f:
+            f.write("zero")
+        store = FileStore()
+        self.assertTrue(store.exists(os.path.join(directory, "0.json")))
+        with open(os.path.join(directory, "1.json"), "w", encoding="utf-8") as f:
+            f.write("one")
+        self.assertIsNone(store.read(os.path.join(directory, "1.json")))  # the folder was already listed; no probing per item
+        store.write(os.path.join(directory, "2.json"), "two")
+        self.assertEqual(store.read(os.path.join(directory, "2.json")), "two")
+        self.assertEqual(FileStore().glob(os.path.join(directory, "*.json")), [os.path.join(directory, f"{i}.json") for i in range(3)])
+
+    def test_corrupted_file_is_regenerated(self):
+        step = PipelineStep(
+            prompt_path="step",
+            sampling_params={},
+            output_dir=self.tempdir.name,
+            output_subdir="step_generations",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            result_key="result",
+        )
+        step.save(result="answer", full_output="output", idx=0, output_list=[], input_data={"text": "q"})
+        save_path_file = step.make_save_path_file(0)
+        self.assertEqual([name for name in os.listdir(os.path.dirname(save_path_file)) if name.endswith(".tmp")], [])
+        with open(save_path_file, "w", encoding="utf-8") as f:
+            f.write('{"text": "q", "res')  # what a crash mid-write used to leave
+
+        self.assertIsNone(FileStore().read(save_path_file))  # a restarted run checks it against the .checksums log
+        resumed = []
+        self.assertFalse(step.read_previous_output(0, resumed))
+        self.assertEqual(resumed, [])
+
+    def test_resume_regenerates_files_corrupted_since_the_last_run(self):
+        with open(os.path.join(self.tempdir.name, "step.yaml"), "w", encoding="utf-8") as f:
+            f.write("- role: user\n  content: \"{text}\"\n")
+
+        class FakeEngineWrapper:
+            mode = "api"
+            metrics_log = None
+            calls = 0
+
+            async def submit_chat(self, messages, sampling_params, **kwargs):
+                FakeEngineWrapper.calls += 1
+                return f"answer {FakeEngineWrapper.calls}", False
+
+        step = PipelineStep(
+            prompt_path="step",
+            prompt_folder=self.tempdir.name,
+            default_prompt_folder=self.tempdir.name,
+            sampling_params={"max_tokens": 100},
+            output_dir=self.tempdir.name,
+            output_subdir="step_generations",
+            save_path="saved",
+            intermediate_output_path="intermediate",
+            result_key="result",
+            completion_mode=False,
+        )
+        asyncio.run(step.run(idx=0, input_data={"text": "q"}, engine_wrapper=FakeEngineWrapper(), output_list=[]))
+        intermediate = os.path.join(self.tempdir.name, "step_generations", "intermediate")
+        [transcript_name] = [name for name in os.listdir(intermediate) if not name.startswith(".")]  # not .checksums
+        for path in (step.make_save_path_file(0), os.path.join(intermediate, transcript_name)):
+            with open(path, "r+b") as f:  # cut off by a crash
+                f.truncate(5)
+
+        with mock.patch.object(run_store, "file_store", FileStore()):  # a restarted run
+            self.assertEqual(read_transcripts(intermediate), [])
+            resumed = []
+            asyncio.run(step.run(idx=0, input_data={"text": "q"}, engine_wrapper=FakeEngineWrapper(), output_list=resumed))
+            self.assertEqual(resumed, [{"text": "q", "result": "answer 2"}])
+            self.assertEqual([transcript[-1]["content"] for transcript in read_transcripts(intermediate)], ["answer 2"])
+
+    def test_files_backend_is_the_usual_layout(self):
+        self.assertIs(open_run_store(self.tempdir.name, "files"), store_for(self.tempdir.name))
+        write_output_to_file("some output", self.tempdir.name, "abc")
+        with open(os.path.join(self.tempdir.name, "abc.yaml"), "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "some output")
+        with self.assertRaises(ValueError):
+            open_run_store(self.tempdir.name, "postgres")
+
+
+if __name__ == "__main__":
+    unittest.main()
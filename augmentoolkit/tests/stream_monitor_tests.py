@@ -0,0 +1,53 @@
+import unittest
+
+from augmentoolkit.generation_functions.request_errors import StreamValidationError, classify_exception
+from augmentoolkit.generation_functions.stream_monitor import StreamMonitor
+
+
+class TestStreamMonitor(unittest.TestCase):
+    def test_collects_text_without_checks(self):
+        monitor = StreamMonitor()
+        for piece in ["a", "b", "c"] * 100:
+            self.assertFalse(monitor.feed(piece))
+        self.assertEqual(monitor.text, "abc" * 100)
+
+    def test_validator_aborts_with_partial_output(self):
+        monitor = StreamMonitor(stream_validators=[lambda text: "bad" not in text], check_interval=10)
+        with self.assertRaises(StreamValidationError) as context:
+            for piece in ["good "] * 3 + ["bad "] * 10:
+                monitor.feed(piece)
+        self.assertIn("bad", context.exception.partial_output)
+        self.assertLess(len(context.exception.partial_output), 30)
+        self.assertEqual(classify_exception(context.exception), "invalid_output")
+
+    def test_stop_when_keeps_output(self):
+        monitor = StreamMonitor(stop_when=[lambda text: text.count("\n") >= 3], check_interval=5)
+        pieces = ["line\n"] * 10
+        for piece in pieces:
+            if monitor.feed(piece):
+                break
+        self.assertTrue(monitor.stopped_early)
+        self.assertEqual(monitor.text, "line\n" * 3)
+
+    def test_stateful_check_gets_an_instance_per_stream(self):
+        class LinesSoFar:
+            # only looks at the text it hasn't seen yet
+            def __init__(self):
+                self.seen = 0
+                self.lines = 0
+
+            def __call__(self, text):
+                self.lines += text[self.seen :].count("\n")
+                self.seen = len(text)
+                return self.lines >= 3
+
+        for _ in range(2):  # a second stream starts from scratch rather than where the first left off
+            monitor = StreamMonitor(stop_when=[LinesSoFar], check_interval=5)
+            for piece in ["line\n"] * 10:
+                if monitor.feed(piece):
+                    break
+            self.assertEqual(monitor.text, "line\n" * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
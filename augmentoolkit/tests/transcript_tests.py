@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from augmentoolkit.generation_functions import transcript
+from augmentoolkit.generation_functions.transcript import Transcript, read_transcripts, set_transcript_format
+from augmentoolkit.utils.write_output_to_file import write_output_to_file
+
+
+class TestTranscript(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.messages = [
+            {"role": "system", "content": "Be brief."},
+            {"role": "user", "content": "Über: what's 2+2?"},
+        ]
+
+    def tearDown(self):
+        set_transcript_format("yaml")
+        self.tempdir.cleanup()
+
+    def test_yaml_matches_old_full_output(self):
+        full_output = Transcript(self.messages, "4", False)
+        old_full_output = yaml.dump(
+            self.messages + [{"role": "assistant", "content": "4", "timeout": False}],
+            default_flow_style=False,
+            allow_unicode=True,
+        )
+        self.assertEqual(str(full_output), old_full_output)
+        write_output_to_file(full_output, self.tempdir.name, "abc")
+        with open(os.path.join(self.tempdir.name, "abc.yaml"), "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), old_full_output)
+
+    def test_every_format_reads_back_the_same(self):
+        expected = self.messages + [{"role": "assistant", "content": "4", "timeout": False}]
+        for format_name in transcript.TRANSCRIPT_FORMATS:
+            with self.subTest(format_name=format_name):
+                directory = os.path.join(self.tempdir.name, format_name)
+                set_transcript_format(format_name)
+                write_output_to_file(Transcript(self.messages, "5", False), directory, "a")
+                write_output_to_file(Transcript(self.messages, "4", False), directory, "a")  # overwrites, in every format
+                write_output_to_file(Transcript(self.messages, "4", False), directory, "b")
+                self.assertEqual(read_transcripts(directory), [expected, expected])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            set_transcript_format("xml")
+
+
+if __name__ == "__main__":
+    unittest.main()
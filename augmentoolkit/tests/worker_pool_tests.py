@@ -0,0 +1,63 @@
+import asyncio
+import unittest
+
+from augmentoolkit.generation_functions.worker_pool import run_pool
+
+
+class FakeProgressBar:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+class TestRunPool(unittest.TestCase):
+    def test_bounded_and_lazy(self):
+        pulled = []
+        running = []
+        peak = []
+        done = []
+
+        def inputs():
+            for i in range(20):
+                pulled.append(i)
+                peak.append(len(pulled) - len(done))  # items read but not finished yet
+                yield i
+
+        async def work(item):
+            running.append(item)
+            await asyncio.sleep(0.001 * (item % 3))
+            running.remove(item)
+            done.append(item)
+
+        progress_bar = FakeProgressBar()
+        asyncio.run(run_pool(work, inputs(), 3, progress_bar=progress_bar))
+        self.assertEqual(sorted(done), list(range(20)))
+        self.assertLessEqual(max(peak), 3)  # the generator is only advanced when a worker is free
+        self.assertEqual(progress_bar.n, 20)
+
+    def test_async_iterator_and_errors(self):
+        seen = []
+
+        async def inputs():
+            for i in range(5):
+                await asyncio.sleep(0)
+                yield i
+
+        async def work(item):
+            seen.append(item)
+
+        asyncio.run(run_pool(work, inputs(), 2))
+        self.assertEqual(sorted(seen), list(range(5)))
+
+        async def fails(item):
+            if item == 2:
+                raise ValueError("bad item")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(run_pool(fails, range(10), 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,12 @@
-import yaml
-import os
+from augmentoolkit.generation_functions.transcript import read_transcripts
 
 
-def convert_logging_to_dataset(dir_path)
\ No newline at end of file
+def convert_logging_to_dataset(dir_path):
+    # Turns every saved transcript in a folder (yaml, json or jsonl) into a sharegpt-style conversation
+    conversations = []
+    for messages in read_transcripts(dir_path):
+        sysprompt = {"from": "system", "value": messages[0]["content"]}
+        input = {"from": "human", "value": messages[-2]["content"]}
+        output = {"from": "gpt", "value": messages[-1]["content"]}
+        conversations.append({"conversations": [sysprompt, input, output]})
+    return conversations
@@ -1,25 +1,26 @@
 from augmentoolkit.generation_functions.format_qadicts import format_qadicts
 from augmentoolkit.generation_functions.identify_duplicates import identify_duplicates
+from augmentoolkit.utils.paragraph_table import paragraph_id
 import sys
 import traceback
 
 def group_by_text(dicts_list):
-    # Dictionary to hold the groups with text as the key
+    # Dictionary to hold the groups with the paragraph's id as the key (rather than the whole paragraph; see paragraph_table)
     groups = {}
 
     # Iterate over each tuple in the list
     for dict in dicts_list:
-        # If the text is not yet a key in the dictionary, add it with an empty list
-        text = dict["paragraph"]
-        if text not in groups:
-            groups[text] = {
+        # If the paragraph is not yet a key in the dictionary, add it with an empty list
+        key = dict.get("paragraph_id") or paragraph_id(dict["paragraph"]) # dicts saved before paragraph ids existed get theirs here
+        if key not in groups:
+            groups[key] = {
                 "dict_list": [],
                 "question_answer_pairs_string": "",
             }
                             
 
         # Append the current tuple to the appropriate list
-        groups[text]['dict_list'].append(dict)
+        groups[key]['dict_list'].append(dict)
     
     # Iterate over the dictionary to create the question-answer pairs string
     for key, value in groups.items():
@@ -0,0 +1,34 @@
+import hashlib
+
+# QA dicts used to each carry their own copy of their paragraph (every dict loaded from a saved file gets a fresh string), so memory grew with questions x paragraph length.
+# Now each paragraph's text is kept once, in the run's paragraph table; QA dicts get a paragraph_id (a hash of the text, so it's the same across runs and resumes) and their "paragraph" points at the table's one copy.
+
+
+def paragraph_id(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+class ParagraphTable:
+    def __init__(self):
+        self.paragraphs = {}  # paragraph_id -> text
+
+    def intern(self, text):
+        # Returns the text's id and the table's copy of it
+        pid = paragraph_id(text)
+        return pid, self.paragraphs.setdefault(pid, text)
+
+    def get(self, pid):
+        return self.paragraphs[pid]
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+
+paragraph_table = ParagraphTable()  # one per run, shared by every step
+
+
+def intern_paragraph(qa_dict):
+    # Swaps a QA dict's paragraph for the shared copy and tags it with the paragraph's id. Returns the dict, so it can wrap json.loads; None (a question that failed) passes through
+    if qa_dict is not None and qa_dict.get("paragraph") is not None:
+        qa_dict["paragraph_id"], qa_dict["paragraph"] = paragraph_table.intern(qa_dict["paragraph"])
+    return qa_dict
@@ -1,16 +1,20 @@
 import os
 
+from augmentoolkit.generation_functions.run_store import store_for
+from augmentoolkit.generation_functions.transcript import Transcript
 
-def write_output_to_file(output, directory, uuid):
-    # Ensure directory exists
-    if not os.path.exists(directory):
-        os.makedirs(directory)
+
+def write_output_to_file(output, directory, uuid, extension=".yaml"):
+    # Chat-mode full outputs are Transcripts, which serialize themselves in whichever format TRANSCRIPT_FORMAT picked
+    if isinstance(output, Transcript):
+        file_path = output.write(directory, uuid)
+        print(f"Output written to {file_path}")
+        return
 
     # Define the file path using the directory and UUID
-    file_path = os.path.join(directory, f"{uuid}.yaml")
+    file_path = os.path.join(directory, f"{uuid}{extension}")
 
-    # Write the output to the file using UTF-8 encoding
-    with open(file_path, "w", encoding="utf-8") as file:
-        file.write(output)
+    # Write the output to the file (or the run store, if STORAGE_BACKEND is sqlite) using UTF-8 encoding
+    store_for(directory).write(file_path, output)
 
-    print(f"Output written to {file_path}")
\ No newline at end of file
+    print(f"Output written to {file_path}")
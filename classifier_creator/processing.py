@@ -22,10 +22,16 @@ async def main():
 
     from steps import all_labels_same, create_label, create_rules, run_classifier, save_train_set, train_classifier, fix_text
     from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+    from augmentoolkit.generation_functions.llamacpp_client import close_shared_session
+    from augmentoolkit.generation_functions.request_recorder import RequestRecorder, seed_random
+    from augmentoolkit.generation_functions.request_metrics import MetricsLog
+    from augmentoolkit.generation_functions.transcript import set_transcript_format
+    from augmentoolkit.generation_functions.run_store import close_run_stores, open_run_store, store_for
+    from augmentoolkit.generation_functions.retry_policy import set_retry_budget
     config_path = os.environ["CONFIG_PATH"]
     with open(config_path, "r") as f: # different yaml file for different pipes
         config = yaml.safe_load(f)
-    random.seed(1048596)
+    RANDOM_SEED = seed_random(config["SYSTEM"].get("RANDOM_SEED") or 1048596) # the same every run unless the config says otherwise; written to the request log so a replay can use it too
         
     if not os.path.exists(config["PATH"]["OUTPUT"]):
         os.makedirs(config["PATH"]["OUTPUT"])
@@ -38,6 +44,10 @@ async def main():
         "CONCURRENCY_LIMIT"
     ])  # Adjust this number based on the rate limit constraints of your api
 
+    MAX_CONCURRENCY_LIMIT = int(config["SYSTEM"].get(
+        "MAX_CONCURRENCY_LIMIT", CONCURRENCY_LIMIT * 4
+    ))  # CONCURRENCY_LIMIT is only the starting point; requests in flight grow while the API keeps up and back off on rate limits/errors/slowdowns, never going above this
+
     API_KEY = config["API"]["API_KEY"]
 
     BASE_URL = config["API"][
@@ -46,8 +56,34 @@ async def main():
 
     COMPLETION_MODE = parse_bool(config["SYSTEM"]["COMPLETION_MODE"])
 
+    USE_STREAMING = parse_bool(config["SYSTEM"].get("USE_STREAMING", True))
+
+    HEDGE_PERCENTILE = float(config["SYSTEM"].get("HEDGE_PERCENTILE", 0)) or None
+
+    RECORD_REQUESTS = parse_bool(config["SYSTEM"].get("RECORD_REQUESTS", False))
+
+    REQUEST_METRICS = parse_bool(config["SYSTEM"].get("REQUEST_METRICS", True))
+
+    TRANSCRIPT_FORMAT = config["SYSTEM"].get("TRANSCRIPT_FORMAT", "yaml")
+    set_transcript_format(TRANSCRIPT_FORMAT)
+
+    STORAGE_BACKEND = config["SYSTEM"].get("STORAGE_BACKEND", "files")
+    open_run_store(config["PATH"]["OUTPUT"], STORAGE_BACKEND)
+
+    STEP_CONCURRENCY_LIMITS = config["SYSTEM"].get("STEP_CONCURRENCY_LIMITS") or {}
+    EngineWrapper.set_step_concurrency_limits(STEP_CONCURRENCY_LIMITS)
+
+    RETRY_BUDGET = int(config["SYSTEM"].get("RETRY_BUDGET", 0))
+    retry_budget = set_retry_budget(RETRY_BUDGET)
+
     MODE = config["SYSTEM"]["MODE"]
 
+    # Optional provider quotas (0 means no limit); requests wait for budget instead of getting rate limited
+    REQUESTS_PER_MINUTE = int(config["API"].get("REQUESTS_PER_MINUTE", 0)) or None
+    TOKENS_PER_MINUTE = int(config["API"].get("TOKENS_PER_MINUTE", 0)) or None
+
+    ENDPOINT_WEIGHTS = config["API"].get("ENDPOINT_WEIGHTS") # BASE_URL and API_KEY can be lists of identical servers to load balance across; this optional list is each one's relative capacity
+
     INPUT_FOLDER = os.path.abspath(config["PATH"]["INPUT"])
     
     USER_CLASSES = parse_string_list.parse_string_list(config["CLASSIFICATION"]["CLASSES"]) # Something like ["happy", "sad", "angry"] or ["great", "bad"] or ["mature", "safe"] --- a list of classes
@@ -110,36 +146,48 @@ async def main():
     print(chunks[0])
     print("-----------------")
         
-    from tqdm import asyncio as tqdmasyncio
+    from tqdm import tqdm
     import asyncio
+    from augmentoolkit.generation_functions.worker_pool import run_pool
 
     # Set up rate-limit-conscious functions
-    semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-
-    async def run_task_with_limit(task):
-        async with semaphore:
-            # Run your task here
-            return await task
-        
+    # The engine wrappers' adaptive limiter decides how many requests are actually in flight; this just stops every task from starting at once.
+    # A fixed pool of workers pulls inputs one at a time, so only MAX_CONCURRENCY_LIMIT tasks exist at once however big the input is
     async def run_async_many(*args, input_list=None, func=None, **kwargs):
-        tasks = [
-        func(
-            idx,
-            inp,
-            *args,
-            **kwargs,
-            ) for idx, inp in enumerate(input_list)
-        ]
-
-        task_list = [run_task_with_limit(task) for task in tasks]
-        for future in tqdmasyncio.tqdm.as_completed(task_list):
-            await future
+        async def run_one(item):
+            idx, inp = item
+            await func(
+                idx,
+                inp,
+                *args,
+                **kwargs,
+            )
+
+        with tqdm(total=len(input_list)) as progress_bar:
+            await run_pool(run_one, enumerate(input_list), MAX_CONCURRENCY_LIMIT, progress_bar=progress_bar)
+
+    request_recorder = None
+    if RECORD_REQUESTS: # the recording can be served back by utils_for_manual_use/replay_server.py for offline benchmark runs
+        request_recorder = RequestRecorder(os.path.join(config["PATH"]["OUTPUT"], "request_log.jsonl"), seed=RANDOM_SEED)
+
+    metrics_log = None
+    if REQUEST_METRICS: # per-request timings/tokens/retries, by step; a summary table is printed at the end
+        metrics_log = MetricsLog(os.path.join(config["PATH"]["OUTPUT"], "request_metrics.jsonl"))
 
     engine_wrapper = EngineWrapper(
         model=LOGICAL_MODEL,
         api_key=API_KEY,
         base_url=BASE_URL,
         mode=MODE,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        endpoint_weights=ENDPOINT_WEIGHTS,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
         # quantization="gptq" # modify if you want to do stuff with the aphrodite branch
     )
     
@@ -148,6 +196,15 @@ async def main():
         api_key=API_KEY,
         base_url=BASE_URL,
         mode=MODE,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+        endpoint_weights=ENDPOINT_WEIGHTS,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
         # quantization="gptq" # modify if you want to do stuff with the aphrodite branch
     )
     
@@ -156,19 +213,18 @@ async def main():
     # Load rules if present, otherwise create them
     
     import os
-    import yaml
+    from augmentoolkit.generation_functions.transcript import read_transcripts
 
-    if os.path.exists(os.path.join(config["PATH"]["OUTPUT"], "rules_creation_generation")):
-        yaml_files = [f for f in os.listdir(os.path.join(config["PATH"]["OUTPUT"], "rules_creation_generation")) if f.endswith('.yaml')]
-        if yaml_files:
-            yaml_file_path = os.path.join(config["PATH"]["OUTPUT"], "rules_creation_generation", yaml_files[0])
-            with open(yaml_file_path, 'r') as file:
-                yaml_content = yaml.safe_load(file)
-                if isinstance(yaml_content, list) and yaml_content:
-                    print("Loading preexisting rules...")
-                    rules_string = yaml_content[-1]['content']
-                else:
-                    rules_string = await create_rules(engine_wrapper=engine_wrapper_large, classes_list=USER_CLASSES, classes_desc=USER_CLASSES_DESCRIPTION, completion_mode=COMPLETION_MODE)
+    rules_dir = os.path.join(config["PATH"]["OUTPUT"], "rules_creation_generation")
+    if store_for(rules_dir).isdir(rules_dir):
+        transcripts = read_transcripts(rules_dir)
+        if transcripts:
+            yaml_content = transcripts[0]
+            if isinstance(yaml_content, list) and yaml_content:
+                print("Loading preexisting rules...")
+                rules_string = yaml_content[-1]['content']
+            else:
+                rules_string = await create_rules(engine_wrapper=engine_wrapper_large, classes_list=USER_CLASSES, classes_desc=USER_CLASSES_DESCRIPTION, completion_mode=COMPLETION_MODE)
         else:
             rules_string = await create_rules(engine_wrapper=engine_wrapper_large, classes_list=USER_CLASSES, classes_desc=USER_CLASSES_DESCRIPTION, completion_mode=COMPLETION_MODE)
     else:
@@ -193,13 +249,20 @@ async def main():
     text_label_dicts = []
 
     # Load existing tuples if they exist
-    if os.path.exists(saved_dicts_dir):
-        json_files = glob.glob(os.path.join(saved_dicts_dir, "*.json"))
+    store = store_for(saved_dicts_dir)
+    if store.isdir(saved_dicts_dir):
+        json_files = store.glob(os.path.join(saved_dicts_dir, "*.json"))
         for file in json_files:
-            with open(file, 'r') as f:
-                dict_data = json.load(f)
-                if isinstance(dict_data, dict) and "label" in dict_data:
-                    text_label_dicts.append(dict_data)
+            content = store.read(file)
+            if content is None: # corrupted; it's made up for by generating more below
+                continue
+            try:
+                dict_data = json.loads(content)
+            except json.JSONDecodeError:
+                print(f"Could not parse {file}; generating another in its place")
+                continue
+            if isinstance(dict_data, dict) and "label" in dict_data:
+                text_label_dicts.append(dict_data)
 
     # Determine how many more tuples we need to generate
     remaining_dicts = max(0, TRAIN_SET_SIZE - len(text_label_dicts))
@@ -292,6 +355,14 @@ async def main():
     
     print("finished training classifier")
     print(f"ITERATION COMPLETE\nITERATIONS DONE: {max_iters}\nDID REACH THRESHOLD?: {has_passed_LLM_validation}")
+    for server, limiter in EngineWrapper.shared_concurrency_limiters.items():
+        print(f"Concurrency stats for {server}: {limiter.stats()}")
+    for (server, model), limiter in EngineWrapper.shared_rate_limiters.items():
+        print(f"Rate limit stats for {model} at {server}: {limiter.stats()}")
+    for wrapper in (engine_wrapper, engine_wrapper_large):
+        if wrapper.latency_tracker:
+            print(f"Hedging stats for {wrapper.model}: {wrapper.latency_tracker.stats()}")
+    print(f"Retry stats: {retry_budget.stats()}")
 
     if PREDICT_ON_WHOLE_SET_AT_THE_END:
         print("Executing on entire set...")
@@ -299,6 +370,12 @@ async def main():
         output_dir = os.path.join(config["PATH"]["OUTPUT"], "final_classifier_output")
         os.makedirs(output_dir, exist_ok=True)
         run_classifier(model=model, output_dir=output_dir, input_list=chunks, output_list=classifier_labels)
+    if request_recorder:
+        print(f"Recorded {request_recorder.records} requests to {request_recorder.path}")
+    if metrics_log:
+        metrics_log.print_summary("classifier creation")
+    await close_shared_session()  # only does anything if a llamacpp mode was used
+    close_run_stores()
     # run_async_many(classifier_labels, model, output_dir, input_list=chunks, func=run_classifier, output_list=classifier_labels)
     
 asyncio.run(main())
\ No newline at end of file
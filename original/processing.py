@@ -18,22 +18,6 @@ import traceback
 
 import augmentoolkit.utils.group_by_text
 
-def filter_the_text(q_or_a):
-    list_of_bad_strings = [
-        # " the text",
-        "according to the text",
-        "as stated in",
-        "explicitly stated",
-        "as defined in",
-        "given text",
-        "provided information",
-        "the text states",
-        
-    ]
-    if any(bad_string in q_or_a for bad_string in list_of_bad_strings):
-        return False
-    return True
-
 async def main():
     # NOTE NOTEBOOK SETTINGS AND CONSTANTS (some script file constants are in generation_functions/constants.py)
 
@@ -52,6 +36,15 @@ async def main():
         "DOUBLE_CHECK_COUNTER"
     ])  # Set to 1 to check outputs only once; set to 2 to check twice; set to 3 to check thrice, etc. Set to 0 to break everything in vet_question_loop() and elsewhere. Set to -1 and cause the universe to implode?
 
+    BATCHED_VETTING = parse_bool(config["SYSTEM"].get("BATCHED_VETTING", False)) # check all the questions of a paragraph in one request per vote instead of one request per question per check; far fewer input tokens for phase 2
+
+    BANNED_PHRASES = config["PATH"].get("BANNED_PHRASES") or os.path.join(script_dir, "banned_phrases.txt") # questions and answers containing any of these phrases (one per line) are thrown out
+
+    FILTER_FINAL_OUTPUTS = parse_bool(config["SYSTEM"].get("FILTER_FINAL_OUTPUTS", False)) # also drop conversations with a banned phrase from the final datasets
+
+    DEDUPLICATE_QUESTIONS = parse_bool(config["SYSTEM"].get("DEDUPLICATE_QUESTIONS", False)) # drop near-duplicate questions (similar question and answer, e.g. from overlapping chunks) before conversations are written about them
+    DEDUPLICATION_THRESHOLD = float(config["SYSTEM"].get("DEDUPLICATION_THRESHOLD", 0.6)) # how similar (Jaccard similarity of their 5-character shingles, 0 to 1) two questions must be to count as duplicates
+
     USE_SUBSET = parse_bool(config["SYSTEM"][
         "USE_SUBSET"
     ])  # Set to True if you want to use only a small subset of the text, to test whether it plays nicely with the current setup of the notebook
@@ -66,6 +59,10 @@ async def main():
         "CONCURRENCY_LIMIT"
     ])  # Adjust this number based on the rate limit constraints of your api
 
+    MAX_CONCURRENCY_LIMIT = int(config["SYSTEM"].get(
+        "MAX_CONCURRENCY_LIMIT", CONCURRENCY_LIMIT * 4
+    ))  # CONCURRENCY_LIMIT is only the starting point; the number of requests in flight grows while the API keeps up and backs off on rate limits/errors/slowdowns, never going above this
+
     SMALL_BASE_URL = config["API"][
         "SMALL_BASE_URL"
     ]  # Augmentoolkit-API mode should also be compatible with any other API provider that accepts OAI-style requests
@@ -95,6 +92,16 @@ async def main():
     LARGE_MODE = config["API"][
         "LARGE_MODE"
     ]
+
+    # Optional provider quotas (0 means no limit). Requests wait until there's budget for them instead of being rejected with a 429
+    SMALL_REQUESTS_PER_MINUTE = int(config["API"].get("SMALL_REQUESTS_PER_MINUTE", 0)) or None
+    SMALL_TOKENS_PER_MINUTE = int(config["API"].get("SMALL_TOKENS_PER_MINUTE", 0)) or None
+    LARGE_REQUESTS_PER_MINUTE = int(config["API"].get("LARGE_REQUESTS_PER_MINUTE", 0)) or None
+    LARGE_TOKENS_PER_MINUTE = int(config["API"].get("LARGE_TOKENS_PER_MINUTE", 0)) or None
+
+    # The BASE_URLs (and API_KEYs) can be lists of identical servers to load balance across; these optional lists say how much capacity each one has relative to the others
+    SMALL_ENDPOINT_WEIGHTS = config["API"].get("SMALL_ENDPOINT_WEIGHTS")
+    LARGE_ENDPOINT_WEIGHTS = config["API"].get("LARGE_ENDPOINT_WEIGHTS")
     
 
     COMPLETION_MODE = parse_bool(config["SYSTEM"]["COMPLETION_MODE"])
@@ -106,6 +113,8 @@ async def main():
     PHASE_INDEX = int(config["PHASE"]["PHASE_INDEX"])
 
     WORK_IN_PHASES = parse_bool(config["PHASE"]["WORK_IN_PHASES"])
+
+    OVERLAP_PHASES = parse_bool(config["PHASE"].get("OVERLAP_PHASES", False)) # let each paragraph move on to its next step as soon as it's ready, instead of running the phases one after another; WORK_IN_PHASES/PHASE_INDEX then mean "stop after that phase"
     
     SKIP_FILTER_CHUNKS = parse_bool(config["SKIP"]["FILTER_CHUNKS"])
     
@@ -121,6 +130,29 @@ async def main():
     
     SKIP_CONVERSATION_GENERATION = parse_bool(config["SKIP"]["CONVERSATION_GENERATION"]) # useful if you're generating "tight" data only.
     
+    USE_RESPONSE_CACHE = parse_bool(config["SYSTEM"].get("USE_RESPONSE_CACHE", False)) # reuse responses saved by a previous (crashed or tweaked) run instead of paying for identical requests again
+
+    USE_STREAMING = parse_bool(config["SYSTEM"].get("USE_STREAMING", True)) # we never look at partial output, so turning this off can be a bit faster with servers where streaming has overhead
+
+    HEDGE_PERCENTILE = float(config["SYSTEM"].get("HEDGE_PERCENTILE", 0)) or None # e.g. 0.95: requests slower than 95% of their step's recent requests get a duplicate sent, so a few stragglers don't hold up a whole phase. 0 turns it off
+
+    REQUEST_METRICS = parse_bool(config["SYSTEM"].get("REQUEST_METRICS", True)) # per-request timings/tokens/retries go to request_metrics.jsonl, and a per-step summary table is printed after each phase
+
+    RECORD_REQUESTS = parse_bool(config["SYSTEM"].get("RECORD_REQUESTS", False)) # log every request/response to request_log.jsonl, which utils_for_manual_use/replay_server.py can serve back for offline benchmark runs
+
+    RANDOM_SEED = config["SYSTEM"].get("RANDOM_SEED") # seeds the random choices that go into prompts. Recording picks one if this isn't set; replaying needs the same one, or the prompts won't match the recording
+
+    STORAGE_BACKEND = config["SYSTEM"].get("STORAGE_BACKEND", "files") # "files" (one file per item, like always) or "sqlite" (everything the steps save goes in a single output/run_store.sqlite, much faster on network filesystems and for resuming big runs)
+
+    STEP_CONCURRENCY_LIMITS = config["SYSTEM"].get("STEP_CONCURRENCY_LIMITS") or {} # e.g. {multi_turn_convs: 8}: max requests in flight for a step (by the names in the metrics table), so a slow step can't take every slot
+
+    SMALL_MODEL_SHARE = float(config["SYSTEM"].get("SMALL_MODEL_SHARE", 1)) # with OVERLAP_PHASES, how the concurrency budget is split between steps using the small and the large model when both have work waiting
+    LARGE_MODEL_SHARE = float(config["SYSTEM"].get("LARGE_MODEL_SHARE", 1))
+
+    RETRY_BUDGET = int(config["SYSTEM"].get("RETRY_BUDGET", 0)) # max retries (failed requests and outputs that failed validation) for the whole run, so a broken prompt or a dead server fails fast instead of retrying every item. 0 means no cap
+
+    TRANSCRIPT_FORMAT = config["SYSTEM"].get("TRANSCRIPT_FORMAT", "yaml") # how the intermediate_generations transcripts are saved: "yaml" (one file each), "json" (one file each, much faster) or "jsonl" (one transcripts.jsonl per folder)
+    
     
     if USE_GUTENBERG:
         print("SCRAPING IS ON. BEGINNING GUTENBERG SCRAPE! This will modify your input folder.")
@@ -154,16 +186,16 @@ async def main():
     import pkgutil
     import importlib
     import sys
-    from tqdm import asyncio as tqdmasyncio
+    from tqdm import tqdm
     import asyncio
+    from augmentoolkit.generation_functions.worker_pool import run_pool
 
     # Set up rate-limit-conscious functions
-    semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-
-    async def run_task_with_limit(task):
-        async with semaphore:
-            # Run your task here
-            return await task
+    # The actual number of requests in flight is decided by the engine wrappers' adaptive limiter; this just stops us from starting every task at once.
+    # A fixed pool of workers pulls items one at a time, so only MAX_CONCURRENCY_LIMIT tasks exist at once however big the input is
+    async def run_all(function, inputs, total=None):
+        with tqdm(total=total if total is not None else getattr(inputs, "__len__", lambda: None)()) as progress_bar:
+            await run_pool(function, inputs, MAX_CONCURRENCY_LIMIT, progress_bar=progress_bar)
 
     # We have to define this up here so that two-step generation works, you'll see later.
     multi_turn_convs_info_dir = (
@@ -175,12 +207,67 @@ async def main():
 
     import augmentoolkit.generation_functions as generation_functions  # This is the package directory
     from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+    from augmentoolkit.generation_functions.llamacpp_client import close_shared_session
+    from augmentoolkit.generation_functions.response_cache import ResponseCache
+    from augmentoolkit.generation_functions.request_recorder import RequestRecorder, seed_random
+    from augmentoolkit.generation_functions.request_metrics import MetricsLog
+    from augmentoolkit.generation_functions.transcript import set_transcript_format
+    from augmentoolkit.generation_functions.run_store import close_run_stores, open_run_store
+    from augmentoolkit.generation_functions.retry_policy import set_retry_budget
+    from augmentoolkit.generation_functions.identify_duplicates import NearDuplicateIndex, identify_duplicates, save_duplicate_clusters
+    from augmentoolkit.generation_functions.phrase_matcher import PhraseMatcher, filter_jsonl
+
+    set_transcript_format(TRANSCRIPT_FORMAT)
+    open_run_store(config["PATH"]["OUTPUT"], STORAGE_BACKEND)
+    EngineWrapper.set_step_concurrency_limits(STEP_CONCURRENCY_LIMITS)
+    retry_budget = set_retry_budget(RETRY_BUDGET)
+
+    banned_phrases = PhraseMatcher.from_file(BANNED_PHRASES) # built once; checks all the phrases in one pass over each string
+
+    def filter_the_text(q_or_a):
+        return q_or_a not in banned_phrases
+
+    duplicate_index = NearDuplicateIndex(threshold=DEDUPLICATION_THRESHOLD)
+    checked_for_duplicates = [] # everything added to duplicate_index, in order, so the duplicate groups can be saved at the end
+
+    def drop_duplicate_questions(qa_dicts):
+        if not DEDUPLICATE_QUESTIONS:
+            return qa_dicts
+        checked_for_duplicates.extend(qa_dicts)
+        kept, _ = identify_duplicates(qa_dicts, index=duplicate_index)
+        return kept
+
+    response_cache = None
+    if USE_RESPONSE_CACHE:
+        response_cache = ResponseCache(os.path.join(config["PATH"]["OUTPUT"], "response_cache.sqlite"))
+
+    if RECORD_REQUESTS or RANDOM_SEED is not None:
+        RANDOM_SEED = seed_random(RANDOM_SEED)
+
+    request_recorder = None
+    if RECORD_REQUESTS:
+        request_recorder = RequestRecorder(os.path.join(config["PATH"]["OUTPUT"], "request_log.jsonl"), seed=RANDOM_SEED)
+        print(f"Recording requests; set RANDOM_SEED: {RANDOM_SEED} when replaying them")
+
+    metrics_log = None
+    if REQUEST_METRICS:
+        metrics_log = MetricsLog(os.path.join(config["PATH"]["OUTPUT"], "request_metrics.jsonl"))
 
     engine_wrapper = EngineWrapper(
         model=SMALL_MODEL,
         api_key=SMALL_API_KEY,
         base_url=SMALL_BASE_URL,
         mode=SMALL_MODE,
+        cache=response_cache,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=SMALL_REQUESTS_PER_MINUTE,
+        tokens_per_minute=SMALL_TOKENS_PER_MINUTE,
+        endpoint_weights=SMALL_ENDPOINT_WEIGHTS,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
         # quantization="gptq" # modify if you want to do stuff with the aphrodite branch
     )
     
@@ -189,6 +276,16 @@ async def main():
         api_key=LARGE_API_KEY,
         base_url=LARGE_BASE_URL,
         mode=LARGE_MODE,
+        cache=response_cache,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=LARGE_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LARGE_TOKENS_PER_MINUTE,
+        endpoint_weights=LARGE_ENDPOINT_WEIGHTS,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
         # quantization="gptq" # modify if you want to do stuff with the aphrodite branch
     )
     
@@ -240,142 +337,285 @@ async def main():
         print("\n\nWarning: Local generation can be slow if your computer is not powerful enough. It may be most cost/time effective to rent a cloud GPU. However if you have a good computer you can make progress; I know a guy who used a 2xA6000 rig and waited a while and created a good-sized dataset.")
 
 
-    if SKIP_FILTER_CHUNKS:
-        print("Skipping chunk filtering")
+    if OVERLAP_PHASES:
+        import random
+        from augmentoolkit.generation_functions.dag_scheduler import DAGScheduler
+        
+        # Each paragraph moves on to its next step as soon as it's done with the last one, instead of every phase waiting for its slowest item.
+        # Later steps get first pick of the shared concurrency budget, so finished conversations start showing up early.
+        stop_after = None
+        if WORK_IN_PHASES and PHASE_INDEX < 3:
+            stop_after = ["judge_paragraph", "question_generation", "question_validation"][PHASE_INDEX]
+        dag = DAGScheduler(MAX_CONCURRENCY_LIMIT, stop_after=stop_after, share_weights={"small": SMALL_MODEL_SHARE, "large": LARGE_MODEL_SHARE})
+        step_limit = lambda name: int(STEP_CONCURRENCY_LIMITS.get(name) or 0) or None # capped here too, so that waiting on a step's cap doesn't tie up slots other steps could use. Looked up by the step names EngineWrapper uses, so one entry caps both
+        
         if USE_SUBSET:
-            filtered_worthy_for_questions = paragraphs_processed[:SUBSET_SIZE]
-        else:
-            filtered_worthy_for_questions = paragraphs_processed
-    else:
-        # Determine which paragraphs are worthy of making questions from
+            if not SKIP_FILTER_CHUNKS: # same subset as filter_all_questions picks
+                random.seed(42)
+                random.shuffle(paragraphs_processed)
+            paragraphs_processed = paragraphs_processed[:SUBSET_SIZE]
+        
+        qa_dicts_dir_checked = os.path.join(config["PATH"]["OUTPUT"], "qatuples_filtered")
         judged_worthy_for_questions = []
+        generated_qa_dicts = []
+        all_vetted_qa_dicts = [] # including the Nones of questions that failed vetting, for the stats
+        vetted_qa_dicts = []
+        multi_turn_convs = []
+        
+        async def judge_paragraph(item):
+            idx, para = item
+            if SKIP_FILTER_CHUNKS:
+                return [item]
+            judged = []
+            async with dag.limit("judge_paragraph"):
+                await steps.judge_paragraph_step.run(idx, input_data=para, output_list=judged, engine_wrapper=engine_wrapper)
+            judged_worthy_for_questions.extend(judged)
+            return [(idx, judged[0])] if judged and judged[0]["paragraph"] is not None else []
+        
+        async def generate_questions(item):
+            idx, para = item # idx is the paragraph's position in the input, which is what its saved questions are named after
+            qa_dicts = []
+            async with dag.limit("question_generation"):
+                await steps.generate_qadicts_from_para(idx, para, engine_wrapper_large=engine_wrapper_large, generated_qa_dicts=qa_dicts)
+            generated_qa_dicts.extend(qa_dicts)
+            return [qa_dicts] if qa_dicts else []
+        
+        async def validate_questions(qa_dicts):
+            vetted = []
+            async def vet(question_answer_dict):
+                async with dag.limit("question_validation"):
+                    await steps.vet_question_loop(
+                        question_answer_dict,
+                        question_group_id=question_answer_dict['question_group_id'],
+                        engine_wrapper=engine_wrapper,
+                        qa_dicts_dir=qa_dicts_dir_checked,
+                        vetted_qa_dicts=vetted,
+                        double_check_counter=DOUBLE_CHECK_COUNTER,
+                        completion_mode=COMPLETION_MODE,
+                        logging_level=LOG_LEVEL,
+                    )
+            if BATCHED_VETTING:
+                async with dag.limit("question_validation"):
+                    await steps.vet_paragraph_questions_batched(
+                        qa_dicts,
+                        engine_wrapper=engine_wrapper,
+                        qa_dicts_dir=qa_dicts_dir_checked,
+                        vetted_qa_dicts=vetted,
+                        double_check_counter=DOUBLE_CHECK_COUNTER,
+                        completion_mode=COMPLETION_MODE,
+                        logging_level=LOG_LEVEL,
+                    )
+            else:
+                await asyncio.gather(*[vet(qa_dict) for qa_dict in qa_dicts])
+            all_vetted_qa_dicts.extend(vetted)
+            vetted = [qa for qa in vetted if qa is not None]
+            return [vetted] if vetted else []
+        
+        async def revise_questions(qa_dicts):
+            if not SKIP_REPAIR_QA_TUPLES:
+                revised = {steps.qa_key(qa): qa for qa in qa_dicts}
+                async def revise(key):
+                    async with dag.limit("revision"):
+                        await steps.repair_qatuple_context(key, revised[key], engine_wrapper_large, revised)
+                await asyncio.gather(*[revise(key) for key in list(revised)])
+                qa_dicts = [qa for qa in revised.values() if qa is not None]
+            qa_dicts = [qadict for qadict in qa_dicts if filter_the_text(qadict["question"]) and filter_the_text(qadict["answer"])]
+            qa_dicts = drop_duplicate_questions(qa_dicts) # against every paragraph's questions so far, since this one's conversation gets written next
+            vetted_qa_dicts.extend(qa_dicts)
+            return [qa_dicts] if qa_dicts else []
+        
+        async def write_conversation(qa_dicts):
+            for info in augmentoolkit.utils.group_by_text.group_by_text(qa_dicts): # all one paragraph, so one group
+                async with dag.limit("conversation_generation"):
+                    await steps.create_conversation(f"para_{qa_dicts[0]['paragraph_idx']}", info, engine_wrapper_large, multi_turn_convs)
+            return [qa_dicts]
+        
+        dag.add_step("judge_paragraph", judge_paragraph, share="small", max_concurrency=step_limit(steps.judge_paragraph_step.output_subdir))
+        dag.add_step("question_generation", generate_questions, after="judge_paragraph", share="large", max_concurrency=step_limit(steps.question_generation_step.output_subdir))
+        dag.add_step("question_validation", validate_questions, after="question_generation", share="small", max_concurrency=step_limit(steps.QUESTION_VALIDATION_STEP))
+        dag.add_step("revision", revise_questions, after="question_validation", share="large", max_concurrency=step_limit(steps.context_repairer.output_subdir))
+        if not SKIP_CONVERSATION_GENERATION:
+            dag.add_step("conversation_generation", write_conversation, after="revision", share="large", max_concurrency=step_limit(steps.conversation_generator.output_subdir))
+        
+        await dag.run(enumerate(paragraphs_processed))
+        print(f"Items through each step: {dag.stats()}")
+        
+        if not SKIP_FILTER_CHUNKS:
+            steps.filter_and_graph(judged_worthy_for_questions)
+            print("Converting generations to training data")
+            steps.convert_logging_to_dataset(input_pth=os.path.join("judge_paragraph_generations", "intermediate_generations"), output_pth="judge_paragraph_generations")
+            if not any(d["paragraph"] is not None for d in judged_worthy_for_questions):
+                print("No paragraphs were judged worthy for questions. Either the judgement step thinks everything you added is metadata or has no factual information, or your input path is wrong, or the model is being stupid. Check your input directory path, your model, and your input data. The intermediate outputs at the end of each file in ./output/judge_paragraph_generations/intermediate_generations/ may help you diagnose the problem.")
+                sys.exit(1)
+        
+        if metrics_log:
+            metrics_log.print_summary("all phases (overlapped)")
+        if stop_after:
+            print(f"EXITING DUE TO config.yaml SETTINGS AROUND PHASES; STOPPED AFTER {stop_after}")
+            sys.exit(0)
+        
+        print("-------------- QUESTIONS CREATED AND REVISED ------------- STATS (may be wrong if run was continued from interruption):")
+        nones = list(filter(lambda x: x is None, all_vetted_qa_dicts))
+        print(f"Nones: {len(nones)}")
+        print(f"Non-nones: {len(all_vetted_qa_dicts) - len(nones)}")
+        print(f"Total: {len(all_vetted_qa_dicts)}")
+    else:
+        # (idx, paragraph) pairs, idx being the paragraph's position in the input; saved work is named after it, the same as with OVERLAP_PHASES, so a run can be resumed in either mode
+        if SKIP_FILTER_CHUNKS:
+            print("Skipping chunk filtering")
+            if USE_SUBSET:
+                filtered_worthy_for_questions = list(enumerate(paragraphs_processed[:SUBSET_SIZE]))
+            else:
+                filtered_worthy_for_questions = list(enumerate(paragraphs_processed))
+        else:
+            # Determine which paragraphs are worthy of making questions from
+            judged_worthy_for_questions = []
+
+            await steps.filter_all_questions(
+                paragraphs_processed,
+                judged_worthy_for_questions,
+                engine_wrapper,
+                take_subset=USE_SUBSET,
+                subset_size=SUBSET_SIZE,
+                use_filenames=False,
+                run_all=run_all,
+                completion_mode=COMPLETION_MODE,
+                logging_level=LOG_LEVEL,
+            )
 
-        await steps.filter_all_questions(
-            paragraphs_processed,
-            judged_worthy_for_questions,
-            engine_wrapper,
-            take_subset=USE_SUBSET,
-            subset_size=SUBSET_SIZE,
-            use_filenames=False,
-            rtwl=run_task_with_limit,
-            completion_mode=COMPLETION_MODE,
-            logging_level=LOG_LEVEL,
-        )
-
-        filtered_worthy_for_questions = steps.filter_and_graph(
-            judged_worthy_for_questions
-        )
+            steps.filter_and_graph([judgement for _, judgement in judged_worthy_for_questions])
+            filtered_worthy_for_questions = [(idx, para) for idx, para in judged_worthy_for_questions if para["paragraph"] is not None]
         
-        print("Converting generations to training data")
-        steps.convert_logging_to_dataset(input_pth=os.path.join("judge_paragraph_generations", "intermediate_generations"), output_pth="judge_paragraph_generations")
+            print("Converting generations to training data")
+            steps.convert_logging_to_dataset(input_pth=os.path.join("judge_paragraph_generations", "intermediate_generations"), output_pth="judge_paragraph_generations")
 
-    if len(filtered_worthy_for_questions) == 0:
-        print("No paragraphs were judged worthy for questions. Either the judgement step thinks everything you added is metadata or has no factual information, or your input path is wrong, or the model is being stupid. Check your input directory path, your model, and your input data. The intermediate outputs at the end of each file in ./output/judge_paragraph_generations/intermediate_generations/ may help you diagnose the problem.")
-        sys.exit(1)
-    print(filtered_worthy_for_questions[0])
+        if len(filtered_worthy_for_questions) == 0:
+            print("No paragraphs were judged worthy for questions. Either the judgement step thinks everything you added is metadata or has no factual information, or your input path is wrong, or the model is being stupid. Check your input directory path, your model, and your input data. The intermediate outputs at the end of each file in ./output/judge_paragraph_generations/intermediate_generations/ may help you diagnose the problem.")
+            sys.exit(1)
+        print(filtered_worthy_for_questions[0])
     
-    # PHASE 0 END
-    print("\n\nCOMPLETED PHASE 0")
-    if WORK_IN_PHASES and PHASE_INDEX == 0:
-        sys.exit(0)
+        # PHASE 0 END
+        if metrics_log:
+            metrics_log.print_summary("phase 0 (chunk filtering)")
+        print("\n\nCOMPLETED PHASE 0")
+        if WORK_IN_PHASES and PHASE_INDEX == 0:
+            sys.exit(0)
     
-    #####
+        #####
 
-    # control flow
-    import json
+        # control flow
+        import json
     
-    import glob
+        import glob
 
-    generated_qa_dicts = []  # tuple list of qa tuples that have been judged good
+        generated_qa_dicts = []  # tuple list of qa tuples that have been judged good
 
-    # Attempt to initialize filtered_worthy_for_questions
-    tasks = [
-        steps.generate_qadicts_from_para(
-            idx,
-            para,
-            engine_wrapper_large=engine_wrapper_large,
-            generated_qa_dicts=generated_qa_dicts,
-        )
-        for idx, para in enumerate(filtered_worthy_for_questions)
-    ]
-    limited_tasks_qgen = [run_task_with_limit(task) for task in tasks]
-    for future in tqdmasyncio.tqdm.as_completed(limited_tasks_qgen):
-        await future
-    
-    # PHASE 1 END
-    print("COMPLETED PHASE 1")
-    if WORK_IN_PHASES and PHASE_INDEX == 1:
-        print("EXITING DUE TO config.yaml SETTINGS AROUND PHASES; SET TO ONLY EXECUTE PHASE 1 RIGHT NOW")
-        sys.exit(0)
-    ####
-    
-    vetted_qa_dicts = []
-    qa_dicts_dir_checked = os.path.join(config["PATH"]["OUTPUT"], "qatuples_filtered")
-    if not os.path.exists(qa_dicts_dir_checked):
-        os.makedirs(qa_dicts_dir_checked)
-    
-    print(generated_qa_dicts[0])
-    
-    tasks = [
-        steps.vet_question_loop(
-            question_answer_dict,
-            question_group_id=question_answer_dict['question_group_id'],
-            engine_wrapper=engine_wrapper,
-            qa_dicts_dir=qa_dicts_dir_checked,
-            vetted_qa_dicts=vetted_qa_dicts,
-            double_check_counter=DOUBLE_CHECK_COUNTER,
-            completion_mode=COMPLETION_MODE,
-            logging_level=LOG_LEVEL,
-        ) for question_answer_dict in generated_qa_dicts
-    ]
-    limited_tasks_q_validation = [run_task_with_limit(task) for task in tasks]
-    for future in tqdmasyncio.tqdm.as_completed(limited_tasks_q_validation):
-            await future
+        # Attempt to initialize filtered_worthy_for_questions
+        async def generate_qadicts(item):
+            idx, para = item
+            await steps.generate_qadicts_from_para(
+                idx,
+                para,
+                engine_wrapper_large=engine_wrapper_large,
+                generated_qa_dicts=generated_qa_dicts,
+            )
+        await run_all(generate_qadicts, filtered_worthy_for_questions, total=len(filtered_worthy_for_questions))
+    
+        # PHASE 1 END
+        if metrics_log:
+            metrics_log.print_summary("phase 1 (question generation)")
+        print("COMPLETED PHASE 1")
+        if WORK_IN_PHASES and PHASE_INDEX == 1:
+            print("EXITING DUE TO config.yaml SETTINGS AROUND PHASES; SET TO ONLY EXECUTE PHASE 1 RIGHT NOW")
+            sys.exit(0)
+        ####
+    
+        vetted_qa_dicts = []
+        qa_dicts_dir_checked = os.path.join(config["PATH"]["OUTPUT"], "qatuples_filtered")
+        if not os.path.exists(qa_dicts_dir_checked):
+            os.makedirs(qa_dicts_dir_checked)
+    
+        print(generated_qa_dicts[0])
+    
+        async def vet_qadict(question_answer_dict):
+            await steps.vet_question_loop(
+                question_answer_dict,
+                question_group_id=question_answer_dict['question_group_id'],
+                engine_wrapper=engine_wrapper,
+                qa_dicts_dir=qa_dicts_dir_checked,
+                vetted_qa_dicts=vetted_qa_dicts,
+                double_check_counter=DOUBLE_CHECK_COUNTER,
+                completion_mode=COMPLETION_MODE,
+                logging_level=LOG_LEVEL,
+            )
+        async def vet_paragraph(qa_dicts):
+            await steps.vet_paragraph_questions_batched(
+                qa_dicts,
+                engine_wrapper=engine_wrapper,
+                qa_dicts_dir=qa_dicts_dir_checked,
+                vetted_qa_dicts=vetted_qa_dicts,
+                double_check_counter=DOUBLE_CHECK_COUNTER,
+                completion_mode=COMPLETION_MODE,
+                logging_level=LOG_LEVEL,
+            )
+        if BATCHED_VETTING:
+            qa_dicts_by_paragraph = {}
+            for question_answer_dict in generated_qa_dicts:
+                qa_dicts_by_paragraph.setdefault(question_answer_dict["paragraph_idx"], []).append(question_answer_dict)
+            await run_all(vet_paragraph, qa_dicts_by_paragraph.values())
+        else:
+            await run_all(vet_qadict, generated_qa_dicts)
                 
     
-    if WORK_IN_PHASES and PHASE_INDEX == 2:
-        print("EXITING DUE TO config.yaml SETTINGS AROUND PHASES; SET TO ONLY EXECUTE PHASE 2 RIGHT NOW")
-        sys.exit(0)
+        if metrics_log:
+            metrics_log.print_summary("phase 2 (question validation)")
+        if WORK_IN_PHASES and PHASE_INDEX == 2:
+            print("EXITING DUE TO config.yaml SETTINGS AROUND PHASES; SET TO ONLY EXECUTE PHASE 2 RIGHT NOW")
+            sys.exit(0)
 
-    print(
-        "-------------- QUESTIONS CREATED ------------- STATS SO FAR (may be wrong if run was continued from interruption):"
-    )
-    nones = list(filter(lambda x: x is None, vetted_qa_dicts))
-    print(f"Nones: {len(nones)}")
-    print(f"Non-nones: {len(vetted_qa_dicts) - len(nones)}")
-    print(f"Total: {len(vetted_qa_dicts)}")
-    # filter out all None values
-    vetted_qa_dicts = [qa for qa in vetted_qa_dicts if qa is not None]
-    print("---------------- ONTO REVISION ------------------")
-
-    # Assuming vetted_qa_tuples is a list that might or might not exist
-    
-    if not SKIP_REPAIR_QA_TUPLES:
-        tasks = [
-            steps.repair_qatuple_context( # NOTE PROBLEM in that things that this writes, do not have enough items in the tuple
-                idx,
-                tup,
-                engine_wrapper_large,
-                vetted_qa_dicts,
-            )
-            for idx, tup in enumerate(vetted_qa_dicts)
-        ]
-        limited_tasks_qcorrection = [run_task_with_limit(task) for task in tasks]
-        for future in tqdmasyncio.tqdm.as_completed(limited_tasks_qcorrection):
-            await future
-        print("-------------- QUESTIONS REVISED ------------- STATS SO FAR:")
+        print(
+            "-------------- QUESTIONS CREATED ------------- STATS SO FAR (may be wrong if run was continued from interruption):"
+        )
         nones = list(filter(lambda x: x is None, vetted_qa_dicts))
         print(f"Nones: {len(nones)}")
         print(f"Non-nones: {len(vetted_qa_dicts) - len(nones)}")
         print(f"Total: {len(vetted_qa_dicts)}")
         # filter out all None values
         vetted_qa_dicts = [qa for qa in vetted_qa_dicts if qa is not None]
-        print("---------------- ONTO EXAMPLES GENERATION-------------------")
-    else:
-        print("Skipping question repair")
+        print("---------------- ONTO REVISION ------------------")
+
+        # Assuming vetted_qa_tuples is a list that might or might not exist
+    
+        if not SKIP_REPAIR_QA_TUPLES:
+            revised = {steps.qa_key(qa): qa for qa in vetted_qa_dicts} # the same keys as with OVERLAP_PHASES; a position in this list depends on the order vetting finished in
+            async def repair_qadict(key):
+                await steps.repair_qatuple_context( # NOTE PROBLEM in that things that this writes, do not have enough items in the tuple
+                    key,
+                    revised[key],
+                    engine_wrapper_large,
+                    revised,
+                )
+            await run_all(repair_qadict, list(revised), total=len(revised)) # each task only writes back to its own key
+            vetted_qa_dicts = list(revised.values())
+            print("-------------- QUESTIONS REVISED ------------- STATS SO FAR:")
+            nones = list(filter(lambda x: x is None, vetted_qa_dicts))
+            print(f"Nones: {len(nones)}")
+            print(f"Non-nones: {len(vetted_qa_dicts) - len(nones)}")
+            print(f"Total: {len(vetted_qa_dicts)}")
+            # filter out all None values
+            vetted_qa_dicts = [qa for qa in vetted_qa_dicts if qa is not None]
+            print("---------------- ONTO EXAMPLES GENERATION-------------------")
+        else:
+            print("Skipping question repair")
         
-    # filter questions and answers using filter_the_text
-    vetted_qa_dicts = [qadict for qadict in vetted_qa_dicts if filter_the_text(qadict["question"]) and filter_the_text(qadict["answer"])]
+        # filter questions and answers using filter_the_text
+        vetted_qa_dicts = [qadict for qadict in vetted_qa_dicts if filter_the_text(qadict["question"]) and filter_the_text(qadict["answer"])]
+
+    if DEDUPLICATE_QUESTIONS:
+        if not OVERLAP_PHASES: # otherwise it was done paragraph by paragraph
+            vetted_qa_dicts = drop_duplicate_questions(vetted_qa_dicts)
+        duplicate_clusters = save_duplicate_clusters(os.path.join(config["PATH"]["OUTPUT"], "duplicate_questions.json"), duplicate_index, checked_for_duplicates)
+        print(f"Dropped {len(checked_for_duplicates) - len(vetted_qa_dicts)} near-duplicate questions from {len(duplicate_clusters)} groups (see duplicate_questions.json)")
 
     qa_dicts_by_text = augmentoolkit.utils.group_by_text.group_by_text(vetted_qa_dicts)
     
@@ -385,20 +625,17 @@ async def main():
         print("Skipping conversation generation")
         steps.save_plain_qatuples(qa_dicts_by_text=qa_dicts_by_text)
     else:
-        multi_turn_convs = []
-
-        tasks = [
-            steps.create_conversation(
-                idx,
-                info,
-                engine_wrapper_large,
-                multi_turn_convs,
-            )
-            for idx, info in enumerate(qa_dicts_by_text)
-        ]
-        limited_tasks_convwriting = [run_task_with_limit(task) for task in tasks]
-        for future in tqdmasyncio.tqdm.as_completed(limited_tasks_convwriting):
-            await future
+        if not OVERLAP_PHASES: # otherwise the conversations were already written, paragraph by paragraph
+            multi_turn_convs = []
+
+            async def generate_conversation(info):
+                await steps.create_conversation(
+                    f"para_{info['dict_list'][0]['paragraph_idx']}", # named after the paragraph, the same as with OVERLAP_PHASES
+                    info,
+                    engine_wrapper_large,
+                    multi_turn_convs,
+                )
+            await run_all(generate_conversation, qa_dicts_by_text, total=len(qa_dicts_by_text))
 
         print("Converting conversational data generations to training data")
         steps.convert_logging_to_dataset(input_pth=os.path.join("multi_turn_convs", "intermediate_generations"), output_pth="multi_turn_convs")
@@ -408,6 +645,15 @@ async def main():
             os.path.join(config["PATH"]["OUTPUT"],"multi_turn_convs", "saved_readable_generations")
         )
         
+    if FILTER_FINAL_OUTPUTS:
+        def conversation_texts(record): # the system prompt and any RAG context are left alone; only what's said is checked
+            return (turn["value"] for turn in record.get("conversations", []) if turn.get("from") != "system")
+        for output_file in ("simplified_data_no_rag.jsonl", "simplified_data_rag.jsonl", "plain_qa_list.jsonl"):
+            output_path = os.path.join(config["PATH"]["OUTPUT"], output_file)
+            if os.path.exists(output_path):
+                kept, dropped = filter_jsonl(output_path, output_path, banned_phrases, texts=conversation_texts)
+                print(f"Filtered {output_file}: kept {kept}, dropped {dropped} with banned phrases")
+
     # Yay! Now you have a dataset!
     
     with open(config["PATH"]["OUTPUT"] + "/master_list.jsonl", "r", encoding='utf-8') as f:
@@ -428,6 +674,24 @@ async def main():
 
 
     print(f"Total GPT turns: {gpt_turns}")
+    if response_cache:
+        print(f"Response cache stats: {response_cache.stats()}")
+    for server, limiter in EngineWrapper.shared_concurrency_limiters.items():
+        print(f"Concurrency stats for {server}: {limiter.stats()}")
+    for (server, model), limiter in EngineWrapper.shared_rate_limiters.items():
+        print(f"Rate limit stats for {model} at {server}: {limiter.stats()}")
+    if len(engine_wrapper.endpoint_pool) > 1 or len(engine_wrapper_large.endpoint_pool) > 1:
+        print(f"Endpoint stats: {engine_wrapper.endpoint_pool.stats()} {engine_wrapper_large.endpoint_pool.stats()}")
+    for wrapper in (engine_wrapper, engine_wrapper_large):
+        if wrapper.latency_tracker:
+            print(f"Hedging stats for {wrapper.model}: {wrapper.latency_tracker.stats()}")
+    print(f"Retry stats: {retry_budget.stats()}")
+    if request_recorder:
+        print(f"Recorded {request_recorder.records} requests to {request_recorder.path}")
+    if metrics_log:
+        metrics_log.print_summary("final phase (revision and conversation generation)")
+    await close_shared_session()  # only does anything if a llamacpp mode was used
+    close_run_stores()
     print("COMPLETED FINAL PHASE")
     if USE_SUBSET:
         print(f"Warning! USE_SUBSET was on in the config you used, {config_path}. This means that you only generated data from the first {SUBSET_SIZE} chunks of your input data. If you want to generate data from all chunks, set USE_SUBSET to False.")
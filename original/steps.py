@@ -1,4 +1,6 @@
 import random
+import asyncio
+import functools
 from bs4 import BeautifulSoup
 from logging import INFO
 import os
@@ -7,17 +9,16 @@ import json
 import re
 import sys
 import requests
-from tqdm import asyncio as tqdmasyncio
 from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
 from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
 from augmentoolkit.utils.make_id import make_id
+from augmentoolkit.utils.paragraph_table import intern_paragraph, paragraph_table
 from augmentoolkit.utils.write_output_to_file import write_output_to_file
 from augmentoolkit.generation_functions.safe_formatter import safe_format
 from nltk.tokenize import sent_tokenize
 import matplotlib.pyplot as plt
 from collections import Counter
 import logging
-from math import ceil
 import traceback
 import glob
 import yaml
@@ -36,6 +37,9 @@ from augmentoolkit.generation_functions import (
 )
 
 from augmentoolkit.generation_functions.generation_step_class import GenerationStep
+from augmentoolkit.generation_functions.transcript import read_transcripts
+from augmentoolkit.generation_functions.majority_vote import majority_vote, majority_vote_checks
+from augmentoolkit.generation_functions.run_store import store_for
 from augmentoolkit.generation_functions.special_instructions import special_instructions
 
 from augmentoolkit.utils.find_relevant_pos import analyze_responses
@@ -96,18 +100,12 @@ def convert_logging_to_dataset(input_pth=None, output_pth=None):
     
     output_file_path = os.path.join(obj_conf["PATH"]["OUTPUT"], output_pth + "_DATAGEN_OUTPUT.jsonl")
     
-    if not os.path.exists(output_dir):
+    if not store_for(output_dir).isdir(output_dir):
         raise Exception("ERROR!! Trying to convert a logging directory to a dataset, when that directory does not exist!")
         
     full_list_of_dicts = []
     with open(output_file_path, "w", encoding='utf-8') as f:
-        existing_files = glob.glob(
-            os.path.join(output_dir, "*.yaml")
-        )
-        
-        for file in existing_files:
-            with open(file,'r', encoding='utf-8') as file2:
-                file_list_of_dicts = yaml.safe_load(file2)
+        for file_list_of_dicts in read_transcripts(output_dir):  # yaml, json or jsonl, depending on TRANSCRIPT_FORMAT
             # print(file_list_of_dicts)
             
             sysprompt = {"from": "system", "value": file_list_of_dicts[0]["content"]}
@@ -291,49 +289,19 @@ class ContextRepairer(PipelineStep):
         
     def read_previous_output(self, idx, output_list):
         save_path_file = self.make_save_path_file(idx)
-        if os.path.exists(save_path_file):
-            try:
-                # First try reading in binary mode
-                with open(save_path_file, 'rb') as f:
-                    content = f.read()
-                    
-                # Try different decodings of the binary content
-                for encoding in ['utf-8', 'utf-8-sig', 'latin1', 'cp1252']:
-                    try:
-                        decoded_content = content.decode(encoding, errors='replace')
-                        if decoded_content == "failed":
-                            print("Loaded failed file")
-                            output_list[idx] = None
-                            return True
-                            
-                        try:
-                            data = json.loads(decoded_content)
-                            output_list[idx] = data
-                            print(f"Successfully loaded file using {encoding} encoding")
-                            return True
-                        except json.JSONDecodeError:
-                            continue
-                            
-                    except UnicodeDecodeError:
-                        continue
-                        
-                # If we get here, none of the decodings worked properly
-                print(f"Warning: Using fallback decoding for {save_path_file}")
-                # Use 'replace' mode with cp1252 as last resort
-                decoded_content = content.decode('cp1252', errors='replace')
-                try:
-                    data = json.loads(decoded_content)
-                    output_list[idx] = data
-                    return True
-                except json.JSONDecodeError as e:
-                    print(f"Failed to parse JSON after decoding: {str(e)}")
-                    return False
-                    
-            except Exception as e:
-                print(f"Error reading file {save_path_file}: {str(e)}")
+        try:
+            content = self.store.read(save_path_file)
+            if content is None: # not there, or not valid UTF-8/cut off by a crash (the store says which), so it's revised again
                 return False
-                
-        return False
+            if content == "failed":
+                print("Loaded failed file")
+                output_list[idx] = None
+                return True
+            output_list[idx] = intern_paragraph(json.loads(content))
+            return True
+        except Exception as e:
+            print(f"Error reading file {save_path_file}: {str(e)}")
+            return False
     
     def save(self, result=None, full_output=None, idx=None, output_list=None, input_data=None):
         if isinstance(result[0], str):
@@ -348,17 +316,23 @@ class ContextRepairer(PipelineStep):
         id = make_id()
         write_output_to_file(full_output, self.intermediate_output_path_full, id)
         
-        os.makedirs(self.save_path_dir, exist_ok=True)
         if output_list[idx]:
-            with open(self.make_save_path_file(idx), "w", encoding='utf-8') as f:
-                f.write(json.dumps(output_list[idx], ensure_ascii=False))
+            self.store.write(self.make_save_path_file(idx), json.dumps(output_list[idx], ensure_ascii=False))
         else:
-            with open(self.make_save_path_file(idx), "w", encoding='utf-8') as f:
-                f.write("failed")
+            self.store.write(self.make_save_path_file(idx), "failed")
     
 context_repairer = ContextRepairer()
 
 # Postprocessing function for question/answer validation
+# The step name every question check's requests are made under (for STEP_CONCURRENCY_LIMITS, hedging and the metrics table), which is also the OVERLAP_PHASES scheduler's name for the validation step, so one limit caps both
+QUESTION_VALIDATION_STEP = "question_validation"
+
+
+def qa_key(qa_dict):
+    # What a question's vetting and revision are saved under, in both OVERLAP_PHASES and phase-by-phase runs: its paragraph's position in the input, and its own among that paragraph's questions
+    return f"para_{qa_dict['paragraph_idx']}_q_{qa_dict['question_idx']}"
+
+
 async def repair_qatuple_context(
     idx,
     dict,
@@ -413,9 +387,9 @@ async def vet_answer_accuracy_loop(
         r"Reasoning and thought process \(the text is your single source of truth\):\n(.+)",
         re.DOTALL,
     )
-    # TODO performance improvement could be gained by using async for to do the checks simultaneously
     answer_accuracy_checker = GenerationStep(
         prompt_path=prompt_path_ans_accuracy_check,
+        step_name=QUESTION_VALIDATION_STEP,
         regex=check_ans_accuracy_regex,
         sampling_params={
             "max_tokens": 1500,
@@ -449,14 +423,8 @@ async def vet_answer_accuracy_loop(
         # print(
         # f"\n\nStarting ACCURACY loop for question: {qtuple[0]}, context: {qtuple[2]}"
         # )
-        passed_checks = 0
-        times_checked = 0
-        dissenting_reasoning = ""
-        while times_checked < double_check_counter:
+        async def check_answer_accuracy():
             check_id = make_id()
-            # print(
-            # f"\n\nACCURACY CALL CHECK ANSWER: {qtuple[0]}, context: {qtuple[2]}, retries: {total_retries}, dissenting reasoning: {dissenting_reasoning}"
-            # )
             judgement, answer_accuracy_output = await answer_accuracy_checker.generate(
                 paragraph=qa_dict["paragraph"],
                 question=qa_dict["question"],
@@ -471,30 +439,21 @@ async def vet_answer_accuracy_loop(
                 dissenting_reasoning = judgement[1]
                 print("\nNegative Vote Cast! Here was the reasoning:\n")
                 print(dissenting_reasoning)
-            else:
-                passed_checks += 1
-            times_checked += 1
-            if passed_checks >= ceil(double_check_counter / 2):
-                break
-            failed_checks = times_checked - passed_checks
-            if failed_checks >= ceil(double_check_counter / 2):
-                break
-
-        if passed_checks >= ceil(double_check_counter / 2):  # if question checks passed
+            return judgement[0]
+
+        if await majority_vote(check_answer_accuracy, double_check_counter):  # if question checks passed
             # print(f"\n\ANSWER ACCURACY CHECKS PASSED retries: {total_retries}")
             return qa_dict
         else:
             print("Answer accuracy validation failed! Tossing")
-            with open(file_path, "w", encoding='utf-8') as file:
-                    file.write("failed")
+            store_for(file_path).write(file_path, "failed")
             return
     except Exception as e:
         print("!!ERROR!!")
         print(e)
         traceback.print_exc()
 
-    with open(file_path, "w", encoding='utf-8') as file:
-        file.write("failed")
+    store_for(file_path).write(file_path, "failed")
     return
 
 
@@ -546,6 +505,7 @@ async def vet_answer_relevance_loop(
 
     answer_relevancy_checker = GenerationStep(
         prompt_path=prompt_path_ans_relevancy_check,
+        step_name=QUESTION_VALIDATION_STEP,
         regex=check_ans_relevancy_regex,
         sampling_params={
             "max_tokens": 1500,
@@ -575,11 +535,7 @@ async def vet_answer_relevance_loop(
 
     # Resume normal control flow code
     try:
-        passed_checks = 0
-        times_checked = 0
-        dissenting_reasoning = ""
-        while times_checked < double_check_counter:
-            
+        async def check_answer_relevancy():
             check_id = make_id()
             (
                 judgement,
@@ -598,16 +554,9 @@ async def vet_answer_relevance_loop(
                 dissenting_reasoning = judgement[1]
                 print("\nNegative Vote Cast! Here was the reasoning:\n")
                 print(dissenting_reasoning)
-            else:
-                passed_checks += 1
-            times_checked += 1
-            if passed_checks >= ceil(double_check_counter / 2):
-                break
-            failed_checks = times_checked - passed_checks
-            if failed_checks >= ceil(double_check_counter / 2):
-                break
-
-        if passed_checks >= ceil(double_check_counter / 2):  # if question checks passed
+            return judgement[0]
+
+        if await majority_vote(check_answer_relevancy, double_check_counter):  # if question checks passed
             # print(f"\n\ANSWER ACCURACY CHECKS PASSED retries: {total_retries}")
             return await vet_answer_accuracy_loop(
                 qa_dict,
@@ -620,16 +569,14 @@ async def vet_answer_relevance_loop(
             )
         else:
             print("Answer relevancy validation failed! Tossing")
-            with open(file_path, "w", encoding='utf-8') as file:
-                    file.write("failed")
+            store_for(file_path).write(file_path, "failed")
             return
     except Exception as e:
         print("!!ERROR!!")
         print(e)
         traceback.print_exc()
 
-    with open(file_path, "w", encoding='utf-8') as file:
-        file.write("failed")
+    store_for(file_path).write(file_path, "failed")
     return
 
 
@@ -733,16 +680,19 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
     logging_level=None,
 ):
     try:
-        file_path = os.path.join(qa_dicts_dir, f"para_{qa_dict['paragraph_idx']}_q_{qa_dict['question_idx']}.json")
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding='utf-8') as file:
-                file_body = file.read()
-                if file_body == "failed":
-                    qa_dict = None
-                else:
-                    file.seek(0)
-                    qa_dict = json.loads(file_body)
-            vetted_qa_dicts.append(qa_dict)
+        file_path = os.path.join(qa_dicts_dir, f"{qa_key(qa_dict)}.json")
+        file_body = store_for(qa_dicts_dir).read(file_path) # checks the folder's manifest first, so unvetted questions don't cost a filesystem probe each
+        previous = None
+        if file_body == "failed":
+            vetted_qa_dicts.append(None)
+            return
+        if file_body is not None:
+            try:
+                previous = intern_paragraph(json.loads(file_body))
+            except json.JSONDecodeError:
+                print(f"Could not parse {file_path}; vetting that question again")
+        if previous is not None:
+            vetted_qa_dicts.append(previous)
             return
         
         # NOTE Set up question check generation step
@@ -759,6 +709,7 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
 
         question_checker = GenerationStep(
             prompt_path=prompt_path_q_check,
+            step_name=QUESTION_VALIDATION_STEP,
             regex=check_q_regex,
             sampling_params={
                 "max_tokens": 1500,
@@ -793,9 +744,6 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
             #     f"\n\nStarting QUESTION loop for question: {qtuple[0]}, context: {qtuple[2]}"
             # )
             run_id = question_group_id + "--subquestion--" + make_id()
-            passed_checks = 0
-            times_checked = 0
-            dissenting_reasoning = ""
             if SKIP_QUESTION_CHECK:
                 print("DEBUG: Skipping question check")
                 res = await vet_answer_relevance_loop(
@@ -810,14 +758,10 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
                 
                 vetted_qa_dicts.append(res)
                 if res is not None:
-                    with open(file_path, "w", encoding='utf-8') as file:
-                        json.dump(res, file, indent=4)
+                    store_for(file_path).write(file_path, json.dumps(res, indent=4))
                 return 
-            while times_checked < double_check_counter:
+            async def check_question():
                 check_id = make_id()
-                # print(
-                #     f"\n\nQUESTION CALL CHECK ANSWER: {qtuple[0]}, context: {qtuple[2]}, retries: {total_retries}, dissenting reasoning: {dissenting_reasoning}"
-                # )
                 judgement, check_q_output = await question_checker.generate(paragraph=qa_dict["paragraph"], question=qa_dict["question"], answer=qa_dict["answer"])
 
                 # Now we need to put the judgement together into the format it expects it to be in
@@ -835,18 +779,10 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
                     print("\nNegative Vote Cast! Here was the reasoning:\n")
                     print(dissenting_reasoning)
                     print(f"ID: {check_id}")
-                else:
-                    passed_checks += 1
-                times_checked += 1
-                if passed_checks >= ceil(double_check_counter / 2):
-                    break
-                failed_checks = times_checked - passed_checks
-                if failed_checks >= ceil(double_check_counter / 2):
-                    break
-
-            if passed_checks >= ceil(
-                double_check_counter / 2
-            ):  # if all question checks passed
+                return judgement[0]
+
+            # The votes run at the same time, and as soon as a stage's outcome is decided the next stage starts (or the question is tossed)
+            if await majority_vote(check_question, double_check_counter):  # if all question checks passed
                 # print(f"\n\nQUESTION CHECKS PASSED retries: {total_retries}")
                 
                 if SKIP_ANSWER_RELEVANCY_CHECK:
@@ -874,25 +810,164 @@ async def vet_question_loop( # NOTE adding the pipelinestep class would make thi
                 
                 vetted_qa_dicts.append(res)
                 if res is not None:
-                    with open(file_path, "w", encoding='utf-8') as file:
-                        json.dump(res, file, indent=4)
+                    store_for(file_path).write(file_path, json.dumps(res, indent=4))
                 return
             else: # this path is probably redundant
                 print("Question accuracy validation failed! Tossing")
-                with open(file_path, "w", encoding='utf-8') as file:
-                    file.write("failed")
+                store_for(file_path).write(file_path, "failed")
                 return
         except Exception as e:
             print("!!ERROR!!")
             print(e)
             traceback.print_exc()
-        with open(file_path, "w", encoding='utf-8') as file:
-            file.write("failed")
+        store_for(file_path).write(file_path, "failed")
     except Exception as e:
         print(f"Q ERROR: {e}")
         traceback.print_exc()
 
 
+def parse_batched_qa_checks(response, question_count, completion_mode=False):
+    # One set of judgments per question, in order. Anything missing or garbled raises, so the request is retried (and if it keeps failing, the questions are vetted one at a time)
+    if completion_mode:
+        response = "### Question 1\nReasoning:" + response  # the prompt ends with the start of the first answer
+    blocks = re.split(r"^#+\s*Question\s+(\d+)\s*$", response, flags=re.MULTILINE)
+    verdicts = {}
+    for number, block in zip(blocks[1::2], blocks[2::2]):
+        verdict = {}
+        for check, label, positive, negative in (
+            ("question", "Question judgment", "Relevant", "Irrelevant"),
+            ("answer_relevancy", "Answer relevancy judgment", "Relevant", "Irrelevant"),
+            ("answer_accuracy", "Answer accuracy judgment", "Accurate", "Inaccurate"),
+        ):
+            match = re.search(rf"{label}:\W*({positive}|{negative})", block, re.IGNORECASE)
+            if not match:
+                raise ValueError(f"No {label.lower()} for question {number}")
+            verdict[check] = match.group(1).lower() == positive.lower()
+        verdicts[int(number)] = verdict
+    if sorted(verdicts) != list(range(1, question_count + 1)):
+        raise ValueError(f"Expected judgments for {question_count} questions, got them for {sorted(verdicts)}")
+    return [verdicts[number] for number in range(1, question_count + 1)]
+
+
+async def vet_paragraph_questions_batched(
+    qa_dicts,
+    engine_wrapper=None,
+    qa_dicts_dir=None,
+    vetted_qa_dicts=None,
+    double_check_counter=3,
+    completion_mode=None,
+    logging_level=None,
+):
+    # Checks all the questions of one paragraph together: one request per vote covers the question, answer relevancy and answer accuracy checks of every question,
+    # so the paragraph and the prompt's examples are sent once per vote instead of once per question per check.
+    # If the judgments can't be parsed (even after retries), the questions are vetted one at a time with vet_question_loop
+    to_vet = []
+    for qa_dict in qa_dicts:
+        file_path = os.path.join(qa_dicts_dir, f"{qa_key(qa_dict)}.json")
+        file_body = store_for(qa_dicts_dir).read(file_path)
+        if file_body == "failed":
+            vetted_qa_dicts.append(None)
+            continue
+        if file_body is not None:
+            try:
+                vetted_qa_dicts.append(intern_paragraph(json.loads(file_body)))
+                continue
+            except json.JSONDecodeError:
+                print(f"Could not parse {file_path}; vetting that question again")
+        to_vet.append((qa_dict, file_path))
+    if not to_vet:
+        return
+
+    prompt_path_batch_check = "check_qa_batch"
+    if completion_mode:
+        prompt_path_batch_check = prompt_path_batch_check + ".txt"
+    else:
+        prompt_path_batch_check = prompt_path_batch_check + ".yaml"
+
+    batch_checker = GenerationStep(
+        prompt_path=prompt_path_batch_check,
+        step_name=QUESTION_VALIDATION_STEP,
+        regex=re.compile(r"(.*)", re.DOTALL),
+        sampling_params={
+            "max_tokens": 1500 + 500 * len(to_vet),
+            "stop": [
+                "### Response",
+                "\n\n\n\n\n",
+                "</s>",
+                "# Input:",
+                "[INST]",
+                "### Instruction",
+                "[INST",
+                "<|eot_id|>",
+                "<|start_header_id|>",
+                "<|end_header_id|>",
+            ],
+            "temperature": 0.2,
+        },
+        completion_mode=completion_mode,
+        retries=2,
+        engine_wrapper=engine_wrapper,
+        logging_level=logging_level,
+        output_processor=functools.partial(parse_batched_qa_checks, question_count=len(to_vet), completion_mode=completion_mode),
+        prompt_folder=PROMPTS_DIR,
+        default_prompt_folder=DEFAULT_PROMPTS,
+        use_stop=USE_STOP,
+    )
+
+    checks = ["answer_accuracy"]
+    if not SKIP_QUESTION_CHECK:
+        checks.append("question")
+    if not SKIP_ANSWER_RELEVANCY_CHECK:
+        checks.append("answer_relevancy")
+    questions = "\n\n".join(
+        f'### Question {number}\nQuestion: """{qa_dict["question"]}"""\nAnswer: """{qa_dict["answer"]}"""'
+        for number, (qa_dict, _) in enumerate(to_vet, 1)
+    )
+    run_id = to_vet[0][0]["question_group_id"] + "--batch--" + make_id()
+
+    async def check_questions():
+        check_id = make_id()
+        verdicts, batch_check_output = await batch_checker.generate(
+            paragraph=to_vet[0][0]["paragraph"],
+            questions=questions,
+            question_count=len(to_vet),
+        )
+        write_output_to_file(
+            batch_check_output,
+            obj_conf["PATH"]["OUTPUT"] + "/check_qa_batch_generations",
+            run_id + "--check--" + check_id,
+        )
+        return verdicts
+
+    try:
+        outcomes = await majority_vote_checks(check_questions, double_check_counter, len(to_vet), checks) # a separate majority for each check, as when vetting one question at a time
+    except Exception as e:
+        print(f"Batched vetting failed ({e}); vetting these questions one at a time")
+        await asyncio.gather(*[
+            vet_question_loop(
+                qa_dict,
+                question_group_id=qa_dict["question_group_id"],
+                engine_wrapper=engine_wrapper,
+                qa_dicts_dir=qa_dicts_dir,
+                vetted_qa_dicts=vetted_qa_dicts,
+                double_check_counter=double_check_counter,
+                completion_mode=completion_mode,
+                logging_level=logging_level,
+            )
+            for qa_dict, _ in to_vet
+        ])
+        return
+
+    for (qa_dict, file_path), passed in zip(to_vet, outcomes):
+        if passed:
+            store_for(file_path).write(file_path, json.dumps(qa_dict, indent=4))
+            vetted_qa_dicts.append(qa_dict)
+        else:
+            print(f"Question {qa_dict['question_idx']} of paragraph {qa_dict['paragraph_idx']} failed validation! Tossing")
+            store_for(file_path).write(file_path, "failed")
+            vetted_qa_dicts.append(None)
+
+
 
 
 ### Question Generation Section
@@ -952,36 +1027,47 @@ class QuestionGenerationStep(PipelineStep): # like before, but with the new syst
             save_path="raw_qatuples_saved",
             result_key="not_used",
         )
+        self.saved_by_paragraph = None # paragraph idx -> its saved question files, from one pass over the folder (rather than a glob per paragraph)
         
     def read_previous_output(self, idx, output_list):
-        existing_files = glob.glob(
-            os.path.join(self.save_path_dir, f"para_{idx}_*.json")
-        )
+        if self.saved_by_paragraph is None:
+            self.saved_by_paragraph = {}
+            for name in self.store.manifest(self.save_path_dir):
+                match = re.match(r"para_(\d+)_q_\d+\.json$", name)
+                if match:
+                    self.saved_by_paragraph.setdefault(int(match.group(1)), []).append(name)
+        existing_files = [
+            os.path.join(self.save_path_dir, name) for name in sorted(self.saved_by_paragraph.get(idx, []))
+        ]
         
         if len(existing_files) > 0:
-            print(f"Skipping para_{idx} as files already exist; loading said files")
+            qa_dicts = []
             for file_path in existing_files:
-                with open(file_path, "r", encoding='utf-8') as file:
-                    qa_dict = json.load(file)
-                output_list.append(qa_dict)
+                content = self.store.read(file_path) # None if it's corrupted; the store has already said so
+                try:
+                    qa_dicts.append(intern_paragraph(json.loads(content)))
+                except (TypeError, json.JSONDecodeError):
+                    print(f"Could not read {file_path}; generating the questions for para_{idx} again")
+                    return False # all of them, so the paragraph's questions all come from the same generation
+            print(f"Skipping para_{idx} as files already exist; loading said files")
+            output_list.extend(qa_dicts)
             return True
         return False
     
-    def generate_data(self, processed_data, engine_wrapper):
-        self.question_group_id = make_id()
-        return super().generate_data(processed_data, engine_wrapper)
-    
     def save(self, result=None, full_output=None, idx=None, output_list=None, input_data=None):
 
         id = make_id()
+        question_group_id = make_id() # made here rather than on the step object, which every paragraph's task shares
         write_output_to_file(full_output, self.intermediate_output_path_full, id)
+        para_id, paragraph = paragraph_table.intern(input_data['paragraph'])
         qdicts = [
             {
-                "paragraph": input_data['paragraph'],
+                "paragraph": paragraph,
+                "paragraph_id": para_id,
                 "metadata": input_data['metadata'],
                 "question": qatup[0],
                 "answer": qatup[1],
-                "question_group_id": self.question_group_id,
+                "question_group_id": question_group_id,
                 "paragraph_idx": idx,
                 "question_idx": qnum,
             } for qnum, qatup in enumerate(result)
@@ -990,11 +1076,9 @@ class QuestionGenerationStep(PipelineStep): # like before, but with the new syst
         output_list.extend(qdicts)
         
         # Save the output to a file
-        os.makedirs(self.save_path_dir, exist_ok=True)
         for qdict in qdicts:
             file_path = os.path.join(self.save_path_dir, f"para_{idx}_q_{qdict['question_idx']}.json")
-            with open(file_path, "w", encoding='utf-8') as file:
-                json.dump(qdict, file, indent=4)
+            self.store.write(file_path, json.dumps(qdict, indent=4))
 
 question_generation_step = QuestionGenerationStep() 
 
@@ -1090,32 +1174,35 @@ class JudgeParagraphStep(PipelineStep):
     def read_previous_output(self, idx, output_list):
         save_path_file = self.make_save_path_file(idx)
         
-        if os.path.isfile(save_path_file):
-            with open(save_path_file, "r", encoding='utf-8') as f:
+        content = self.store.read(save_path_file)
+        if content is not None:
+            if content.startswith("failed|"):
+                data = content
+            else:
                 try:
-                    data = json.load(f)
+                    data = json.loads(content)
                 except json.JSONDecodeError:
-                    data = f.read()
-                if isinstance(data, str):
-                    output_list.append(
-                        {
-                            "paragraph": None,
-                            "metadata": data[7:]
-                        }
-                    )
-                else:
-                    output_list.append(
-                        {
-                            "paragraph": data["paragraph"], 
-                            "metadata": data["metadata"]
-                        }
-                    )
+                    print(f"Could not parse {save_path_file}; judging that paragraph again")
+                    return False
+            if isinstance(data, str):
+                output_list.append(
+                    {
+                        "paragraph": None,
+                        "metadata": data[7:]
+                    }
+                )
+            else:
+                output_list.append(
+                    {
+                        "paragraph": data["paragraph"], 
+                        "metadata": data["metadata"]
+                    }
+                )
             return True
         else:
             return False
     
     def save(self, result=None, full_output=None, idx=None, output_list=None, input_data=None):
-        os.makedirs(self.full_output_path, exist_ok=True)
         save_path_file = self.make_save_path_file(idx)
         
         
@@ -1127,9 +1214,8 @@ class JudgeParagraphStep(PipelineStep):
                 "metadata": input_data["metadata"]
             }
             output_list.append(output_data)
-            with open(save_path_file, "w", encoding='utf-8') as f:
-                metadata = input_data["metadata"]
-                f.write(f"failed|{metadata}")
+            metadata = input_data["metadata"]
+            self.store.write(save_path_file, f"failed|{metadata}")
             print(f"DEBUG model decided that index {idx} was not suitable")
             print(f"Saved to {save_path_file}")
         else:
@@ -1138,9 +1224,7 @@ class JudgeParagraphStep(PipelineStep):
                 "metadata": input_data["metadata"]
             }
             output_list.append(output_data)
-            os.makedirs(os.path.dirname(save_path_file), exist_ok=True)
-            with open(save_path_file, "w", encoding='utf-8') as f:
-                json.dump(output_data, f)
+            self.store.write(save_path_file, json.dumps(output_data))
             print(f"DEBUG model decided that index {idx} was suitable")
             print(f"Saved to {save_path_file}")
             
@@ -1157,27 +1241,26 @@ async def filter_all_questions(
     take_subset=False,
     subset_size=None,
     use_filenames=False,
-    rtwl=None,
+    run_all=None,
     completion_mode=None,
     logging_level=None,
 ):
+    # judged_worthy_for_questions gets (idx, judgement) pairs, idx being the paragraph's position in the input: later steps save their work under it, whatever order the judgements finish in
+    async def judge(item):
+        idx, p = item
+        # determine_worthy(idx, p, judged_worthy_for_questions, output_dir, engine_wrapper)
+        judged = []
+        await judge_paragraph_step.run(idx, input_data=p, output_list=judged, engine_wrapper=engine_wrapper)
+        judged_worthy_for_questions.extend((idx, judgement) for judgement in judged)
+
     if not take_subset:
-        tasks = [
-            # determine_worthy(idx, p, judged_worthy_for_questions, output_dir, engine_wrapper)
-            judge_paragraph_step.run(idx, input_data=p, output_list=judged_worthy_for_questions, engine_wrapper=engine_wrapper)
-            for idx, p in enumerate(paragraphs_processed)
-        ]
+        await run_all(judge, enumerate(paragraphs_processed), total=len(paragraphs_processed))
     else:
         random.seed(42)
         random.shuffle(paragraphs_processed)
-        tasks = [
-            # determine_worthy(idx, p, judged_worthy_for_questions, output_dir, engine_wrapper)
-            judge_paragraph_step.run(idx, input_data=p, output_list=judged_worthy_for_questions, engine_wrapper=engine_wrapper)
-            for idx, p in enumerate(paragraphs_processed[:subset_size])
-        ]
-    limited_tasks = [rtwl(task) for task in tasks]
-    for future in tqdmasyncio.tqdm.as_completed(limited_tasks):
-        await future
+        subset = paragraphs_processed[:subset_size]
+        await run_all(judge, enumerate(subset), total=len(subset))
+    judged_worthy_for_questions.sort(key=lambda pair: pair[0])
 
 
 def fix_text(to_replace_arr, text):
@@ -1259,82 +1342,84 @@ def convert_directory_to_list(directory_path):
     simplified_rag_list = []
     plain_qa_list = []
 
-    for filename in os.listdir(directory_path):  # for each file
-        if filename.endswith(".json"):  # if it's a conversation file
-            filepath = os.path.join(directory_path, filename)  # get the path
-            with open(filepath, "r", encoding='utf-8') as file:  # open it
-                try:
-                    data_dict = json.load(file)  # load its data
-                    master_list.append(
-                        data_dict
-                    )  # append it as-is to the master-list
+    store = store_for(directory_path)
+    for filepath in store.glob(os.path.join(directory_path, "*.json")):  # for each conversation file (on disk, or in the run store)
+        filename = os.path.basename(filepath)
+        try:
+            content = store.read(filepath)
+            if content is None:  # corrupted; the store has already said so
+                continue
+            data_dict = json.loads(content)  # load its data
+            master_list.append(
+                data_dict
+            )  # append it as-is to the master-list
+
+            dialogues = process_multiturn_functions.extract_conversation(
+                data_dict["conversation"]
+            )
+            
+            plain_conversations = []
+
+            # Convert to simplified format
+            simplified_conversations = []
+            simplified_conversations_rag = []
+
+            system_prompt_rag = random.choice(FINAL_ASSISTANT_PROMPTS_RAG)
+            simplified_conversations_rag.append(
+                {
+                    "from": "system",
+                    "value": system_prompt_rag.replace(
+                        "{data}", data_dict['dict_list'][0]["paragraph"]
+                    ),
+                }
+            )
+            
+            if not DO_NOT_USE_SYSTEM_PROMPTS:
+                # Load system prompts
+                system_prompt_norag = random.choice(FINAL_ASSISTANT_PROMPTS_NO_RAG)
+                
+                simplified_conversations.append(
+                    {"from": "system", "value": system_prompt_norag}
+                )
+                
+                plain_conversations.append(
+                    {"from": "system", "value": system_prompt_norag}
+                )
+                
 
-                    dialogues = process_multiturn_functions.extract_conversation(
-                        data_dict["conversation"]
-                    )
-                    
-                    plain_conversations = []
-
-                    # Convert to simplified format
-                    simplified_conversations = []
-                    simplified_conversations_rag = []
-
-                    system_prompt_rag = random.choice(FINAL_ASSISTANT_PROMPTS_RAG)
-                    simplified_conversations_rag.append(
-                        {
-                            "from": "system",
-                            "value": system_prompt_rag.replace(
-                                "{data}", data_dict['dict_list'][0]["paragraph"]
-                            ),
-                        }
-                    )
-                    
-                    if not DO_NOT_USE_SYSTEM_PROMPTS:
-                        # Load system prompts
-                        system_prompt_norag = random.choice(FINAL_ASSISTANT_PROMPTS_NO_RAG)
-                        
-                        simplified_conversations.append(
-                            {"from": "system", "value": system_prompt_norag}
-                        )
-                        
-                        plain_conversations.append(
-                            {"from": "system", "value": system_prompt_norag}
-                        )
-                        
-
-                        
-                    for i, (charname, message) in enumerate(
-                        dialogues
-                    ):  # Skipping the first message
-                        from_person = "human" if (i % 2) == 0 else "gpt"
-                        simplified_conversations.append(
-                            {"from": from_person, "value": f"{message}"}
-                        )
-                        simplified_conversations_rag.append(
-                            {
-                                "from": from_person,
-                                "value": f"{message}",
-                            }  # same as above, but for the RAG context
-                        )
-
-                    if simplified_conversations:  # If there are any conversations
-                        simplified_list.append(
-                            {"conversations": simplified_conversations}
-                        )
-                        simplified_rag_list.append(
-                            {"conversations": simplified_conversations_rag}
-                        )
-                        
-                        # handle plain QA tuples
-                    for d in data_dict["dict_list"]:
-                        q = d["question"]
-                        a = d["answer"]
-                        plain_conversations.append({"from": "human", "value": q})
-                        plain_conversations.append({"from": "gpt", "value": a})
-                    plain_qa_list.append({"conversations": plain_conversations})
-                        
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
+                
+            for i, (charname, message) in enumerate(
+                dialogues
+            ):  # Skipping the first message
+                from_person = "human" if (i % 2) == 0 else "gpt"
+                simplified_conversations.append(
+                    {"from": from_person, "value": f"{message}"}
+                )
+                simplified_conversations_rag.append(
+                    {
+                        "from": from_person,
+                        "value": f"{message}",
+                    }  # same as above, but for the RAG context
+                )
+
+            if simplified_conversations:  # If there are any conversations
+                simplified_list.append(
+                    {"conversations": simplified_conversations}
+                )
+                simplified_rag_list.append(
+                    {"conversations": simplified_conversations_rag}
+                )
+                
+                # handle plain QA tuples
+            for d in data_dict["dict_list"]:
+                q = d["question"]
+                a = d["answer"]
+                plain_conversations.append({"from": "human", "value": q})
+                plain_conversations.append({"from": "gpt", "value": a})
+            plain_qa_list.append({"conversations": plain_conversations})
+                
+        except Exception as e:
+            print(f"Error reading {filename}: {e}")
 
     
     
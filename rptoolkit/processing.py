@@ -1,12 +1,19 @@
 import random
 import traceback
 from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+from augmentoolkit.generation_functions.llamacpp_client import close_shared_session
+from augmentoolkit.generation_functions.response_cache import ResponseCache
+from augmentoolkit.generation_functions.request_recorder import RequestRecorder, seed_random
+from augmentoolkit.generation_functions.request_metrics import MetricsLog
+from augmentoolkit.generation_functions.transcript import set_transcript_format
+from augmentoolkit.generation_functions.run_store import close_run_stores, open_run_store
+from augmentoolkit.generation_functions.retry_policy import set_retry_budget
+from augmentoolkit.generation_functions.worker_pool import run_pool
 from augmentoolkit.utils.write_output_to_file import write_output_to_file
-from rptoolkit.steps import API_KEY_A, API_KEY_B, BASE_URL_A, BASE_URL_B, CONCURRENCY_LIMIT, LOGICAL_MODEL_A, LOGICAL_MODEL_B, MODE_A, MODE_B, OUTPUT_FOLDER, chunking_algorithm, count_tokens, extract_charname, extract_features, fix_text, generate_emotion_constrained, generate_emotion_from_text, generate_scene_card, generate_story, is_story_awesome, is_story_ok, make_id, obj_conf, rate_story, scrape_novels, validate_generation, validate_length_callback, validate_not_none, validate_rating_keys_presence, validate_repetition_callback, write_final_dataset_files
+from rptoolkit.steps import API_KEY_A, API_KEY_B, BASE_URL_A, BASE_URL_B, CONCURRENCY_LIMIT, MAX_CONCURRENCY_LIMIT, ENDPOINT_WEIGHTS_A, ENDPOINT_WEIGHTS_B, LOGICAL_MODEL_A, LOGICAL_MODEL_B, MODE_A, MODE_B, REQUESTS_PER_MINUTE_A, REQUESTS_PER_MINUTE_B, TOKENS_PER_MINUTE_A, TOKENS_PER_MINUTE_B, OUTPUT_FOLDER, chunking_algorithm, count_tokens, extract_charname, extract_features, fix_text, generate_emotion_constrained, generate_emotion_from_text, generate_scene_card, generate_story, is_story_awesome, is_story_ok, make_id, obj_conf, rate_story, scrape_novels, validate_generation, validate_length_callback, validate_not_none, validate_rating_keys_presence, validate_repetition_callback, write_final_dataset_files
 from tqdm import tqdm
 
 import nltk
-from tqdm import asyncio as tqdmasyncio
 
 
 import asyncio
@@ -16,6 +23,7 @@ import os
 import sys
 import time
 import yaml
+from augmentoolkit.utils.parse_bool import parse_bool
 
 config_path = os.environ["CONFIG_PATH"]
 with open (config_path, "r") as file:
@@ -34,6 +42,17 @@ LNCO_CHAPTER_COUNT = int(config["SCRAPING"]["LNCO_CHAPTER_COUNT"])
 LNCO_NOVEL_COUNT = int(config["SCRAPING"]["LNCO_NOVEL_COUNT"])
 LNCO_WAIT_TIME = int(config["SCRAPING"]["LNCO_WAIT_TIME"])
 LNCO_MAX_WORKERS = int(config["SCRAPING"]["LNCO_MAX_WORKERS"])
+USE_RESPONSE_CACHE = parse_bool(config["SYSTEM"].get("USE_RESPONSE_CACHE", False))
+USE_STREAMING = parse_bool(config["SYSTEM"].get("USE_STREAMING", True))
+HEDGE_PERCENTILE = float(config["SYSTEM"].get("HEDGE_PERCENTILE", 0)) or None
+RECORD_REQUESTS = parse_bool(config["SYSTEM"].get("RECORD_REQUESTS", False))
+RANDOM_SEED = config["SYSTEM"].get("RANDOM_SEED")
+REQUEST_METRICS = parse_bool(config["SYSTEM"].get("REQUEST_METRICS", True))
+TRANSCRIPT_FORMAT = config["SYSTEM"].get("TRANSCRIPT_FORMAT", "yaml")
+set_transcript_format(TRANSCRIPT_FORMAT)
+STORAGE_BACKEND = config["SYSTEM"].get("STORAGE_BACKEND", "files")
+STEP_CONCURRENCY_LIMITS = config["SYSTEM"].get("STEP_CONCURRENCY_LIMITS") or {}
+RETRY_BUDGET = int(config["SYSTEM"].get("RETRY_BUDGET", 0))
 
 async def generate_data(chunk: str, engine_wrapper: EngineWrapper, engine_wrapper_large: EngineWrapper, stories, idx):
     # NOTE Generate emotions, or pick
@@ -95,10 +114,11 @@ async def main():
     print("Begun")
 
     # Set up rate-limit-conscious functions
-    semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    async def run_task_with_limit(task):
-        async with semaphore:
-            return await task
+    # The engine wrappers decide how many requests are actually in flight; this just stops every task from starting at once.
+    # A fixed pool of workers pulls chunks one at a time, so only MAX_CONCURRENCY_LIMIT tasks exist at once however big the input is
+    async def run_all(function, inputs, total=None):
+        with tqdm(total=total) as progress_bar:
+            await run_pool(function, inputs, MAX_CONCURRENCY_LIMIT, progress_bar=progress_bar)
 
 
     extension = ".txt"
@@ -107,11 +127,42 @@ async def main():
     source_texts = glob.glob(path)
 
     # NOTE Initialize the Engine (or API client)
+    response_cache = None
+    if USE_RESPONSE_CACHE: # lets a re-run after a crash or a prompt tweak only pay for the requests that actually changed
+        response_cache = ResponseCache(os.path.join(OUTPUT_FOLDER, "response_cache.sqlite"))
+
+    open_run_store(OUTPUT_FOLDER, STORAGE_BACKEND) # "sqlite" keeps everything the steps save in one run_store.sqlite instead of a file per item
+    EngineWrapper.set_step_concurrency_limits(STEP_CONCURRENCY_LIMITS) # e.g. cap story generation so the small model's steps for other chunks still get through
+    retry_budget = set_retry_budget(RETRY_BUDGET) # 0 means no cap on retries for the run
+
+    random_seed = RANDOM_SEED
+    if RECORD_REQUESTS or random_seed is not None: # prompts include random choices, so a replay only matches the recording if it's seeded the same way
+        random_seed = seed_random(random_seed)
+
+    request_recorder = None
+    if RECORD_REQUESTS: # the recording can be served back by utils_for_manual_use/replay_server.py for offline benchmark runs
+        request_recorder = RequestRecorder(os.path.join(OUTPUT_FOLDER, "request_log.jsonl"), seed=random_seed)
+        print(f"Recording requests; set RANDOM_SEED: {random_seed} when replaying them")
+
+    metrics_log = None
+    if REQUEST_METRICS: # per-request timings/tokens/retries, by step; a summary table is printed at the end
+        metrics_log = MetricsLog(os.path.join(OUTPUT_FOLDER, "request_metrics.jsonl"))
+
     engine_wrapper = EngineWrapper(
         model=LOGICAL_MODEL_A,
         api_key=API_KEY_A,
         base_url=BASE_URL_A,
         mode=MODE_A,
+        cache=response_cache,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE_A,
+        tokens_per_minute=TOKENS_PER_MINUTE_A,
+        endpoint_weights=ENDPOINT_WEIGHTS_A,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
     )
 
     engine_wrapper_large = EngineWrapper(
@@ -119,6 +170,16 @@ async def main():
         api_key=API_KEY_B,
         base_url=BASE_URL_B,
         mode=MODE_B,
+        cache=response_cache,
+        concurrency_limit=CONCURRENCY_LIMIT,
+        max_concurrency_limit=MAX_CONCURRENCY_LIMIT,
+        requests_per_minute=REQUESTS_PER_MINUTE_B,
+        tokens_per_minute=TOKENS_PER_MINUTE_B,
+        endpoint_weights=ENDPOINT_WEIGHTS_B,
+        stream=USE_STREAMING,
+        hedge_percentile=HEDGE_PERCENTILE,
+        recorder=request_recorder,
+        metrics_log=metrics_log,
     )
 
     # NOTE Tokenize and chunk text
@@ -157,10 +218,10 @@ async def main():
 
     # NOTE Generate the data
     story_data = []
-    data_generations_tasks = [generate_data(chunk=chunk, engine_wrapper=engine_wrapper, engine_wrapper_large=engine_wrapper_large, stories=story_data, idx=idx) for idx, chunk in enumerate(paragraphs_processed)]
-    coroutines = [run_task_with_limit(task) for task in data_generations_tasks]
-    for future in tqdmasyncio.tqdm.as_completed(coroutines):
-        await future
+    async def generate_story_data(item):
+        idx, chunk = item
+        await generate_data(chunk=chunk, engine_wrapper=engine_wrapper, engine_wrapper_large=engine_wrapper_large, stories=story_data, idx=idx)
+    await run_all(generate_story_data, enumerate(paragraphs_processed), total=len(paragraphs_processed))
 
     if (PHASE_INDEX == 2 and WORK_IN_PHASES) or not WORK_IN_PHASES:
         minimally_ok_stories = [story for story in story_data if is_story_ok(story)]
@@ -179,6 +240,24 @@ async def main():
         total_tokens_of_stories = sum([count_tokens(story["story"]) for story in story_data])
         print("Total tokens of all stories (roughly equivalent to the number of training tokens): ", total_tokens_of_stories)
         print(f"Time taken: {time.time() - start_time} seconds")
+        if response_cache:
+            print(f"Response cache stats: {response_cache.stats()}")
+        for server, limiter in EngineWrapper.shared_concurrency_limiters.items():
+            print(f"Concurrency stats for {server}: {limiter.stats()}")
+        for (server, model), limiter in EngineWrapper.shared_rate_limiters.items():
+            print(f"Rate limit stats for {model} at {server}: {limiter.stats()}")
+        if len(engine_wrapper.endpoint_pool) > 1 or len(engine_wrapper_large.endpoint_pool) > 1:
+            print(f"Endpoint stats: {engine_wrapper.endpoint_pool.stats()} {engine_wrapper_large.endpoint_pool.stats()}")
+        for wrapper in (engine_wrapper, engine_wrapper_large):
+            if wrapper.latency_tracker:
+                print(f"Hedging stats for {wrapper.model}: {wrapper.latency_tracker.stats()}")
+        print(f"Retry stats: {retry_budget.stats()}")
+        if request_recorder:
+            print(f"Recorded {request_recorder.records} requests to {request_recorder.path}")
+        if metrics_log:
+            metrics_log.print_summary("story generation")
+        await close_shared_session()  # only does anything if a llamacpp mode was used
+        close_run_stores()
         print("ShareGPT-format .json export is created, and the full dataset is also available in the final_outputs folder.")
         if len(story_data) == 0:
             print("Hmm... No stories were generated. Check the logs for more information, and consider creating an issue if this is unexpected. If you do make an issue, please include your input data and the logs!")
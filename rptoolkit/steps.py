@@ -15,6 +15,9 @@ import logging
 from math import ceil
 import traceback
 from augmentoolkit.generation_functions.pipeline_step_class import PipelineStep
+from augmentoolkit.generation_functions.depth_first_pipeline_step import DepthFirstPipelineStep
+from augmentoolkit.utils.write_output_to_file import write_output_to_file
+from augmentoolkit.generation_functions.retry_policy import RetryPolicy, ValidationFailed
 import uuid
 import yaml
 import nltk
@@ -47,9 +50,18 @@ API_KEY_A = obj_conf["API"]["API_KEY_A"]
 API_KEY_B = obj_conf["API"]["API_KEY_B"]
 BASE_URL_A = obj_conf["API"]["BASE_URL_A"]
 BASE_URL_B = obj_conf["API"]["BASE_URL_B"]
+# Optional provider quotas, 0 means no limit. Requests wait for budget instead of getting rate limited
+REQUESTS_PER_MINUTE_A = int(obj_conf["API"].get("REQUESTS_PER_MINUTE_A", 0)) or None
+TOKENS_PER_MINUTE_A = int(obj_conf["API"].get("TOKENS_PER_MINUTE_A", 0)) or None
+REQUESTS_PER_MINUTE_B = int(obj_conf["API"].get("REQUESTS_PER_MINUTE_B", 0)) or None
+TOKENS_PER_MINUTE_B = int(obj_conf["API"].get("TOKENS_PER_MINUTE_B", 0)) or None
+# BASE_URL_A/B (and API_KEY_A/B) can be lists of identical servers to load balance across; optional relative capacity of each
+ENDPOINT_WEIGHTS_A = obj_conf["API"].get("ENDPOINT_WEIGHTS_A")
+ENDPOINT_WEIGHTS_B = obj_conf["API"].get("ENDPOINT_WEIGHTS_B")
 MODE_A = obj_conf["SYSTEM"]["MODE_A"]
 MODE_B = obj_conf["SYSTEM"]["MODE_B"]
 CONCURRENCY_LIMIT = int(obj_conf["SYSTEM"]["CONCURRENCY_LIMIT"])
+MAX_CONCURRENCY_LIMIT = int(obj_conf["SYSTEM"].get("MAX_CONCURRENCY_LIMIT", CONCURRENCY_LIMIT * 4)) # the adaptive limiter starts at CONCURRENCY_LIMIT and can grow up to this while the API keeps up
 USE_STOP = parse_bool(obj_conf["SYSTEM"]["STOP"])
 EMOTIONS = parse_string_list.parse_string_list(obj_conf["SYSTEM"]["EMOTIONS"])
 INCLUDE_CHUNK_IN_PROMPT = parse_bool(obj_conf["SYSTEM"]["INCLUDE_CHUNK_IN_PROMPT"])
@@ -120,25 +132,25 @@ async def validate_generation(gen_func, validation_functions, retries=1, gen_fun
     The gen_func_args should ALWAYS have the id be the last argument
     """
     times_tried = 0
-    while times_tried <= retries:
+    async def attempt():
+        nonlocal times_tried
         try:
             response = await gen_func(*gen_func_args[:-1], str(gen_func_args[-1]) + f"_{times_tried}")
-            success = True
-            for validation_function in validation_functions:
-                if not validation_function(response):
-                    print("VALIDATION FAILED")
-                    success = False
-                    break
-            if success:
-                return response
-            else:
-                times_tried += 1
         except Exception as e:
-            times_tried += 1
             print(f"Error in Generation Step: {e}")
-            print(e)
             traceback.print_exc()
-    raise Exception("VALIDATION FAILED TOO MANY TIMES -- CUTTING LOSSES AND SKIPPING THIS CHUNK\n\n\n")
+            raise
+        finally:
+            times_tried += 1
+        for validation_function in validation_functions:
+            if not validation_function(response):
+                print("VALIDATION FAILED")
+                raise ValidationFailed(getattr(validation_function, "__name__", "validation function"))
+        return response
+    try:
+        return await RetryPolicy(retries=retries).run(attempt, getattr(gen_func, "__name__", None))
+    except Exception as e:
+        raise Exception("VALIDATION FAILED TOO MANY TIMES -- CUTTING LOSSES AND SKIPPING THIS CHUNK\n\n\n") from e
 
 # Helpers for said abstraction
 def validate_length_callback(length): # returns a function that checks if a string is a certain length
@@ -159,6 +171,18 @@ def validate_consecutive_repetition_callback(min_length): # returns a function t
     return inner
 
 
+def validate_no_runaway_repetition_callback(min_length, num_repetitions_allowed, window): # returns a function that checks whether a (still streaming) string has got stuck repeating the same chunk of text back-to-back
+    def inner(string):
+        tail = string[-window:] # a model stuck in a loop is looping at the end of its output, so only the tail needs checking, which keeps this cheap however long the output gets
+        for period in range(min_length, len(tail) // (num_repetitions_allowed + 1) + 1):
+            span = period * (num_repetitions_allowed + 1)
+            # the last `span` characters are the same `period` characters over and over (ignoring things like "=====" dividers)
+            if tail[-span:-period] == tail[-span + period:] and len(set(tail[-period:])) > 1:
+                return False
+        return True
+    return inner
+
+
 def find_frequent_substrings(text, min_length, min_occurrences, cluster_threshold):
     def update_counts(substring, index):
         # Update positions and remove indices that are out of the current cluster scope
@@ -217,81 +241,12 @@ def validate_not_none(input):
 def make_id():
     return str(uuid.uuid4())
 
-# Also used basically everywhere:
-def write_output_to_file(output, directory, uuid):
-    # Ensure directory exists
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-
-    # Define the file path using the directory and UUID
-    file_path = os.path.join(directory, f"{uuid}.txt")
-
-    # Write the output to the file
-    with open(file_path, "w", encoding="utf-8") as file:
-        file.write(output)
-
-    print(f"Output written to {file_path}")
-    
 def fix_text(to_replace_arr, text): # see common errors across your input text? Give this an array of tuples ("bad string from input text","string it should be") and this'll fix up the raw inputs. Example for double spaces only: to_replace_arr = [("  ", "")]
     for startup in to_replace_arr:
         text = text.replace(startup[0], startup[1])
     return text
     
     
-class DepthFirstPipelineStep(PipelineStep): # RPTOOLKIT is depth-first rather than breadth-first, so it is easiest to build these steps out using a different class of pipeline step that is focused on returning rather than appending to an output list
-    def read_previous_output(self, idx):
-        save_path_file = super().make_save_path_file(idx)
-        if os.path.exists(save_path_file):
-            with open(save_path_file, "r", encoding='utf-8') as f:
-                output_data = json.load(f)
-            return output_data
-        return False
-    
-    def save(self, result=None,
-    full_output=None,
-    idx=None,
-    input_data=None,):
-        
-        if result:
-            id = make_id()
-            save_path_file = super().make_save_path_file(idx)
-            
-            output_data = input_data
-            output_data[self.result_key] = result
-            write_output_to_file(full_output, self.intermediate_output_path_full, id)
-            
-            os.makedirs(self.save_path, exist_ok=True)
-            with open(save_path_file, "w",encoding='utf-8') as f:
-                f.write(json.dumps(output_data, ensure_ascii=False))
-            
-            return output_data
-    
-    async def run(self, idx=None,
-    input_data=None,
-    engine_wrapper=None,
-      ): # things that are args here are produced during inference time. Including config settings.
-        
-        read_previous_item = self.read_previous_output(idx)
-        if read_previous_item:
-            return read_previous_item
-        
-        processed_data = super().process_input_data(input_data)
-        
-        complete = False
-        max_retries = self.max_retries
-        while not complete and max_retries > 0:
-            try:
-                result, full_output = await super().generate_data(processed_data, engine_wrapper)
-                if self.validation_function(result, input_data):
-                    complete = True
-            except Exception as e:
-                print(e)
-                traceback.print_exc() 
-                max_retries -= 1
-        if not complete: # consider raising here and catching in the actual pipeline.
-            return
-        
-        return self.save(result=result, full_output=full_output, idx=idx, input_data=input_data)
 #### BEGIN GENERATION STEPS
     
     
@@ -637,6 +592,46 @@ def parse_story_messages(story):
     print("==================================")
     return (processed_story_string, truncated)
 
+class StoryShouldStop: # checked while the story streams in; passed to stop_when as the class, so each stream gets its own instance (see StreamMonitor)
+    # parse_story_messages cuts the story off at the first overlong message or repeated character message, so once either has been written, everything after it is wasted tokens.
+    # Messages are only parsed (and tokenized) once they're complete, rather than the whole story on every check; the one still being written is looked at each time.
+    def __init__(self):
+        self.charname = None
+        self.offset = 0 # where the message still being written starts
+        self.completed = 0 # messages before it
+        self.too_long_seen = False
+        self.character_messages = {} # the character's completed messages -> where they first appeared
+        self.repeated = set() # ...and where the ones that have been repeated first appeared
+
+    def too_long(self, message, index):
+        # the first message is skipped because parse_story_messages doesn't truncate there either; the length check comes first because it's much cheaper than tokenizing
+        return index > 0 and len(message["content"]) > 650 and count_tokens(message["content"]) > 650
+
+    def __call__(self, story_so_far):
+        charname = get_character_name(story_so_far)
+        if not charname:
+            return False
+        if charname != self.charname: # (re)start with the name the story turned out to use
+            self.__init__()
+            self.charname = charname
+        starts = [self.offset + match.start() for match in re.finditer(rf"^(?:{re.escape(charname)}|\{{user\}}):", story_so_far[self.offset:], re.MULTILINE)]
+        for start, end in zip(starts, starts[1:]): # messages finished since the last check
+            for message in parse_chatlog(story_so_far[start:end], charname):
+                self.too_long_seen = self.too_long_seen or self.too_long(message, self.completed)
+                if message["owner"] != "{user}":
+                    first_seen = self.character_messages.setdefault(message["content"], self.completed)
+                    if first_seen != self.completed:
+                        self.repeated.add(first_seen)
+                self.completed += 1
+        if starts:
+            self.offset = starts[-1]
+            if any(self.too_long(message, self.completed) for message in parse_chatlog(story_so_far[self.offset:], charname)):
+                return True
+        # like find_duplicate_character_message, which returns where the earliest repeated message first appeared; if that's the first message, parse_story_messages reads the 0 as "no duplicates"
+        return self.too_long_seen or (bool(self.repeated) and 0 not in self.repeated)
+
+story_repetition_callback = validate_no_runaway_repetition_callback(16, 4, 1500)
+
 ## Step
 
 if INCLUDE_CHUNK_IN_PROMPT:
@@ -685,6 +680,8 @@ story_generator = DepthFirstPipelineStep(
     result_key="story",
     use_stop=USE_STOP,
     regex=re.compile(r'### NOW! THE STORY BEGINS ###(.*?)###', re.DOTALL),
+    stream_validators=[story_repetition_callback], # a story stuck in a loop is aborted and retried immediately instead of after 7000 tokens
+    stop_when=[StoryShouldStop],
 )
 
 
@@ -870,10 +867,7 @@ async def edit_story(scene_card, story, engine_wrapper, id):
         raise Exception("\n\nUnpacking failed!!")
     print("----------------------------------------------------")
     
-    try:
-        write_output_to_file(full_output, OUTPUT_FOLDER + "/edit_story", id)
-    except:
-        pass
+    write_output_to_file(full_output, OUTPUT_FOLDER + "/edit_story", id, extension=".txt") # handles chat-mode Transcripts too, so there's nothing to swallow here any more
     return result[0], result[1], result[2]
 
 ### End Generate Story
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from augmentoolkit.generation_functions.engine_wrapper_class import EngineWrapper
+
+# Measures how much event loop time EngineWrapper spends per generated token, using a fake server that streams instantly,
+# so the only cost being measured is our own. Compares the old way of building the output (adding each piece onto a string)
+# against the current one, and against non-streaming mode. Run from the repo root: python -m utils_for_manual_use.benchmark_stream_accumulation
+# On CPython the first two come out about the same (within run-to-run noise, ~1.3-2us per token each): its in-place string concatenation
+# already avoids the quadratic copying here, and "after" also does the stream monitoring "before" didn't have. List + join just keeps it linear
+# everywhere; turning streaming off is what actually removes the per-token cost.
+
+TOKENS_PER_RESPONSE = 7000  # about the longest generate_story output
+CONCURRENT_REQUESTS = 50
+TOKEN_TEXT = " word"
+REPEATS = 5  # the best of several runs, since a single one is noisy at this scale
+
+
+def make_chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text), text=text)])
+
+
+class FakeStream:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def __aiter__(self):
+        return self.generate()
+
+    async def generate(self):
+        for index in range(self.tokens):
+            if index % 64 == 0:
+                await asyncio.sleep(0)  # like a real stream, let the other requests run while we "wait for the network"
+            yield make_chunk(TOKEN_TEXT)
+
+
+class FakeChatCompletions:
+    async def create(self, stream=False, **kwargs):
+        if stream:
+            return FakeStream(TOKENS_PER_RESPONSE)
+        message = SimpleNamespace(content=TOKEN_TEXT * TOKENS_PER_RESPONSE)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+fake_client = SimpleNamespace(chat=SimpleNamespace(completions=FakeChatCompletions()))
+
+
+async def old_stream_chat(client, messages, sampling_params):
+    # How EngineWrapper used to accumulate streamed output
+    completion = ""
+    stream = await client.chat.completions.create(messages=messages, stream=True)
+    async for chunk in stream:
+        if chunk.choices[0].delta.content:
+            completion = completion + chunk.choices[0].delta.content
+    return completion, False
+
+
+async def run(stream_function):
+    messages = [{"role": "user", "content": "hi"}]
+    sampling_params = {"temperature": 1, "top_p": 1, "stop": [], "max_tokens": TOKENS_PER_RESPONSE}
+    start = time.process_time()
+    results = await asyncio.gather(
+        *[stream_function(fake_client, messages, sampling_params) for _ in range(CONCURRENT_REQUESTS)]
+    )
+    elapsed = time.process_time() - start
+    assert all(len(completion) == len(TOKEN_TEXT) * TOKENS_PER_RESPONSE for completion, _ in results)
+    return elapsed / (CONCURRENT_REQUESTS * TOKENS_PER_RESPONSE)
+
+
+def main():
+    streaming_wrapper = EngineWrapper(model="fake", api_key="fake", base_url="http://localhost:1/v1")
+    non_streaming_wrapper = EngineWrapper(model="fake", api_key="fake", base_url="http://localhost:1/v1", stream=False)
+    contenders = [
+        ("string concatenation (before)", old_stream_chat),
+        ("list + join (after)", streaming_wrapper._stream_chat),
+        ("non-streaming", non_streaming_wrapper._stream_chat),
+    ]
+    best = {name: float("inf") for name, _ in contenders}
+    for _ in range(REPEATS):  # taking turns, so warm-up and background noise don't all land on one contender
+        for name, stream_function in contenders:
+            best[name] = min(best[name], asyncio.run(run(stream_function)))
+    for name, per_token in best.items():
+        print(f"{name:32} {per_token * 1e6:8.3f} microseconds of event loop time per token")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import argparse
+
+from augmentoolkit.generation_functions.phrase_matcher import PhraseMatcher, filter_jsonl
+
+# Drops every line of a .jsonl dataset that contains one of the phrases in a phrase file (one per line, like original/banned_phrases.txt), reading and writing one line at a time so any size of file works.
+# Run from the repo root: python -m utils_for_manual_use.filter_jsonl_by_phrases original/banned_phrases.txt output/simplified_data_no_rag.jsonl filtered.jsonl
+# Leave out the output path to filter the file in place. --conversations-only checks only the non-system turns of ShareGPT-style {"conversations": [...]} lines, instead of every string in the line.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter a .jsonl file with a list of banned phrases")
+    parser.add_argument("phrases")
+    parser.add_argument("input")
+    parser.add_argument("output", nargs="?")
+    parser.add_argument("--conversations-only", action="store_true")
+    args = parser.parse_args()
+
+    matcher = PhraseMatcher.from_file(args.phrases)
+    kwargs = {}
+    if args.conversations_only:
+        kwargs["texts"] = lambda record: (turn["value"] for turn in record.get("conversations", []) if turn.get("from") != "system")
+    kept, dropped = filter_jsonl(args.input, args.output or args.input, matcher, **kwargs)
+    print(f"Checked {len(matcher)} phrases: kept {kept} lines, dropped {dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+import uuid
+
+from aiohttp import web
+
+from augmentoolkit.generation_functions.request_recorder import ReplayLog
+
+# A stand-in for an OpenAI-compatible API that answers with responses recorded by a previous run (RECORD_REQUESTS: True in a pipeline's config).
+# Point a pipeline's BASE_URL at it (http://localhost:8000/v1, any API key) to get a deterministic, offline, free end-to-end run; useful for benchmarking and regression testing.
+# Run from the repo root: python -m utils_for_manual_use.replay_server path/to/request_log.jsonl --latency 0.5 --tokens-per-second 50
+#
+# --latency is the wait before the first token, --tokens-per-second how fast the rest streams in (0 = instantly).
+# --recorded-latency waits as long as the real request took instead, so a replay takes about as long as the original run.
+# Requests that were never recorded get a 404 (never a real model's answer), are printed as they happen, and are counted in the stats printed on exit. --strict shuts the server down at the first one.
+# Prompts include random choices, so replay with the RANDOM_SEED the recorded run used (printed at start-up); see the RECORD_REQUESTS section of the README for what seeding can't cover.
+
+CHARACTERS_PER_TOKEN = 4  # same rough estimate as the rate limiter
+
+
+def split_into_tokens(text):
+    return [text[i : i + CHARACTERS_PER_TOKEN] for i in range(0, len(text), CHARACTERS_PER_TOKEN)]
+
+
+class ReplayServer:
+    def __init__(self, replay_log, latency=0.0, tokens_per_second=0.0, recorded_latency=False, strict=False):
+        self.replay_log = replay_log
+        self.strict = strict
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.recorded_latency = recorded_latency
+
+    def make_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)  # prompts can be long
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        return app
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": "replay", "object": "model", "owned_by": "replay"}]})
+
+    async def completions(self, request):
+        body = await request.json()
+        return await self.respond(request, body, "completion", body.get("prompt"))
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        return await self.respond(request, body, "chat", body.get("messages"))
+
+    async def respond(self, request, body, kind, prompt_or_messages):
+        found = self.replay_log.lookup(kind, prompt_or_messages)
+        if found is None:
+            preview = json.dumps(prompt_or_messages, ensure_ascii=False)[-200:]
+            print(f"REPLAY MISS #{self.replay_log.misses}: this {kind} request isn't in the recording, so the run has diverged from the recorded one. End of the request: {preview}")
+            if self.strict:
+                print("Stopping because of --strict")
+                asyncio.get_running_loop().call_later(0.5, os.kill, os.getpid(), signal.SIGINT)  # once this 404 has gone out; run_app shuts down cleanly on SIGINT
+            return web.json_response(
+                {
+                    "error": {
+                        "message": "This request is not in the recording. Is RANDOM_SEED set to the seed the recorded run used?",
+                        "type": "invalid_request_error",
+                        "code": "not_recorded",
+                    }
+                },
+                status=404,
+            )
+        output, recorded_latency = found
+        tokens = split_into_tokens(output)
+        model = body.get("model", "replay")
+        response_id = f"replay-{uuid.uuid4().hex}"
+
+        if self.recorded_latency:
+            first_token_wait = recorded_latency
+            seconds_per_token = 0.0
+        else:
+            first_token_wait = self.latency
+            seconds_per_token = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_wait + seconds_per_token * len(tokens))
+            return web.json_response(self.make_response(kind, response_id, model, output))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await asyncio.sleep(first_token_wait)
+        if kind == "chat":
+            await self.send_event(response, self.make_chunk(kind, response_id, model, None, role="assistant"))
+        # The client may hang up partway (early stopping, a hedged request that lost); that's fine, we just stop sending
+        try:
+            for token in tokens:
+                await self.send_event(response, self.make_chunk(kind, response_id, model, token))
+                if seconds_per_token:
+                    await asyncio.sleep(seconds_per_token)
+            await self.send_event(response, self.make_chunk(kind, response_id, model, None, finish_reason="stop"))
+            await response.write(b"data: [DONE]\n\n")
+        except ConnectionResetError:
+            pass
+        return response
+
+    @staticmethod
+    async def send_event(response, event):
+        await response.write(b"data: " + json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n\n")
+
+    @staticmethod
+    def make_response(kind, response_id, model, output):
+        if kind == "chat":
+            choice = {"index": 0, "message": {"role": "assistant", "content": output}, "finish_reason": "stop"}
+            object_type = "chat.completion"
+        else:
+            choice = {"index": 0, "text": output, "logprobs": None, "finish_reason": "stop"}
+            object_type = "text_completion"
+        return {"id": response_id, "object": object_type, "created": int(time.time()), "model": model, "choices": [choice]}
+
+    @staticmethod
+    def make_chunk(kind, response_id, model, text, role=None, finish_reason=None):
+        if kind == "chat":
+            delta = {}
+            if role:
+                delta["role"] = role
+            if text is not None:
+                delta["content"] = text
+            choice = {"index": 0, "delta": delta, "finish_reason": finish_reason}
+            object_type = "chat.completion.chunk"
+        else:
+            choice = {"index": 0, "text": text or "", "logprobs": None, "finish_reason": finish_reason}
+            object_type = "text_completion"
+        return {"id": response_id, "object": object_type, "created": int(time.time()), "model": model, "choices": [choice]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded pipeline responses over an OpenAI-compatible API")
+    parser.add_argument("recording", help="request_log.jsonl written by a run with RECORD_REQUESTS on")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before the first token of each response")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="streaming speed per request; 0 sends everything at once")
+    parser.add_argument("--recorded-latency", action="store_true", help="take as long as each request took when it was recorded")
+    parser.add_argument("--strict", action="store_true", help="shut down at the first request that isn't in the recording")
+    args = parser.parse_args()
+
+    replay_log = ReplayLog(args.recording)
+    print(f"Loaded {len(replay_log)} recorded responses from {args.recording}")
+    if replay_log.seeds:
+        print(f"Recorded with RANDOM_SEED {', '.join(str(seed) for seed in replay_log.seeds)}; set the same RANDOM_SEED in the config you replay with")
+    else:
+        print("This recording doesn't say what RANDOM_SEED it was made with, so expect replay misses wherever prompts include random choices")
+    server = ReplayServer(replay_log, args.latency, args.tokens_per_second, args.recorded_latency, args.strict)
+    try:
+        web.run_app(server.make_app(), host=args.host, port=args.port)
+    finally:
+        print(f"Replay stats: {replay_log.stats()}")
+
+
+if __name__ == "__main__":
+    main()